@@ -50,6 +50,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'myapp.middleware.RequestDeadlineMiddleware',
 ]
 
 ROOT_URLCONF = 'masteryapp.urls'
@@ -143,3 +144,52 @@ AUTHENTICATION_BACKENDS = [
 
 CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOW_ALL_ORIGINS = True
+
+# Upper bound (seconds) on how long a request may spend in generation calls.
+# Clients can ask for less with the X-Request-Timeout header.
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", 300))
+# Shortest deadline a client can ask for, so tiny timeouts cannot be used to fail calls on purpose
+REQUEST_TIMEOUT_MIN_SECONDS = float(os.environ.get("REQUEST_TIMEOUT_MIN_SECONDS", 5))
+
+# Optional daily cap on LLM tokens (prompt + output) per user. Quiz creation and material
+# ingestion are rejected with 429 once it is reached. Unset means no cap.
+LLM_USER_DAILY_TOKEN_BUDGET = int(os.environ["LLM_USER_DAILY_TOKEN_BUDGET"]) if os.environ.get("LLM_USER_DAILY_TOKEN_BUDGET") else None
+
+# Quizzes in "auto" generation mode put the selected snippets straight into the prompt when
+# they fit in this many tokens, and use retrieval from the course corpus otherwise.
+QUIZ_DIRECT_CONTEXT_TOKENS = int(os.environ.get("QUIZ_DIRECT_CONTEXT_TOKENS", 200000))
+
+# Snippets guaranteed to every subject of a quiz, as far as its length allows
+QUIZ_MIN_PER_SUBJECT = int(os.environ.get("QUIZ_MIN_PER_SUBJECT", 1))
+
+# Share of an "optimize learning" quiz given to snippets due for review (spaced repetition),
+# most overdue first. The rest is picked by mastery weighting, which brings in new snippets.
+QUIZ_DUE_SHARE = float(os.environ.get("QUIZ_DUE_SHARE", 0.75))
+
+# Local snippet embedding index (one file per course). The embedder is "hashing" (local,
+# offline) or "vertex" (Vertex AI text embeddings); changing it rebuilds indexes on next use.
+VECTOR_INDEX_DIR = os.environ.get("VECTOR_INDEX_DIR", str(BASE_DIR / "vector_indexes"))
+VECTOR_INDEX_EMBEDDER = os.environ.get("VECTOR_INDEX_EMBEDDER", "hashing")
+
+# Questions pre-generated per snippet after ingestion; quizzes are assembled from this bank
+# and only generate live for snippets whose bank is empty.
+QUESTION_BANK_SIZE = int(os.environ.get("QUESTION_BANK_SIZE", 3))
+
+# Each user's next quiz per course is pre-generated after a submit or when the course is opened,
+# and handed out by quiz creation. It is discarded after this many seconds, or once any subject
+# mastery moved by more than WARM_QUIZ_MASTERY_DRIFT (one fresh answer moves it by up to 1).
+WARM_QUIZ_MAX_AGE_SECONDS = int(os.environ.get("WARM_QUIZ_MAX_AGE_SECONDS", 6 * 3600))
+WARM_QUIZ_MASTERY_DRIFT = float(os.environ.get("WARM_QUIZ_MASTERY_DRIFT", 1.5))
+
+# Quiz creation and material upload accept an Idempotency-Key header. A retry with the same key
+# replays the stored response for IDEMPOTENCY_KEY_TTL_SECONDS, or waits up to
+# IDEMPOTENCY_WAIT_SECONDS for the original request if it is still running. A request holding a
+# key longer than IDEMPOTENCY_LOCK_SECONDS is considered dead and its key can be taken over.
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_KEY_TTL_SECONDS", 24 * 3600))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", 30))
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get("IDEMPOTENCY_LOCK_SECONDS", 600))
+
+# Wrong options offered per question from its subject's distractor pool. When a subject has enough
+# of them, generation only writes the stem and correct answer and picks its wrong options from
+# the pool. 0 disables the pool.
+DISTRACTOR_POOL_CANDIDATES = int(os.environ.get("DISTRACTOR_POOL_CANDIDATES", 12))
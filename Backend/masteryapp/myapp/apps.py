@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class MyappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'myapp'
+
+    def ready(self):
+        # Persist token usage of every generation call
+        from .gcp.request_context import add_usage_listener
+        from .services.usage import record_usage
+        add_usage_listener(record_usage)
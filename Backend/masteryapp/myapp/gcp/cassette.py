@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import base64
+import hashlib
+import logging
+import threading
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+# Set up logging
+logging.basicConfig(level=logging.INFO,
+                   format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Cassette modes, selected with GCP_CASSETTE_MODE
+OFF = "off"
+RECORD = "record"
+REPLAY = "replay"
+
+DEFAULT_CASSETTE_PATH = "cassettes/gcp.jsonl"
+
+
+class CassetteMiss(Exception):
+    """Raised in replay mode when no recorded call matches a request"""
+
+
+class RecordedError(Exception):
+    """Replays an exception raised by the original call while recording"""
+
+    def __init__(self, error_type: str, message: str):
+        super().__init__(f"{error_type}: {message}")
+        self.error_type = error_type
+
+
+class Cassette:
+    def __init__(self, path: str, mode: str = OFF, latency_factor: float = 0.0, strict: bool = True):
+        """Record calls to external services (Vertex, RAG, GCS, speech) and replay them offline
+
+        Every call is identified by its kind (e.g. "vertex.generate") and a JSON-serialisable
+        description of the request. In record mode the response and latency of each call are
+        appended to a JSONL file; in replay mode responses are served from that file, in the
+        order they were recorded when the same request was made several times.
+
+        Args:
+            path: Path of the JSONL cassette file
+            mode: One of "off", "record" or "replay"
+            latency_factor: In replay mode, sleep for the recorded latency times this factor (0 disables)
+            strict: In replay mode, raise CassetteMiss for unknown requests instead of serving
+                the next unused recording of the same kind
+        """
+        if mode not in (OFF, RECORD, REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_factor = latency_factor
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._by_kind: Dict[str, List[Dict[str, Any]]] = {}
+        self._served = set()
+
+        if mode == REPLAY:
+            self._load()
+        elif mode == RECORD:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(kind: str, request: Dict[str, Any]) -> str:
+        """Stable identifier of a request"""
+        payload = json.dumps([kind, request], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            raise FileNotFoundError(f"Cassette not found: {self.path}")
+        with open(self.path) as f:
+            for line_number, line in enumerate(f):
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                entry["_index"] = line_number
+                self._entries.setdefault(entry["key"], []).append(entry)
+                self._by_kind.setdefault(entry["kind"], []).append(entry)
+        logger.info(f"Loaded {sum(len(e) for e in self._entries.values())} recorded calls from {self.path}")
+
+    def _next_entry(self, kind: str, key: str) -> Dict[str, Any]:
+        with self._lock:
+            candidates = self._entries.get(key)
+            if not candidates and not self.strict:
+                candidates = self._by_kind.get(kind)
+            if not candidates:
+                raise CassetteMiss(f"No recorded {kind} call matches request {key[:12]}")
+            # Serve recordings in order; once they are used up keep serving the last one
+            for entry in candidates:
+                if entry["_index"] not in self._served:
+                    self._served.add(entry["_index"])
+                    return entry
+            return candidates[-1]
+
+    def _append(self, entry: Dict[str, Any]):
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+
+    def call(self, kind: str, request: Dict[str, Any], fn: Callable[[], Any],
+             encode: Optional[Callable[[Any], Any]] = None, decode: Optional[Callable[[Any], Any]] = None):
+        """Run fn, or serve its recorded response
+
+        Args:
+            kind: Kind of call, e.g. "vertex.generate" or "gcs.download"
+            request: JSON-serialisable description of the request, used to match recordings
+            fn: Zero-argument callable performing the real call
+            encode: Turns the real response into something JSON-serialisable (default: as is)
+            decode: Rebuilds a response from its recorded form (default: as is)
+
+        Returns:
+            The response of fn, or the decoded recorded response in replay mode
+        """
+        if self.mode == OFF:
+            return fn()
+
+        key = self.key(kind, request)
+        if self.mode == REPLAY:
+            entry = self._next_entry(kind, key)
+            if self.latency_factor:
+                time.sleep(entry.get("latency", 0.0) * self.latency_factor)
+            if "error" in entry:
+                raise RecordedError(entry.get("error_type", "Exception"), entry["error"])
+            response = entry.get("response")
+            return decode(response) if decode else response
+
+        start = time.monotonic()
+        entry = {"key": key, "kind": kind, "request": request}
+        try:
+            result = fn()
+        except Exception as e:
+            entry.update({"error": str(e), "error_type": type(e).__name__,
+                          "latency": time.monotonic() - start})
+            self._append(entry)
+            raise
+        entry["latency"] = time.monotonic() - start
+        entry["response"] = encode(result) if encode else result
+        self._append(entry)
+        return result
+
+
+def encode_bytes(data: Optional[bytes]) -> Optional[str]:
+    return base64.b64encode(data).decode("ascii") if data is not None else None
+
+
+def decode_bytes(data: Optional[str]) -> Optional[bytes]:
+    return base64.b64decode(data) if data is not None else None
+
+
+def sha256_bytes(data: bytes) -> str:
+    """Digest used to describe binary payloads (audio, files) in a request"""
+    return hashlib.sha256(data or b"").hexdigest()
+
+
+def to_namespace(data):
+    """Rebuild attribute access (e.g. corpus.name) over a recorded dict or list"""
+    if isinstance(data, dict):
+        return SimpleNamespace(**{key: to_namespace(value) for key, value in data.items()})
+    if isinstance(data, list):
+        return [to_namespace(value) for value in data]
+    return data
+
+
+_cassette: Optional[Cassette] = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette() -> Cassette:
+    """Return the process-wide cassette configured from the environment
+
+    GCP_CASSETTE_MODE: off (default), record or replay
+    GCP_CASSETTE_PATH: JSONL file to record to or replay from
+    GCP_CASSETTE_LATENCY: in replay, multiply recorded latencies by this factor and sleep (default 0)
+    GCP_CASSETTE_STRICT: in replay, set to 0 to serve recordings by kind when a request does not match
+    """
+    global _cassette
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = Cassette(
+                path=os.getenv("GCP_CASSETTE_PATH", DEFAULT_CASSETTE_PATH),
+                mode=os.getenv("GCP_CASSETTE_MODE", OFF).lower(),
+                latency_factor=float(os.getenv("GCP_CASSETTE_LATENCY", 0)),
+                strict=os.getenv("GCP_CASSETTE_STRICT", "1") not in ("0", "false", "False"),
+            )
+        return _cassette
+
+
+def is_replaying() -> bool:
+    """True when external calls are served from a cassette, so no client should be created"""
+    return get_cassette().mode == REPLAY
+
+
+def cassette_call(kind: str, request: Dict[str, Any], fn: Callable[[], Any],
+                  encode: Optional[Callable[[Any], Any]] = None, decode: Optional[Callable[[Any], Any]] = None):
+    """Shortcut for get_cassette().call(...)"""
+    return get_cassette().call(kind, request, fn, encode=encode, decode=decode)
@@ -0,0 +1,154 @@
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+# Set up logging
+logging.basicConfig(level=logging.INFO,
+                   format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit is open"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit {name} is open, retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, window: int = 20, min_calls: int = 5, failure_rate: float = 0.5,
+                 slow_call_seconds: float = 45.0, slow_call_rate: float = 0.8, open_seconds: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """Fail fast when a dependency keeps failing or responding slowly
+
+        The breaker looks at the last `window` calls. Once at least `min_calls` were made,
+        it opens when the share of failed calls reaches `failure_rate` or the share of calls
+        slower than `slow_call_seconds` reaches `slow_call_rate`. After `open_seconds` a single
+        probe call is let through (half open); its outcome closes or re-opens the circuit.
+        `clock` returns the current time in seconds (injectable for tests).
+        """
+        self.name = name
+        self.clock = clock
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+
+        self._calls = deque(maxlen=window)  # (failed, slow) per call
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def retry_after(self) -> float:
+        """Seconds until the circuit lets a probe call through, 0 if it is not open"""
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self.open_seconds - self.clock())
+
+    def allow(self):
+        """Raise CircuitOpenError if a call may not go through right now"""
+        with self._lock:
+            if self._state == OPEN:
+                if self.clock() - self._opened_at < self.open_seconds:
+                    raise CircuitOpenError(self.name, self._opened_at + self.open_seconds - self.clock())
+                self._state = HALF_OPEN
+                self._probe_in_flight = False
+
+            if self._state == HALF_OPEN:
+                if self._probe_in_flight:
+                    raise CircuitOpenError(self.name, self.open_seconds)
+                self._probe_in_flight = True
+
+    def record(self, success: bool, latency: float):
+        """Record the outcome of a call that allow() let through"""
+        slow = latency >= self.slow_call_seconds
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probe_in_flight = False
+                if success and not slow:
+                    logger.info(f"Circuit {self.name} closed after successful probe")
+                    self._state = CLOSED
+                    self._calls.clear()
+                else:
+                    self._open()
+                return
+
+            self._calls.append((not success, slow))
+            if self._state == CLOSED and len(self._calls) >= self.min_calls:
+                failures = sum(1 for failed, _ in self._calls if failed)
+                slow_calls = sum(1 for _, was_slow in self._calls if was_slow)
+                if (failures / len(self._calls) >= self.failure_rate
+                        or slow_calls / len(self._calls) >= self.slow_call_rate):
+                    self._open()
+
+    def release(self):
+        """Give back a call that allow() let through without recording an outcome
+
+        For calls cut short by the caller (e.g. its own deadline), which say nothing about the
+        dependency. A half-open probe is released so the next call can probe instead.
+        """
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probe_in_flight = False
+
+    def _open(self):
+        logger.warning(f"Circuit {self.name} opened for {self.open_seconds}s")
+        self._state = OPEN
+        self._opened_at = self.clock()
+
+    def call(self, fn, *args, **kwargs):
+        """Call fn through the breaker, recording its outcome and latency"""
+        self.allow()
+        start = self.clock()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.record(False, self.clock() - start)
+            raise
+        self.record(True, self.clock() - start)
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = len(self._calls)
+            return {
+                "state": self._state,
+                "calls": calls,
+                "failure_rate": sum(1 for failed, _ in self._calls if failed) / calls if calls else 0.0,
+                "slow_call_rate": sum(1 for _, slow in self._calls if slow) / calls if calls else 0.0,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str, **kwargs) -> CircuitBreaker:
+    """Return the process-wide breaker for a dependency, creating it on first use"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, **kwargs)
+        return _breakers[name]
+
+
+def breakers_snapshot() -> Dict[str, Dict[str, Any]]:
+    """Return the state of every breaker created so far"""
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {name: breaker.snapshot() for name, breaker in breakers.items()}
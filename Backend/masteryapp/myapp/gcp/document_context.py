@@ -0,0 +1,115 @@
+import os
+import hashlib
+import logging
+import datetime
+from typing import Dict, Iterable, Optional
+
+from vertexai.preview.generative_models import GenerativeModel
+from .cassette import is_replaying
+
+# Set up logging
+logging.basicConfig(level=logging.INFO,
+                   format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Vertex only caches contexts above a minimum size; smaller documents use the local prefix
+MIN_CACHE_TOKENS = int(os.getenv("DOCUMENT_CACHE_MIN_TOKENS", 4096))
+CACHE_TTL_SECONDS = int(os.getenv("DOCUMENT_CACHE_TTL_SECONDS", 1800))
+
+DOCUMENT_PREFIX = """You will be given several tasks about the following document, extracted from a PDF.
+Base every answer only on this document.
+
+Document:
+{text}
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token), good enough to decide on caching"""
+    return len(text) // 4
+
+
+class DocumentContext:
+    def __init__(self, text: str, model_names: Iterable[str] = (), use_cache: bool = True,
+                 ttl_seconds: int = CACHE_TTL_SECONDS):
+        """A document shared by several prompts, sent once and referenced by each instruction
+
+        Inside a `with` block the document is registered as a Vertex cached context for each of
+        the given models (when it is large enough and caching is available). Calls made through
+        the router with `document=` then only send their short instruction. Models without a
+        cache (fallbacks, small documents, replay) get the same document prefix inlined ahead of
+        the instruction, so the prompt is identical either way. The caches are deleted when the
+        block exits.
+
+        Args:
+            text: The document text
+            model_names: Models the document will be sent to, one cache is created per model
+            use_cache: Set to False to always inline the document
+            ttl_seconds: Server-side expiry of the caches, in case the block never exits
+        """
+        self.text = text
+        self.prefix = DOCUMENT_PREFIX.format(text=text)
+        self.fingerprint = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        self.model_names = list(dict.fromkeys(model_names))
+        self.use_cache = use_cache
+        self.ttl_seconds = ttl_seconds
+        self._caches = {}
+        self._cached_models: Dict[str, GenerativeModel] = {}
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    @property
+    def cached(self) -> bool:
+        return bool(self._cached_models)
+
+    def open(self):
+        """Create the model-side caches, falling back to the inlined prefix when that is not possible"""
+        if not self.use_cache or is_replaying():
+            return
+        if estimate_tokens(self.prefix) < MIN_CACHE_TOKENS:
+            logger.info(f"Document too small to cache ({estimate_tokens(self.prefix)} tokens), inlining it")
+            return
+
+        try:
+            from vertexai.preview import caching
+        except ImportError:
+            logger.info("Context caching not available, inlining the document")
+            return
+
+        for model_name in self.model_names:
+            try:
+                cache = caching.CachedContent.create(
+                    model_name=model_name,
+                    contents=[self.prefix],
+                    ttl=datetime.timedelta(seconds=self.ttl_seconds),
+                    display_name=f"document-{self.fingerprint[:12]}",
+                )
+                self._caches[model_name] = cache
+                self._cached_models[model_name] = GenerativeModel.from_cached_content(cached_content=cache)
+                logger.info(f"Cached document {self.fingerprint[:12]} for {model_name}")
+            except Exception as e:
+                logger.warning(f"Could not cache document for {model_name}, inlining it: {str(e)}")
+
+    def close(self):
+        """Delete the model-side caches"""
+        for model_name, cache in self._caches.items():
+            try:
+                cache.delete()
+            except Exception as e:
+                logger.warning(f"Could not delete cached document for {model_name}: {str(e)}")
+        self._caches = {}
+        self._cached_models = {}
+
+    def cached_model(self, model_name: str) -> Optional[GenerativeModel]:
+        """Model bound to the cached document, or None if the document is not cached for it"""
+        return self._cached_models.get(model_name)
+
+    def inline(self, instruction: str) -> str:
+        """Full prompt for models without a cache: document prefix followed by the instruction"""
+        return self.prefix + "\n" + instruction
@@ -5,6 +5,7 @@ import logging
 from typing import Dict, Any, Optional
 from google.cloud import storage
 from google.cloud.exceptions import NotFound, Forbidden
+from .cassette import cassette_call, encode_bytes, decode_bytes
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, 
@@ -47,7 +48,8 @@ def validate_credentials(credentials_path: Optional[str] = None) -> bool:
             logger.warning(f"Credentials file not found: {credentials_path}, will try ADC")
         
         # Test creating a client
-        client = get_storage_client(credentials_path)
+        cassette_call("gcs.validate_credentials", {},
+                      lambda: get_storage_client(credentials_path) is not None)
         return True
     except Exception as e:
         logger.error(f"Failed to initialize credentials: {str(e)}")
@@ -57,8 +59,8 @@ def validate_credentials(credentials_path: Optional[str] = None) -> bool:
 def check_bucket_exists(bucket_name: str, credentials_path: Optional[str] = None) -> bool:
     """Check if the GCS bucket exists and is accessible"""
     try:
-        storage_client = get_storage_client(credentials_path)
-        bucket = storage_client.get_bucket(bucket_name)
+        cassette_call("gcs.get_bucket", {"bucket": bucket_name},
+                      lambda: get_storage_client(credentials_path).get_bucket(bucket_name) is not None)
         return True
     except NotFound:
         logger.error(f"Bucket not found: {bucket_name}")
@@ -103,12 +105,15 @@ def upload_pdf_to_gcs(file_obj, bucket_name: str, user_id: str, course_id: str,
             return False
         
         # Upload file
-        storage_client = get_storage_client(credentials_path)
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(f"{user_id}/{course_id}/{file_name}")
+        blob_name = f"{user_id}/{course_id}/{file_name}"
         
-        # Upload from file object
-        blob.upload_from_file(file_obj)
+        def upload():
+            storage_client = get_storage_client(credentials_path)
+            blob = storage_client.bucket(bucket_name).blob(blob_name)
+            # Upload from file object
+            blob.upload_from_file(file_obj)
+        
+        cassette_call("gcs.upload", {"bucket": bucket_name, "blob": blob_name}, upload)
         logger.info(f"PDF uploaded to gs://{bucket_name}/{user_id}/{course_id}/{file_name}")
         return True
     
@@ -136,18 +141,24 @@ def get_pdf_bytes_from_gcs(bucket_name: str, user_id: str, course_id: str, file_
         bytes: The file content as bytes
     """
     try:
-        storage_client = get_storage_client(credentials_path)
-        bucket = storage_client.bucket(bucket_name)
         base_file_name = file_name.split('.')[0]  # Get everything before the first period
         
-        # Attempt to get the highlighted PDF first
-        highlighted_blob = bucket.blob(f"{user_id}/{course_id}/{base_file_name}_highlighted.pdf")
-        if highlighted_blob.exists():
-            return highlighted_blob.download_as_bytes()
+        def download():
+            storage_client = get_storage_client(credentials_path)
+            bucket = storage_client.bucket(bucket_name)
+            
+            # Attempt to get the highlighted PDF first
+            highlighted_blob = bucket.blob(f"{user_id}/{course_id}/{base_file_name}_highlighted.pdf")
+            if highlighted_blob.exists():
+                return highlighted_blob.download_as_bytes()
+            
+            # If highlighted PDF does not exist, get the regular PDF
+            regular_blob = bucket.blob(f"{user_id}/{course_id}/{file_name}")
+            return regular_blob.download_as_bytes()
         
-        # If highlighted PDF does not exist, get the regular PDF
-        regular_blob = bucket.blob(f"{user_id}/{course_id}/{file_name}")
-        return regular_blob.download_as_bytes()
+        return cassette_call("gcs.download_preferring_highlighted",
+                             {"bucket": bucket_name, "blob": f"{user_id}/{course_id}/{file_name}"},
+                             download, encode=encode_bytes, decode=decode_bytes)
     except Exception as e:
         logger.error(f"Error getting PDF bytes from GCS: {str(e)}")
         raise
@@ -161,11 +172,15 @@ def check_user_folder_exists(bucket_name: str, user_id: str, course_id: str,
             logger.error("User ID must be provided")
             return False
             
-        storage_client = get_storage_client(credentials_path)
-        bucket = storage_client.bucket(bucket_name)
-        # Check if any blobs exist with the user_id prefix
-        blobs = list(bucket.list_blobs(prefix=f"{user_id}/{course_id}/", max_results=1))
-        return len(blobs) > 0
+        def folder_exists():
+            storage_client = get_storage_client(credentials_path)
+            bucket = storage_client.bucket(bucket_name)
+            # Check if any blobs exist with the user_id prefix
+            blobs = list(bucket.list_blobs(prefix=f"{user_id}/{course_id}/", max_results=1))
+            return len(blobs) > 0
+        
+        return cassette_call("gcs.folder_exists", {"bucket": bucket_name, "prefix": f"{user_id}/{course_id}/"},
+                             folder_exists)
     
     except Exception as e:
         logger.error(f"Error checking if user folder exists: {str(e)}")
@@ -185,11 +200,14 @@ def create_user_folder_in_gcs(bucket_name: str, user_id: str, course_id: str,
             logger.error("User ID must be provided")
             return False
             
-        storage_client = get_storage_client(credentials_path)
-        bucket = storage_client.bucket(bucket_name)
-        # Create an empty placeholder object to represent the folder
-        blob = bucket.blob(f"{user_id}/{course_id}/")
-        blob.upload_from_string('')
+        def create_folder():
+            storage_client = get_storage_client(credentials_path)
+            bucket = storage_client.bucket(bucket_name)
+            # Create an empty placeholder object to represent the folder
+            blob = bucket.blob(f"{user_id}/{course_id}/")
+            blob.upload_from_string('')
+        
+        cassette_call("gcs.upload", {"bucket": bucket_name, "blob": f"{user_id}/{course_id}/"}, create_folder)
         logger.info(f"User folder created in gs://{bucket_name}/{user_id}/{course_id}/")
         return True
     
@@ -218,13 +236,15 @@ def download_file_from_gcs(bucket_name: str, user_id: str, course_id: str, file_
         io.BytesIO: File contents as a BytesIO object
     """
     try:
-        storage_client = get_storage_client(credentials_path)
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(f"{user_id}/{course_id}/{file_name}")
+        blob_name = f"{user_id}/{course_id}/{file_name}"
+        
+        def download():
+            storage_client = get_storage_client(credentials_path)
+            blob = storage_client.bucket(bucket_name).blob(blob_name)
+            return blob.download_as_bytes()
         
-        file_bytes = io.BytesIO()
-        blob.download_to_file(file_bytes)
-        file_bytes.seek(0)  # Reset pointer to beginning of file
+        file_bytes = io.BytesIO(cassette_call("gcs.download", {"bucket": bucket_name, "blob": blob_name},
+                                              download, encode=encode_bytes, decode=decode_bytes))
         
         logger.info(f"Downloaded {file_name} from bucket {bucket_name}")
         return file_bytes
@@ -247,13 +267,15 @@ def get_json_data_from_gcs(bucket_name: str, user_id: str, course_id: str, file_
         Dict[str, Any]: Parsed JSON data
     """
     try:
-        storage_client = get_storage_client(credentials_path)
-        bucket = storage_client.bucket(bucket_name)
         file_blob_name = f"{user_id}/{course_id}/{file_name}"
         json_blob_name = file_blob_name.rsplit('.', 1)[0] + '.json'
-        blob = bucket.blob(json_blob_name)
         
-        json_data = json.loads(blob.download_as_text())
+        def download():
+            storage_client = get_storage_client(credentials_path)
+            return storage_client.bucket(bucket_name).blob(json_blob_name).download_as_text()
+        
+        json_data = json.loads(cassette_call("gcs.download_text", {"bucket": bucket_name, "blob": json_blob_name},
+                                             download))
         logger.info(f"Downloaded and parsed JSON from {bucket_name}/{json_blob_name}")
         return json_data
     except Exception as e:
@@ -0,0 +1,536 @@
+import os
+import json
+import time
+import contextvars
+import logging
+import threading
+from collections import deque
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
+from typing import Any, Dict, List, Optional
+
+from vertexai.preview.generative_models import GenerativeModel, Tool
+from .request_context import DeadlineExceeded, remaining_time, emit_usage
+from .circuit_breaker import CircuitOpenError, get_breaker
+from .cassette import cassette_call
+
+# Set up logging
+logging.basicConfig(level=logging.INFO,
+                   format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Pipeline tasks that go through the router
+CLEANUP = "cleanup"
+SUBJECT_EXTRACTION = "subject_extraction"
+PARTITION = "partition"
+QUIZ_GENERATION = "quiz_generation"
+COMMAND_PARSING = "command_parsing"
+
+# Default routing table. Cheap tasks (cleanup, command parsing) run on the lite model
+# and fall back to the regular flash model; everything can be overridden through
+# MODEL_ROUTES (inline JSON) or MODEL_ROUTES_FILE (path to a JSON file).
+#
+# A route may define "hedge": once a call has been running longer than the given
+# latency percentile of the task, a duplicate request is fired and the first answer
+# wins. "max_rate" caps the share of calls that may be hedged.
+#
+# "max_concurrency" caps the calls of a task in flight across the process; further
+# callers wait for a slot (never past their request deadline).
+DEFAULT_ROUTES: Dict[str, Dict[str, Any]] = {
+    CLEANUP: {
+        "model": "gemini-2.0-flash-lite-001",
+        "fallbacks": ["gemini-2.0-flash-001"],
+        "generation_config": {"temperature": 0.0},
+        "timeout": 120,
+    },
+    SUBJECT_EXTRACTION: {
+        "model": "gemini-2.0-flash-001",
+        "fallbacks": ["gemini-1.5-flash-002"],
+        "generation_config": {"temperature": 0.2},
+        "timeout": 60,
+    },
+    PARTITION: {
+        "model": "gemini-2.0-flash-001",
+        "fallbacks": ["gemini-1.5-flash-002"],
+        "generation_config": {
+            "temperature": 0.1,
+            "top_p": 0.8,
+            "top_k": 40,
+            "max_output_tokens": 8192
+        },
+        "timeout": 120,
+    },
+    QUIZ_GENERATION: {
+        "model": "gemini-2.0-flash-001",
+        "fallbacks": ["gemini-1.5-flash-002"],
+        "generation_config": {},
+        "timeout": 120,
+        "max_concurrency": 8,
+        "hedge": {
+            "percentile": 95,
+            "max_rate": 0.1,
+            "min_samples": 20,
+            "delay": 30,
+        },
+    },
+    COMMAND_PARSING: {
+        "model": "gemini-2.0-flash-lite-001",
+        "fallbacks": ["gemini-1.5-flash-002"],
+        "generation_config": {"temperature": 0.0, "max_output_tokens": 256},
+        "timeout": 15,
+    },
+}
+
+# Number of recent latencies kept per task for percentile reporting
+LATENCY_WINDOW = 500
+
+
+class GenerationError(Exception):
+    """Raised when every model routed for a task failed"""
+
+
+def load_routes() -> Dict[str, Dict[str, Any]]:
+    """Build the routing table from the defaults and any environment overrides
+
+    Overrides are merged per task, so a file only needs to list the keys it changes, e.g.
+    {"cleanup": {"model": "gemini-2.0-flash-001", "timeout": 30}}
+
+    Returns:
+        Dict mapping task name to its route (model, fallbacks, generation_config, timeout)
+    """
+    routes = {task: dict(route) for task, route in DEFAULT_ROUTES.items()}
+
+    overrides = {}
+    routes_file = os.getenv("MODEL_ROUTES_FILE")
+    if routes_file:
+        try:
+            with open(routes_file) as f:
+                overrides.update(json.load(f))
+        except Exception as e:
+            logger.error(f"Could not read model routes from {routes_file}: {str(e)}")
+
+    routes_json = os.getenv("MODEL_ROUTES")
+    if routes_json:
+        try:
+            overrides.update(json.loads(routes_json))
+        except json.JSONDecodeError as e:
+            logger.error(f"MODEL_ROUTES is not valid JSON: {str(e)}")
+
+    for task, route in overrides.items():
+        merged = dict(routes.get(task, {}))
+        merged.update(route)
+        routes[task] = merged
+
+    return routes
+
+
+class ModelRouter:
+    def __init__(self, routes: Optional[Dict[str, Dict[str, Any]]] = None, max_workers: int = 16):
+        """Route generation calls per pipeline task, with fallbacks and per-task metrics"""
+        self.routes = routes if routes is not None else load_routes()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        # One slot per worker, held by each request sent until it finishes. Requests the caller
+        # stopped waiting for (timed out calls, losing hedge legs) keep running, so without the
+        # slots they could pile up in the executor queue ahead of live calls
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._models: Dict[str, GenerativeModel] = {}
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Dict[str, Any]] = {}
+        self._limits: Dict[str, threading.BoundedSemaphore] = {}
+
+    def get_route(self, task: str) -> Dict[str, Any]:
+        """Return the route for a task, raising KeyError for unknown tasks"""
+        if task not in self.routes:
+            raise KeyError(f"No model route configured for task: {task}")
+        return self.routes[task]
+
+    def _limit(self, task: str) -> Optional[threading.BoundedSemaphore]:
+        """Semaphore bounding the concurrent calls of a task, None if its route sets no limit"""
+        max_concurrency = self.get_route(task).get("max_concurrency")
+        if not max_concurrency:
+            return None
+        with self._lock:
+            return self._limits.setdefault(task, threading.BoundedSemaphore(max_concurrency))
+
+    def reload(self):
+        """Re-read the routing table from the environment"""
+        self.routes = load_routes()
+        with self._lock:
+            self._limits = {}
+
+    def _get_model(self, model_name: str, tools: Optional[List[Tool]] = None) -> GenerativeModel:
+        # Tool-bound models (e.g. RAG retrieval) are per call; plain models are reused
+        if tools:
+            return GenerativeModel(model_name=model_name, tools=tools)
+        with self._lock:
+            if model_name not in self._models:
+                self._models[model_name] = GenerativeModel(model_name=model_name)
+            return self._models[model_name]
+
+    def _task_metrics(self, task: str) -> Dict[str, Any]:
+        if task not in self._metrics:
+            self._metrics[task] = {
+                "calls": 0,
+                "errors": 0,
+                "timeouts": 0,
+                "fallbacks": 0,
+                "prompt_tokens": 0,
+                "output_tokens": 0,
+                "cached_tokens": 0,
+                "hedges": 0,
+                "hedge_wins": 0,
+                "hedge_saved_seconds": 0.0,
+                "models": {},
+                "latencies": deque(maxlen=LATENCY_WINDOW),
+            }
+        return self._metrics[task]
+
+    def _record(self, task: str, model_name: str, latency: float, response=None,
+                error: bool = False, timeout: bool = False, fallback: bool = False):
+        usage = getattr(response, "usage_metadata", None)
+        emit_usage({
+            "call_site": task,
+            "model": model_name,
+            "prompt_tokens": (getattr(usage, "prompt_token_count", 0) or 0) if usage is not None else 0,
+            "output_tokens": (getattr(usage, "candidates_token_count", 0) or 0) if usage is not None else 0,
+            "latency_ms": int(latency * 1000),
+            "success": not (error or timeout),
+        })
+        with self._lock:
+            metrics = self._task_metrics(task)
+            metrics["calls"] += 1
+            metrics["models"][model_name] = metrics["models"].get(model_name, 0) + 1
+            if fallback:
+                metrics["fallbacks"] += 1
+            if timeout:
+                metrics["timeouts"] += 1
+            if error or timeout:
+                metrics["errors"] += 1
+                return
+            metrics["latencies"].append(latency)
+            if usage is not None:
+                metrics["prompt_tokens"] += getattr(usage, "prompt_token_count", 0) or 0
+                metrics["output_tokens"] += getattr(usage, "candidates_token_count", 0) or 0
+                metrics["cached_tokens"] += getattr(usage, "cached_content_token_count", 0) or 0
+
+    def _hedge_delay(self, task: str, hedge: Dict[str, Any]) -> Optional[float]:
+        """Seconds to wait before hedging, or None if the hedge budget is spent"""
+        with self._lock:
+            metrics = self._task_metrics(task)
+            # Budget cap: hedged calls may not exceed max_rate of all calls
+            if metrics["hedges"] + 1 > hedge.get("max_rate", 0.1) * (metrics["calls"] + 1):
+                return None
+            latencies = sorted(metrics["latencies"])
+        if len(latencies) >= hedge.get("min_samples", 20):
+            return _percentile(latencies, hedge.get("percentile", 95))
+        return hedge.get("delay")
+
+    def _record_hedge(self, task: str, won: bool = False):
+        with self._lock:
+            metrics = self._task_metrics(task)
+            if won:
+                metrics["hedge_wins"] += 1
+            else:
+                metrics["hedges"] += 1
+
+    def _record_hedge_saving(self, task: str, saved: float):
+        with self._lock:
+            self._task_metrics(task)["hedge_saved_seconds"] += max(0.0, saved)
+
+    def _generate_content(self, model_name: str, contents, config: Dict[str, Any],
+                          tools: Optional[List[Tool]] = None, document=None):
+        """Single generate_content call, recorded or replayed when a cassette is active"""
+        # Recordings are keyed on the logical prompt, whether or not the document was cached
+        request = {
+            "model": model_name,
+            "contents": _describe(contents),
+            "generation_config": config,
+            "tools": _describe(tools or []),
+        }
+        if document is not None:
+            request["document"] = document.fingerprint
+
+        def send():
+            cached_model = document.cached_model(model_name) if document is not None and not tools else None
+            if cached_model is not None:
+                return cached_model.generate_content(contents, generation_config=config or None)
+            prompt = document.inline(contents) if document is not None else contents
+            return self._get_model(model_name, tools).generate_content(prompt, generation_config=config or None)
+
+        return cassette_call("vertex.generate", request, send,
+                             encode=_encode_response, decode=ReplayedResponse)
+
+    def _send(self, send, timeout: Optional[float] = None):
+        """Submit a request once a worker slot frees up, or return None if none does within timeout
+
+        The slot is released when the request finishes, whether or not anyone still waits for it.
+        """
+        if not self._slots.acquire(timeout=timeout if timeout is not None else -1):
+            return None
+        future = self._executor.submit(send)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _record_leg_usage(self, task: str, model_name: str, context, start: float, future):
+        """Emit the usage of a request whose response was not used (losing hedge leg, timed out call)
+
+        The tokens are billed all the same, so budgets count them. Runs in the executor thread,
+        inside the context of the request that sent it.
+        """
+        response = None if future.cancelled() or future.exception() is not None else future.result()
+        usage = getattr(response, "usage_metadata", None)
+        context.run(emit_usage, {
+            "call_site": task,
+            "model": model_name,
+            "prompt_tokens": (getattr(usage, "prompt_token_count", 0) or 0) if usage is not None else 0,
+            "output_tokens": (getattr(usage, "candidates_token_count", 0) or 0) if usage is not None else 0,
+            "latency_ms": int((time.monotonic() - start) * 1000),
+            "success": response is not None,
+        })
+
+    def _call(self, task: str, model_name: str, send, timeout: Optional[float], hedge: Optional[Dict[str, Any]]):
+        """Run one generation call, hedging it with a duplicate request if it is slow
+
+        Only the response returned is recorded by the caller; every other request sent (the
+        losing hedge leg, or all of them on timeout) emits its own usage once it finishes.
+        Waiting for a worker slot counts against the timeout, and no hedge is sent while every
+        slot is taken.
+        """
+        start = time.monotonic()
+        context = contextvars.copy_context()
+        primary = self._send(send, timeout)
+        if primary is None:
+            raise FutureTimeoutError()
+        futures = [primary]
+
+        def account_others(used=None):
+            for future in futures:
+                if future is not used:
+                    future.add_done_callback(
+                        lambda future: self._record_leg_usage(task, model_name, context, start, future))
+
+        delay = self._hedge_delay(task, hedge) if hedge else None
+        if delay is not None and (timeout is None or delay < timeout):
+            done, _ = wait([primary], timeout=delay)
+            if not done:
+                hedge_leg = self._send(send, timeout=0)
+                if hedge_leg is not None:
+                    futures.append(hedge_leg)
+                    self._record_hedge(task)
+                else:
+                    logger.info(f"Not hedging task {task}: every worker is busy")
+
+        pending = set(futures)
+        last_error = None
+        while pending:
+            wait_for = None if timeout is None else max(0.0, timeout - (time.monotonic() - start))
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            if not done:
+                account_others()
+                raise FutureTimeoutError()
+            for future in done:
+                if future.exception() is not None:
+                    last_error = future.exception()
+                    continue
+
+                if future is not primary:
+                    # The hedge won: once the primary finishes we know how much time was saved
+                    self._record_hedge(task, won=True)
+                    latency = time.monotonic() - start
+                    primary.add_done_callback(
+                        lambda _, latency=latency: self._record_hedge_saving(
+                            task, time.monotonic() - start - latency))
+                    logger.info(f"Hedged request won for task {task} after {latency:.2f}s")
+                account_others(used=future)
+                return future.result()
+        raise last_error
+
+    def generate(self, task: str, contents, tools: Optional[List[Tool]] = None,
+                 generation_config: Optional[Dict[str, Any]] = None, document=None):
+        """Generate content for a pipeline task using its routed model
+
+        The call is bounded by both the route's timeout and the deadline of the request
+        being served (see request_context). Each model sits behind its own circuit breaker;
+        models whose circuit is open are skipped, and CircuitOpenError is raised when all are.
+        Tasks whose route sets max_concurrency first wait for a free slot.
+
+        Args:
+            task: Pipeline task name (see the constants at the top of this module)
+            contents: Prompt or list of contents passed to generate_content
+            tools: Optional tools (e.g. RAG retrieval) bound to the model for this call
+            generation_config: Optional overrides merged over the route's generation config
+            document: Optional DocumentContext the instruction in `contents` refers to; its cached
+                context is used when it exists for the model, otherwise it is inlined in the prompt
+
+        Returns:
+            The model response of the first model that succeeded
+        """
+        limit = self._limit(task)
+        if limit is None:
+            return self._generate_routed(task, contents, tools, generation_config, document)
+
+        remaining = remaining_time()
+        if not limit.acquire(timeout=max(0.0, remaining) if remaining is not None else None):
+            raise DeadlineExceeded(f"Request deadline exceeded waiting for a {task} slot")
+        try:
+            return self._generate_routed(task, contents, tools, generation_config, document)
+        finally:
+            limit.release()
+
+    def _generate_routed(self, task: str, contents, tools: Optional[List[Tool]],
+                         generation_config: Optional[Dict[str, Any]], document):
+        """Try the routed model then its fallbacks (see generate)"""
+        route = self.get_route(task)
+        model_names = [route["model"]] + list(route.get("fallbacks", []))
+        config = dict(route.get("generation_config") or {})
+        config.update(generation_config or {})
+
+        last_error = None
+        open_circuits = []
+        for attempt, model_name in enumerate(model_names):
+            fallback = attempt > 0
+            if fallback:
+                logger.warning(f"Falling back to {model_name} for task {task}: {last_error}")
+
+            # Never wait past the request's deadline
+            timeout = route.get("timeout")
+            remaining = remaining_time()
+            bounded_by_deadline = remaining is not None and (timeout is None or remaining < timeout)
+            if bounded_by_deadline:
+                if remaining <= 0:
+                    raise DeadlineExceeded(f"Request deadline exceeded before {task} call") from last_error
+                timeout = remaining
+
+            breaker = get_breaker(f"vertex:{model_name}")
+            try:
+                breaker.allow()
+            except CircuitOpenError as e:
+                open_circuits.append(e)
+                last_error = e
+                continue
+
+            send = lambda model_name=model_name: self._generate_content(model_name, contents, config, tools, document)
+            start = time.monotonic()
+            try:
+                response = self._call(task, model_name, send, timeout, route.get("hedge"))
+            except FutureTimeoutError:
+                latency = time.monotonic() - start
+                self._record(task, model_name, latency, timeout=True, fallback=fallback)
+                if bounded_by_deadline:
+                    # The caller ran out of time, which says nothing about the model
+                    breaker.release()
+                    raise DeadlineExceeded(f"Request deadline exceeded during {task} call")
+                breaker.record(False, latency)
+                last_error = TimeoutError(f"{model_name} timed out after {timeout}s")
+                continue
+            except Exception as e:
+                latency = time.monotonic() - start
+                breaker.record(False, latency)
+                last_error = e
+                self._record(task, model_name, latency, error=True, fallback=fallback)
+                continue
+
+            latency = time.monotonic() - start
+            breaker.record(True, latency)
+            self._record(task, model_name, latency, response=response, fallback=fallback)
+            return response
+
+        if len(open_circuits) == len(model_names):
+            retry_after = min(e.retry_after for e in open_circuits)
+            raise CircuitOpenError(f"vertex:{task}", retry_after)
+        raise GenerationError(f"All models failed for task {task}: {last_error}") from last_error
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Return a snapshot of per-task call counts, token totals and latency percentiles"""
+        with self._lock:
+            snapshot = {}
+            for task, metrics in self._metrics.items():
+                latencies = sorted(metrics["latencies"])
+                snapshot[task] = {
+                    key: value for key, value in metrics.items() if key not in ("latencies", "models")
+                }
+                snapshot[task]["models"] = dict(metrics["models"])
+                snapshot[task]["latency_p50"] = _percentile(latencies, 50)
+                snapshot[task]["latency_p95"] = _percentile(latencies, 95)
+                snapshot[task]["latency_p99"] = _percentile(latencies, 99)
+                snapshot[task]["hedge_rate"] = metrics["hedges"] / metrics["calls"] if metrics["calls"] else 0.0
+            return snapshot
+
+
+class ReplayedResponse:
+    """Stand-in for a generate_content response served from a cassette"""
+
+    def __init__(self, recorded: Dict[str, Any]):
+        self._text = recorded.get("text")
+        usage = recorded.get("usage") or {}
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=usage.get("prompt_token_count", 0),
+            candidates_token_count=usage.get("candidates_token_count", 0),
+            total_token_count=usage.get("total_token_count", 0),
+            cached_content_token_count=usage.get("cached_content_token_count", 0),
+        )
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            raise ValueError("Recorded response has no text")
+        return self._text
+
+
+def _encode_response(response) -> Dict[str, Any]:
+    try:
+        text = response.text
+    except Exception:
+        # Blocked or empty responses raise on .text; replay raises the same way
+        text = None
+    usage = getattr(response, "usage_metadata", None)
+    return {
+        "text": text,
+        "usage": {
+            name: getattr(usage, name, 0) or 0
+            for name in ("prompt_token_count", "candidates_token_count", "total_token_count",
+                         "cached_content_token_count")
+        } if usage is not None else None,
+    }
+
+
+def _describe(value):
+    """JSON-friendly description of prompt contents or tools, used to match recorded calls"""
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_describe(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _describe(item) for key, item in value.items()}
+    to_dict = getattr(value, "to_dict", None)
+    if callable(to_dict):
+        try:
+            return to_dict()
+        except Exception:
+            pass
+    return str(value)
+
+
+def _percentile(sorted_values: List[float], percentile: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(percentile / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+_router: Optional[ModelRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> ModelRouter:
+    """Return the process-wide model router"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
+
+
+def generate(task: str, contents, **kwargs):
+    """Shortcut for get_router().generate(...)"""
+    return get_router().generate(task, contents, **kwargs)
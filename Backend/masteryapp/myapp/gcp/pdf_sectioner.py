@@ -14,6 +14,10 @@ import PyPDF2
 import requests
 from pathlib import Path
 import base64
+from .model_router import get_router, CLEANUP, SUBJECT_EXTRACTION, PARTITION
+from .circuit_breaker import CircuitOpenError
+from .document_context import DocumentContext
+from .cassette import cassette_call, is_replaying, encode_bytes, decode_bytes
 
 class PDFProcessor:
     def __init__(self, credentials_path: Optional[str] = None, debug: bool = False):
@@ -32,9 +36,11 @@ class PDFProcessor:
         # Initialize GCP services
         vertexai.init(project=self.project_id, location=self.location)
         
-        # Initialize storage client
+        # Initialize storage client (not needed when GCS calls are replayed from a cassette)
         try:
-            if credentials_path and os.path.exists(credentials_path):
+            if is_replaying():
+                self.storage_client = None
+            elif credentials_path and os.path.exists(credentials_path):
                 if self.debug:
                     print(f"Using service account credentials from: {credentials_path}")
                 self.storage_client = storage.Client.from_service_account_json(credentials_path)
@@ -50,8 +56,8 @@ class PDFProcessor:
             self.storage_client = None
             raise
         
-        # Initialize the generative model for subject extraction
-        self.model = GenerativeModel(model_name="gemini-1.5-flash-002")
+        # Generation calls are routed per task (cleanup, subject extraction, partition)
+        self.router = get_router()
 
     def get_pdf_from_bucket(self, bucket_name: str, user_id: str, course_id: str, file_name: str) -> Optional[io.BytesIO]:
         """Get a PDF from GCS bucket as a BytesIO object without downloading to disk
@@ -69,13 +75,13 @@ class PDFProcessor:
             # Construct the full blob path
             blob_path = f"{user_id}/{course_id}/{file_name}"
             
-            bucket = self.storage_client.bucket(bucket_name)
-            blob = bucket.blob(blob_path)
+            def download():
+                blob = self.storage_client.bucket(bucket_name).blob(blob_path)
+                return blob.download_as_bytes()
             
             # Download blob to memory
-            pdf_bytes = io.BytesIO()
-            blob.download_to_file(pdf_bytes)
-            pdf_bytes.seek(0)  # Reset pointer to beginning of file
+            pdf_bytes = io.BytesIO(cassette_call("gcs.download", {"bucket": bucket_name, "blob": blob_path},
+                                                 download, encode=encode_bytes, decode=decode_bytes))
             
             if self.debug:
                 print(f"Downloaded {blob_path} to memory")
@@ -103,14 +109,15 @@ class PDFProcessor:
             json_file_name = file_name.rsplit('.', 1)[0] + '.json'
             json_blob_path = f"{user_id}/{course_id}/{json_file_name}"
             
-            bucket = self.storage_client.bucket(bucket_name)
-            blob = bucket.blob(json_blob_path)
-            
             # Convert dict to JSON string and encode as bytes
             json_bytes = json.dumps(data, indent=2).encode('utf-8')
             
             # Upload to GCS
-            blob.upload_from_string(json_bytes, content_type='application/json')
+            cassette_call(
+                "gcs.upload", {"bucket": bucket_name, "blob": json_blob_path},
+                lambda: self.storage_client.bucket(bucket_name).blob(json_blob_path).upload_from_string(
+                    json_bytes, content_type='application/json')
+            )
             
             if self.debug:
                 print(f"Uploaded results to {bucket_name}/{json_blob_path}")
@@ -199,7 +206,7 @@ class PDFProcessor:
             """ + raw_text
             
             try:
-                response = self.model.generate_content(prompt)
+                response = self.router.generate(CLEANUP, prompt)
                 cleaned_text = response.text.strip()
                 
                 # Remove any markdown formatting if present
@@ -214,6 +221,10 @@ class PDFProcessor:
                 
                 return cleaned_text if cleaned_text else raw_text
                 
+            except CircuitOpenError as e:
+                # Degraded path: cleanup is a nice-to-have, so carry on with the raw text
+                print(f"Text cleanup unavailable, using raw text: {str(e)}")
+                return raw_text.strip()
             except Exception as e:
                 if self.debug:
                     print(f"Error processing text with LLM: {str(e)}")
@@ -225,9 +236,16 @@ class PDFProcessor:
                 print(f"Error extracting text from PDF: {str(e)}")
             return ""
 
-    def identify_key_subjects(self, text_content: str, existing_subjects: List[str] = None) -> List[Dict[str, Any]]:
-        """Use Gemini to identify key subjects from the extracted text, optionally including existing subjects"""
+    def identify_key_subjects(self, text_content: str, existing_subjects: List[str] = None,
+                              document: Optional[DocumentContext] = None) -> List[Dict[str, Any]]:
+        """Use Gemini to identify key subjects from the extracted text, optionally including existing subjects
+        
+        The text is sent through `document` when given (shared with the partition prompts), otherwise inlined.
+        """
         try:
+            if document is None:
+                document = DocumentContext(text_content, use_cache=False)
+            
             existing_subjects_text = ""
             if existing_subjects and len(existing_subjects) > 0:
                 existing_subjects_text = f"""
@@ -236,7 +254,7 @@ class PDFProcessor:
                 """
             
             prompt = f"""
-            Extract key subjects (ONLY THE MOST IMPORTANT ONES) from the following text content from a PDF document.
+            Extract key subjects (ONLY THE MOST IMPORTANT ONES) from the document above.
             Analyze the entire document to identify the most important topics and concepts.
             The subjects should be the main topics of the document. (theoretical, not practical)
             {existing_subjects_text}
@@ -250,10 +268,9 @@ class PDFProcessor:
             }}
             
             Return only the JSON array with no additional text or explanation.
-            {text_content}
             """
             
-            response = self.model.generate_content(prompt)
+            response = self.router.generate(SUBJECT_EXTRACTION, prompt, document=document)
             
             response_text = response.text.strip()
             if response_text.startswith('```json'):
@@ -283,15 +300,24 @@ class PDFProcessor:
                 print(f"Error parsing subjects JSON: {str(e)}")
                 return []
                 
+        except CircuitOpenError:
+            # No degraded path for subjects: let the caller report the outage
+            raise
         except Exception as e:
             print(f"Error identifying key subjects: {str(e)}")
             return []
 
-    def partition_text_by_subjects(self, text_content: str, subjects: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Partition the entire PDF text into sections relevant to each key subject"""
+    def partition_text_by_subjects(self, text_content: str, subjects: List[Dict[str, Any]],
+                                   document: Optional[DocumentContext] = None) -> List[Dict[str, Any]]:
+        """Partition the entire PDF text into sections relevant to each key subject
+        
+        The text is sent through `document` when given (shared by every subject's prompt), otherwise inlined.
+        """
         try:
             if not subjects:
                 return []
+            if document is None:
+                document = DocumentContext(text_content, use_cache=False)
                 
             # Extract subject names for processing
             subject_names = [subject["subject"] for subject in subjects if isinstance(subject, dict) and "subject" in subject]
@@ -307,7 +333,7 @@ class PDFProcessor:
             # Process each subject
             for subject in subject_names:
                 try:
-                    prompt = f"""Given the following text content, extract all sections that are relevant to the subject: "{subject}"
+                    prompt = f"""From the document above, extract all sections that are relevant to the subject: "{subject}"
 
                     Requirements:
                     1. Extract COMPLETE PARAGRAPHS or substantial blocks of text that discuss the subject in depth.
@@ -332,21 +358,10 @@ class PDFProcessor:
                     
                     IMPORTANT: DO NOT fragment the text into tiny pieces. Keep related sentences together in cohesive sections.
                     It is MISSION CRITICAL that you return ONLY the JSON array with no additional text.
-                    
-                    Text content:
-                    {text_content}
                     """
                     
-                    # Generate content with appropriate parameters
-                    response = self.model.generate_content(
-                        prompt,
-                        generation_config={
-                            "temperature": 0.1,
-                            "top_p": 0.8,
-                            "top_k": 40,
-                            "max_output_tokens": 8192
-                        }
-                    )
+                    # Generation parameters come from the partition route
+                    response = self.router.generate(PARTITION, prompt, document=document)
                     
                     response_text = response.text.strip()
                     
@@ -541,11 +556,15 @@ class PDFProcessor:
                                             "text": paragraph
                                         })
                         
+                except CircuitOpenError:
+                    raise
                 except Exception as e:
                     print(f"Error processing subject {subject}: {str(e)}")
             
             return all_results
                 
+        except CircuitOpenError:
+            raise
         except Exception as e:
             print(f"Error in text partitioning: {str(e)}")
             return []
@@ -608,11 +627,15 @@ class PDFProcessor:
                 
             results["text_extracted"] = True
             
-            subjects = self.identify_key_subjects(text_content, existing_subjects)
-            results["subjects"] = subjects
-            
-            # Get text sections for all subjects
-            partitioned_text = self.partition_text_by_subjects(text_content, subjects)
+            # The cleaned document is registered once and referenced by the subject and partition prompts;
+            # its cache lives as long as this ingestion job
+            model_names = [self.router.get_route(SUBJECT_EXTRACTION)["model"], self.router.get_route(PARTITION)["model"]]
+            with DocumentContext(text_content, model_names=model_names) as document:
+                subjects = self.identify_key_subjects(text_content, existing_subjects, document=document)
+                results["subjects"] = subjects
+                
+                # Get text sections for all subjects
+                partitioned_text = self.partition_text_by_subjects(text_content, subjects, document=document)
             
             # The partitioned_text is already a list of dictionaries with "subject" and "text" keys
             results["partitioned_text"] = partitioned_text
@@ -639,6 +662,8 @@ class PDFProcessor:
             
         except Exception as e:
             results["error"] = str(e)
+            if isinstance(e, CircuitOpenError):
+                results["retry_after"] = e.retry_after
             
             # Try to save error results to GCS bucket too
             try:
@@ -1,15 +1,97 @@
 import os
-from typing import Optional, List
+from typing import Dict, Iterator, Optional, List
 from dotenv import load_dotenv
 import vertexai
 from vertexai.preview import rag
 from vertexai.preview.rag import RagCorpus
-from vertexai.preview.generative_models import GenerativeModel, Tool
+from vertexai.preview.generative_models import Tool
 from pathlib import Path
 import json
 import time
+import random
 from google.cloud import storage
 import uuid
+import tempfile
+import contextvars
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from .model_router import get_router, QUIZ_GENERATION, GenerationError
+from .circuit_breaker import CircuitOpenError, get_breaker
+from .cassette import cassette_call, is_replaying, to_namespace
+from .document_context import estimate_tokens
+from .request_context import DeadlineExceeded, remaining_time
+
+# Corpus creation and imports are slow even when healthy, hence the higher slow-call threshold
+RAG_BREAKER = "vertex-rag"
+RAG_SLOW_CALL_SECONDS = 120
+
+# Quiz generation shards: snippet tokens per prompt, and questions per prompt. Small shards answer
+# fast, never hit max output tokens, and a bad answer only costs a retry of its shard.
+DIRECT_BATCH_TOKENS = int(os.getenv("DIRECT_BATCH_TOKENS", 30000))
+DIRECT_BATCH_QUESTIONS = int(os.getenv("DIRECT_BATCH_QUESTIONS", 5))
+# Further attempts for the questions of a shard that came back missing or malformed
+SHARD_RETRIES = int(os.getenv("QUIZ_SHARD_RETRIES", 2))
+
+# Shards run concurrently on this pool; the quiz_generation route's max_concurrency bounds the
+# number of calls in flight across all quizzes
+_shard_executor = ThreadPoolExecutor(max_workers=int(os.getenv("QUIZ_SHARD_WORKERS", 8)),
+                                     thread_name_prefix="quiz-shard")
+
+
+def is_valid_question(question_raw, options_per_question: int) -> bool:
+    """Check a generated question has the shape quizzes rely on"""
+    try:
+        return (
+            bool(str(question_raw['snippet_id']))
+            and bool(str(question_raw['question']).strip())
+            and len(question_raw['choices']) == options_per_question
+            and 0 <= int(question_raw['answer_index']) < options_per_question
+        )
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def expand_pooled_question(question_raw, candidates: List[str], options_per_question: int, rng=random):
+    """Turn a stem-and-answer question picking its wrong options from candidates into a full question
+
+    The model must pick exactly options_per_question - 1 distinct candidates ("distractor_indexes")
+    that differ from the answer. Questions with a blank stem or answer, or with missing or invalid
+    picks, are rejected rather than completed with other candidates, which may not fit the stem.
+
+    Returns:
+        The question with choices and answer_index, marked as pooled, or None if it is rejected
+    """
+    try:
+        question, answer = question_raw['question'], question_raw['answer']
+        picks = [int(index) for index in question_raw.get('distractor_indexes') or []]
+    except (KeyError, TypeError, ValueError):
+        return None
+    question = '' if question is None else str(question).strip()
+    answer = '' if answer is None else str(answer).strip()
+    if not question or not answer or len(picks) != options_per_question - 1:
+        return None
+
+    wrong_options, taken = [], {answer.lower()}
+    for index in picks:
+        if not 0 <= index < len(candidates) or candidates[index].strip().lower() in taken:
+            return None
+        taken.add(candidates[index].strip().lower())
+        wrong_options.append(candidates[index])
+
+    answer_index = rng.randrange(options_per_question)
+    return {
+        'snippet_id': question_raw.get('snippet_id'),
+        'question': question,
+        'choices': wrong_options[:answer_index] + [answer] + wrong_options[answer_index:],
+        'answer_index': answer_index,
+        'pooled': True,
+    }
+
+
+def is_pooled(data: dict, options_per_question: int) -> bool:
+    """Whether an entry has enough candidate wrong options for a stem-and-answer prompt"""
+    return len(data.get('distractors') or []) >= options_per_question - 1
+
 
 class QuizMakerRAG:
     def __init__(self, service_account_path: Optional[str] = None, debug: bool = False):
@@ -30,10 +112,13 @@ class QuizMakerRAG:
         
         # Initialize Vertex AI
         vertexai.init(project=self.project_id, location=self.location)
+        self.rag_breaker = get_breaker(RAG_BREAKER, slow_call_seconds=RAG_SLOW_CALL_SECONDS)
         
-        # Initialize storage client
+        # Initialize storage client (not needed when GCS calls are replayed from a cassette)
         try:
-            if service_account_path and os.path.exists(service_account_path):
+            if is_replaying():
+                self.storage_client = None
+            elif service_account_path and os.path.exists(service_account_path):
                 if self.debug:
                     print(f"  Using service account for storage client")
                 self.storage_client = storage.Client.from_service_account_json(service_account_path)
@@ -48,6 +133,10 @@ class QuizMakerRAG:
             print(f"Error initializing storage client: {str(e)}")
             raise
 
+    def _rag_call(self, kind: str, request: dict, fn, encode=None, decode=None):
+        """Call the RAG API through the breaker, recorded or replayed when a cassette is active"""
+        return self.rag_breaker.call(cassette_call, kind, request, fn, encode=encode, decode=decode)
+
     def setup_corpus(self, bucket_name: str, data_list: List[dict]) -> Optional[str]:
         """Set up the RAG corpus from selected files in GCS bucket"""
         try:
@@ -60,17 +149,21 @@ class QuizMakerRAG:
                     print(f"  Counter: {data.get('comment_helper_counter', 'N/A')}")
 
             # Define the embedding model configuration
-            embedding_model_config = rag.EmbeddingModelConfig(
-                publisher_model=f"projects/{self.project_id}/locations/{self.location}/publishers/google/models/text-embedding-005"
-            )
+            embedding_model_config = self._embedding_model_config()
             
             if self.debug:
                 print(f"\nCreating corpus with embedding model: {embedding_model_config.publisher_model}")
             
             # Create corpus
-            corpus = rag.create_corpus(
-                display_name="simple-rag-corpus",
-                embedding_model_config=embedding_model_config
+            corpus = self._rag_call(
+                "rag.create_corpus",
+                {"display_name": "simple-rag-corpus", "embedding_model": embedding_model_config.publisher_model},
+                lambda: rag.create_corpus(
+                    display_name="simple-rag-corpus",
+                    embedding_model_config=embedding_model_config
+                ),
+                encode=lambda corpus: {"name": corpus.name, "display_name": corpus.display_name},
+                decode=to_namespace,
             )
 
             if self.debug:
@@ -94,9 +187,11 @@ class QuizMakerRAG:
                 print(f"\nTemporary file created. Size: {os.path.getsize(local_path)} bytes")
             
             # Step 2: Upload the file to GCS
-            bucket = self.storage_client.bucket(bucket_name)
-            blob = bucket.blob(file_name)
-            blob.upload_from_filename(local_path)
+            # The file name carries a timestamp, so recordings are matched on the corpus instead
+            cassette_call(
+                "gcs.upload_corpus_data", {"bucket": bucket_name, "corpus_name": corpus.name},
+                lambda: self.storage_client.bucket(bucket_name).blob(file_name).upload_from_filename(local_path)
+            )
             
             gcs_uri = f"gs://{bucket_name}/{file_name}"
             
@@ -107,10 +202,15 @@ class QuizMakerRAG:
             if self.debug:
                 print(f"\nImporting file from GCS to corpus...")
             
-            rag.import_files(
-                corpus_name=corpus.name,
-                paths=[gcs_uri],
-                max_embedding_requests_per_min=1000
+            self._rag_call(
+                "rag.import_files",
+                {"corpus_name": corpus.name, "data": data_list},
+                lambda: rag.import_files(
+                    corpus_name=corpus.name,
+                    paths=[gcs_uri],
+                    max_embedding_requests_per_min=1000
+                ),
+                encode=lambda response: None,
             )
             
             # Clean up local file
@@ -124,7 +224,12 @@ class QuizMakerRAG:
                     print(f"Error: {e}")
 
             # List files to verify import
-            files = list(rag.list_files(corpus.name))
+            files = self._rag_call(
+                "rag.list_files", {"corpus_name": corpus.name},
+                lambda: list(rag.list_files(corpus.name)),
+                encode=lambda files: [{"name": f.name, "display_name": f.display_name} for f in files],
+                decode=to_namespace,
+            )
             if self.debug:
                 print(f"\nFiles in corpus:")
                 for file in files:
@@ -133,49 +238,102 @@ class QuizMakerRAG:
             
             return corpus.name
 
+        except CircuitOpenError:
+            raise
         except Exception as e:
             print(f"\nError setting up corpus: {str(e)}")
             return None
 
-    def setup_model(self, corpus_name: str) -> GenerativeModel:
-        """Set up the model with RAG capability"""
+    def _embedding_model_config(self):
+        return rag.EmbeddingModelConfig(
+            publisher_model=f"projects/{self.project_id}/locations/{self.location}/publishers/google/models/text-embedding-005"
+        )
+
+    def create_course_corpus(self, display_name: str) -> str:
+        """Create an empty, long-lived corpus that a course's materials are added to
+
+        Returns:
+            str: The corpus resource name
+        """
+        embedding_model_config = self._embedding_model_config()
+        corpus = self._rag_call(
+            "rag.create_corpus",
+            {"display_name": display_name, "embedding_model": embedding_model_config.publisher_model},
+            lambda: rag.create_corpus(display_name=display_name, embedding_model_config=embedding_model_config),
+            encode=lambda corpus: {"name": corpus.name, "display_name": corpus.display_name},
+            decode=to_namespace,
+        )
         if self.debug:
-            print(f"\nSetting up model with corpus: {corpus_name}")
+            print(f"\nCreated corpus {corpus.name} ({display_name})")
+        return corpus.name
+
+    def upload_snippets(self, corpus_name: str, data_list: List[dict], display_name: str) -> str:
+        """Upload snippets as one file of an existing corpus, embedding them
+
+        Args:
+            corpus_name: Corpus resource name
+            data_list: Snippets as dicts with at least "id" and "snippet"
+            display_name: Display name of the file in the corpus (e.g. the material id)
+
+        Returns:
+            str: The RAG file resource name, needed to scope retrieval or delete the file
+        """
+        # Written to a temporary file rather than the working directory
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump(data_list, f, default=str)
+            local_path = f.name
+        try:
+            rag_file = self._rag_call(
+                "rag.upload_file",
+                {"corpus_name": corpus_name, "display_name": display_name, "data": data_list},
+                lambda: rag.upload_file(corpus_name=corpus_name, path=local_path, display_name=display_name),
+                encode=lambda rag_file: {"name": rag_file.name},
+                decode=to_namespace,
+            )
+        finally:
+            os.remove(local_path)
+
+        if self.debug:
+            print(f"\nUploaded {len(data_list)} snippets to {rag_file.name}")
+        return rag_file.name
+
+    def delete_file(self, rag_file_name: str):
+        """Delete one file from a corpus"""
+        self._rag_call("rag.delete_file", {"name": rag_file_name},
+                       lambda: rag.delete_file(name=rag_file_name))
+        if self.debug:
+            print(f"\nDeleted RAG file {rag_file_name}")
+
+    def setup_retrieval_tool(self, corpus_name: str, rag_file_names: Optional[List[str]] = None,
+                             similarity_top_k: int = 10) -> Tool:
+        """Set up the RAG retrieval tool for a corpus, optionally restricted to some of its files"""
+        if self.debug:
+            print(f"\nSetting up retrieval tool with corpus: {corpus_name}")
+
+        # Retrieval only looks at the given files; rag_file_ids are the last segment of the file names
+        rag_file_ids = [name.split('/')[-1] for name in rag_file_names] if rag_file_names else None
 
         # Create RAG retrieval tool
         retrieval_tool = Tool.from_retrieval(
             retrieval=rag.Retrieval(
                 source=rag.VertexRagStore(
-                    rag_corpora=[corpus_name],
-                    similarity_top_k=10,
+                    rag_resources=[rag.RagResource(rag_corpus=corpus_name, rag_file_ids=rag_file_ids)],
+                    similarity_top_k=similarity_top_k,
                     vector_distance_threshold=0.8,
                 ),
             )
         )
 
-        # Create model with RAG tool
-        return GenerativeModel(
-            model_name="gemini-2.0-flash-001",
-            tools=[retrieval_tool]
-        )
-
-    def generate_response(self, query: str, model: GenerativeModel, quiz_length: int, options_per_question: int) -> str:
-        """Generate a response using RAG"""
-        try:
-            if self.debug:
-                print(f"\nGenerating quiz with length: {quiz_length}")
-            
-            # Test response to verify corpus access
-            if self.debug:
-                print("\nVerifying corpus access...")
-                test_response = model.generate_content("What are the main topics in the provided data?")
-                print(f"Test response: {test_response.text[:100]}...")
-
-            prompt = f"""
-            Your task is to create multiple-choice questions based on this data.
+        # The model itself is picked by the router for the quiz generation task
+        return retrieval_tool
 
+    def _quiz_prompt(self, source: str, entries_text: str, quiz_length: int, options_per_question: int) -> str:
+        """Quiz generation instructions shared by the RAG and direct modes"""
+        return f"""
+            Your task is to create multiple-choice questions based on {source}.
+            {entries_text}
             Requirements:
-            1. Create exactly one question for each entry in the data ({quiz_length} total questions)
+            1. Create exactly one question for each entry to use ({quiz_length} total questions)
             2. Each question must be multiple choice with exactly ${options_per_question} options
             3. Each question must have exactly one correct answer
             4. Reference the entry's ID in the snippet_id field
@@ -207,22 +365,92 @@ class QuizMakerRAG:
             - Keep questions clear and concise
             - Use the exact snippet_id from the data
             """
+
+    def _pooled_quiz_prompt(self, source: str, entries_text: str, quiz_length: int, options_per_question: int) -> str:
+        """Instructions for entries whose wrong options are picked from their "distractors" candidates"""
+        return f"""
+            Your task is to create multiple-choice questions based on {source}.
+            {entries_text}
+            Requirements:
+            1. Create exactly one question for each entry to use ({quiz_length} total questions)
+            2. Write only the question and its correct answer; do not write any wrong option
+            3. Pick exactly {options_per_question - 1} wrong options for each question from its entry's
+               "distractors" list, by 0-based index: options that are plausible but definitely wrong
+               for your question
+            4. Reference the entry's ID in the snippet_id field
+            5. Make questions challenging but fair, and keep the answer short, in the style of the distractors
+
+            Example of the expected response format:
+            [
+                {{
+                    "snippet_id": "123e4567-e89b-12d3-a456-426614174000",
+                    "question": "Which organelle produces most of a cell's chemical energy?",
+                    "answer": "Mitochondria",
+                    "distractor_indexes": [0, 3, 5]
+                }}
+            ]
+
+            Important:
+            - Your response MUST be a valid JSON array
+            - Create exactly one question per entry
+            - Use the exact snippet_id from the data
+            """
+
+    def _clean_json_response(self, text: str) -> str:
+        """Strip markdown code fences around a JSON answer"""
+        cleaned_response = text.strip()
+        if cleaned_response.startswith('```'):
+            cleaned_response = cleaned_response.split('```')[1]
+            if cleaned_response.startswith('json'):
+                cleaned_response = cleaned_response[4:]
+        return cleaned_response.strip()
+
+    def generate_response(self, query: str, retrieval_tool: Tool, quiz_length: int, options_per_question: int,
+                          snippet_ids: Optional[List[str]] = None,
+                          entries: Optional[List[dict]] = None) -> str:
+        """Generate a response using RAG
+
+        When snippet_ids is given, only those entries of the corpus are used, one question per listed id,
+        generated in concurrent shards (see _generate_sharded). entries can replace snippet_ids
+        to pass per-entry hints along the ids: questions to "avoid" and candidate wrong options
+        ("distractors").
+        """
+        try:
+            if self.debug:
+                print(f"\nGenerating quiz with length: {quiz_length}")
+            
+            # Test response to verify corpus access
+            if self.debug:
+                print("\nVerifying corpus access...")
+                test_response = get_router().generate(
+                    QUIZ_GENERATION,
+                    "What are the main topics in the provided data?",
+                    tools=[retrieval_tool]
+                )
+                print(f"Test response: {test_response.text[:100]}...")
+
+            if entries or snippet_ids:
+                questions = self._generate_sharded(
+                    entries or [{'id': snippet_id} for snippet_id in snippet_ids],
+                    options_per_question,
+                    self._rag_shard_generator(retrieval_tool, options_per_question),
+                )
+                if self.debug:
+                    print(f"\nNumber of questions generated: {len(questions)}")
+                return json.dumps(questions)
+
+            prompt = self._quiz_prompt("this data", "", quiz_length, options_per_question)
                         
             if self.debug:
                 print("\nGenerating questions from model...")
             
-            response = model.generate_content(prompt)
+            response = get_router().generate(QUIZ_GENERATION, prompt, tools=[retrieval_tool])
             
             if self.debug:
                 print("\nRaw response received from model")
             
             # Clean the response text
-            cleaned_response = response.text.strip()
-            if cleaned_response.startswith('```'):
-                cleaned_response = cleaned_response.split('```')[1]
-                if cleaned_response.startswith('json'):
-                    cleaned_response = cleaned_response[4:]
-            cleaned_response = cleaned_response.strip()
+            cleaned_response = self._clean_json_response(response.text)
             
             # Validate JSON
             try:
@@ -241,6 +469,211 @@ class QuizMakerRAG:
             print(f"\nError generating response: {str(e)}")
             raise
 
+    def direct_batches(self, data_list: List[dict]) -> List[List[dict]]:
+        """Split entries into shards of at most DIRECT_BATCH_TOKENS tokens and DIRECT_BATCH_QUESTIONS entries
+
+        Entries of the same snippet stay in one shard, so the model is asked for their distinct
+        questions in a single prompt.
+        """
+        grouped = {}
+        for data in data_list:
+            grouped.setdefault(str(data['id']), []).append(data)
+
+        batches, batch, batch_tokens = [], [], 0
+        for group in grouped.values():
+            tokens = estimate_tokens(group[0].get('snippet', '')) * len(group)
+            if batch and (batch_tokens + tokens > DIRECT_BATCH_TOKENS or len(batch) + len(group) > DIRECT_BATCH_QUESTIONS):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.extend(group)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _match_questions(self, parsed_json, pending: List[dict], options_per_question: int):
+        """Keep the valid questions answering pending entries
+
+        Returns:
+            Tuple of the accepted questions and the entries still without a question
+        """
+        needed = Counter(str(data['id']) for data in pending)
+        candidates = {str(data['id']): data.get('distractors') or [] for data in pending}
+        accepted = []
+        for question_raw in parsed_json if isinstance(parsed_json, list) else [parsed_json]:
+            if isinstance(question_raw, dict) and 'choices' not in question_raw and 'answer' in question_raw:
+                question_raw = expand_pooled_question(
+                    question_raw, candidates.get(str(question_raw.get('snippet_id')), []), options_per_question
+                )
+            if is_valid_question(question_raw, options_per_question) and needed[str(question_raw['snippet_id'])] > 0:
+                needed[str(question_raw['snippet_id'])] -= 1
+                accepted.append(question_raw)
+
+        remaining = []
+        for data in pending:
+            if needed[str(data['id'])] > 0:
+                needed[str(data['id'])] -= 1
+                remaining.append(data)
+        return accepted, remaining
+
+    def _generate_shard(self, shard: List[dict], options_per_question: int, generate_shard) -> List[dict]:
+        """Generate the questions of one shard, asking again only for those missing or malformed"""
+        pending, questions = list(shard), []
+        for attempt in range(1 + SHARD_RETRIES):
+            try:
+                parsed_json = json.loads(self._clean_json_response(generate_shard(pending)))
+            except (json.JSONDecodeError, GenerationError) as e:
+                print(f"Shard of {len(pending)} questions failed on attempt {attempt + 1}: {str(e)}")
+                continue
+            accepted, pending = self._match_questions(parsed_json, pending, options_per_question)
+            questions.extend(accepted)
+            if not pending:
+                break
+        if pending:
+            print(f"Giving up on {len(pending)} questions of a shard after {1 + SHARD_RETRIES} attempts")
+        return questions
+
+    def _submit_shards(self, data_list: List[dict], options_per_question: int, generate_shard) -> list:
+        """Start generating every shard on the shard pool, in the caller's request context
+
+        Entries with distractor candidates and entries without are sharded apart, as they are
+        asked for with different prompts.
+        """
+        pooled = [data for data in data_list if is_pooled(data, options_per_question)]
+        plain = [data for data in data_list if not is_pooled(data, options_per_question)]
+        return [
+            _shard_executor.submit(contextvars.copy_context().run, self._generate_shard,
+                                   shard, options_per_question, generate_shard)
+            for shard in self.direct_batches(pooled) + self.direct_batches(plain)
+        ]
+
+    def _generate_sharded(self, data_list: List[dict], options_per_question: int, generate_shard) -> List[dict]:
+        """Generate one question per entry, shards running concurrently and merged in order
+
+        Each shard is validated on its own and its missing questions retried up to SHARD_RETRIES
+        times; a shard that still falls short only shortens the quiz. Shards inherit the request
+        context (deadline, usage tags) of the caller.
+
+        Args:
+            data_list: Entries with an "id" (and, for direct prompts, a "snippet")
+            options_per_question: Number of choices every question must have
+            generate_shard: Callable taking a list of entries and returning the raw model answer
+
+        Raises:
+            GenerationError: If no shard produced any question
+        """
+        futures = self._submit_shards(data_list, options_per_question, generate_shard)
+        questions = []
+        try:
+            for future in futures:
+                remaining = remaining_time()
+                questions.extend(future.result(timeout=max(0.0, remaining) if remaining is not None else None))
+        except FutureTimeoutError:
+            raise DeadlineExceeded("Request deadline exceeded while generating quiz shards")
+        finally:
+            for future in futures:
+                future.cancel()
+
+        if data_list and not questions:
+            raise GenerationError(f"No valid question generated for {len(data_list)} entries")
+        if self.debug:
+            print(f"\nGenerated {len(questions)}/{len(data_list)} questions in {len(futures)} shards")
+        return questions
+
+    def iter_questions(self, data_list: List[dict], options_per_question: int,
+                       retrieval_tool: Optional[Tool] = None) -> Iterator[List[dict]]:
+        """Yield the questions of each shard as soon as it is generated, in completion order
+
+        Same generation as generate_direct, or as generate_response with snippet ids when a
+        retrieval tool is given. Shards still running are cancelled if the caller stops early.
+
+        Raises:
+            DeadlineExceeded: If shards are still running at the request deadline
+        """
+        if retrieval_tool is not None:
+            data_list = [{key: value for key, value in data.items() if key != 'snippet'} for data in data_list]
+            generate_shard = self._rag_shard_generator(retrieval_tool, options_per_question)
+        else:
+            generate_shard = self._direct_shard_generator(options_per_question)
+
+        futures = self._submit_shards(data_list, options_per_question, generate_shard)
+        remaining = remaining_time()
+        try:
+            for future in as_completed(futures, timeout=max(0.0, remaining) if remaining is not None else None):
+                yield future.result()
+        except FutureTimeoutError:
+            raise DeadlineExceeded("Request deadline exceeded while generating quiz shards")
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _direct_shard_generator(self, options_per_question: int):
+        """Shard generator writing the entries' snippets into the prompt"""
+        def generate_shard(shard: List[dict]) -> str:
+            pooled = all(is_pooled(data, options_per_question) for data in shard)
+            entries = []
+            for data in shard:
+                entry = {'id': data['id'], 'snippet': data['snippet']}
+                if data.get('avoid'):
+                    entry['avoid'] = data['avoid']
+                if pooled:
+                    entry['distractors'] = data['distractors']
+                entries.append(entry)
+            entries_text = f"""
+            Entries (an id listed several times gets several different questions):
+            {json.dumps(entries)}
+            {self._avoid_text(shard)}
+            """
+            make_prompt = self._pooled_quiz_prompt if pooled else self._quiz_prompt
+            prompt = make_prompt("the entries below", entries_text, len(shard), options_per_question)
+            return get_router().generate(QUIZ_GENERATION, prompt).text
+        return generate_shard
+
+    def _avoid_text(self, shard: List[dict], by_id: bool = False) -> str:
+        """Instruction not to repeat the questions already asked about the shard's entries"""
+        avoided = {data['id']: data['avoid'] for data in shard if data.get('avoid')}
+        if not avoided:
+            return ""
+        if not by_id:
+            return ("The user already answered the questions listed in an entry's \"avoid\" field: "
+                    "do not repeat or reword them, ask about another aspect of the entry.")
+        return f"""The user already answered these questions (by entry id): do not repeat or reword them,
+            ask about another aspect of the entry:
+            {json.dumps(avoided)}"""
+
+    def _rag_shard_generator(self, retrieval_tool: Tool, options_per_question: int):
+        """Shard generator retrieving the listed entries from the corpus"""
+        def generate_shard(shard: List[dict]) -> str:
+            pooled = all(is_pooled(data, options_per_question) for data in shard)
+            entries_text = f"""
+            Only use the entries whose id is in this list, and create one question per listed id
+            (an id listed several times gets several different questions):
+            {json.dumps([data['id'] for data in shard])}
+            {self._avoid_text(shard, by_id=True)}
+            """
+            if pooled:
+                entries_text += f"""
+            Candidate wrong options ("distractors") by entry id:
+            {json.dumps({data['id']: data['distractors'] for data in shard})}
+            """
+            make_prompt = self._pooled_quiz_prompt if pooled else self._quiz_prompt
+            prompt = make_prompt("this data", entries_text, len(shard), options_per_question)
+            return get_router().generate(QUIZ_GENERATION, prompt, tools=[retrieval_tool]).text
+        return generate_shard
+
+    def generate_direct(self, data_list: List[dict], options_per_question: int) -> str:
+        """Generate a quiz with the selected snippets written into the prompt, without a corpus
+
+        Each entry of data_list (with "id" and "snippet") gets one question. Snippets are sent in
+        token-budgeted shards generated concurrently (see _generate_sharded).
+
+        Returns:
+            str: JSON array of questions, in the same format as generate_response
+        """
+        return json.dumps(self._generate_sharded(
+            data_list, options_per_question, self._direct_shard_generator(options_per_question)
+        ))
+
     def delete_corpus(self, corpus_name: str):
         """Delete a specific RAG corpus"""
         try:
@@ -252,7 +685,8 @@ class QuizMakerRAG:
             if self.debug:
                 print(f"\nAttempting to delete corpus: {corpus_name}")
             
-            rag.delete_corpus(corpus_name)
+            self._rag_call("rag.delete_corpus", {"corpus_name": corpus_name},
+                           lambda: rag.delete_corpus(corpus_name))
             if self.debug:
                 print("Corpus deleted successfully")
         except Exception as e:
@@ -335,11 +769,11 @@ def main():
     corpus_id = rag.setup_corpus(bucket_name=bucket_name, data_list=mock_data)
 
     if corpus_id:
-        print("\nSetting up model with RAG capability...")
-        model = rag.setup_model(corpus_id)
+        print("\nSetting up retrieval tool...")
+        retrieval_tool = rag.setup_retrieval_tool(corpus_id)
         
         print("\nGenerating quiz based on the corpus...")
-        response = rag.generate_response("", model, quiz_length=len(mock_data))
+        response = rag.generate_response("", retrieval_tool, quiz_length=len(mock_data), options_per_question=4)
         print(f"\nQuiz: {response}")
     
     try:
@@ -0,0 +1,113 @@
+import time
+import uuid
+import logging
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a call is attempted after the request's deadline has passed"""
+
+
+@dataclass(frozen=True)
+class RequestContext:
+    """Per-request information propagated down to every generation call"""
+    request_id: str
+    deadline: Optional[float] = None  # time.monotonic() value, None means no deadline
+    user_id: Optional[str] = None
+    course_id: Optional[str] = None
+    endpoint: Optional[str] = None
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline, or None if there is no deadline"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("request_context", default=None)
+
+
+def current_context() -> Optional[RequestContext]:
+    """Return the context of the request being served, if any"""
+    return _current.get()
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left before the current request's deadline, or None if unbounded"""
+    context = _current.get()
+    return context.remaining() if context else None
+
+
+def check_deadline():
+    """Raise DeadlineExceeded if the current request has run out of time"""
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+
+
+@contextmanager
+def request_context(request_id: Optional[str] = None, timeout: Optional[float] = None):
+    """Bind a request context for the duration of the block
+
+    Nested contexts inherit the request id of the outer one and keep the tighter deadline.
+
+    Args:
+        request_id: Identifier used to correlate calls made on behalf of the request
+        timeout: Seconds from now before the request's deadline, None for no new deadline
+    """
+    parent = _current.get()
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    if parent is not None:
+        if parent.deadline is not None:
+            deadline = parent.deadline if deadline is None else min(deadline, parent.deadline)
+        context = replace(parent, request_id=request_id or parent.request_id, deadline=deadline)
+    else:
+        context = RequestContext(request_id=request_id or uuid.uuid4().hex, deadline=deadline)
+
+    token = _current.set(context)
+    try:
+        yield context
+    finally:
+        _current.reset(token)
+
+
+def tag_request(user_id=None, course_id=None, endpoint: Optional[str] = None):
+    """Attach accounting tags to the current request context for the rest of the request"""
+    context = _current.get()
+    if context is None:
+        return
+    tags = {
+        "user_id": str(user_id) if user_id is not None else context.user_id,
+        "course_id": str(course_id) if course_id is not None else context.course_id,
+        "endpoint": endpoint or context.endpoint,
+    }
+    _current.set(replace(context, **tags))
+
+
+_usage_listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+
+def add_usage_listener(listener: Callable[[Dict[str, Any]], None]):
+    """Register a callable that receives a usage event for every generation call"""
+    if listener not in _usage_listeners:
+        _usage_listeners.append(listener)
+
+
+def emit_usage(event: Dict[str, Any]):
+    """Tag a usage event with the current request context and hand it to every listener"""
+    context = _current.get()
+    if context is not None:
+        event.setdefault("request_id", context.request_id)
+        event.setdefault("user_id", context.user_id)
+        event.setdefault("course_id", context.course_id)
+        event.setdefault("endpoint", context.endpoint)
+    for listener in list(_usage_listeners):
+        try:
+            listener(event)
+        except Exception as e:
+            logger.error(f"Usage listener failed: {str(e)}")
@@ -2,6 +2,53 @@ import os
 from google.cloud import texttospeech
 from google.oauth2 import service_account
 import io
+from .cassette import cassette_call, encode_bytes, decode_bytes
+
+def _synthesize(text, voice_name, language_code, speaking_rate, pitch, credentials_file=None):
+    """
+    Run a synthesize_speech request (LINEAR16/WAV), recorded or replayed when a cassette is active
+    
+    Returns:
+        bytes: The audio content
+    """
+    def synthesize():
+        # Initialize the client with explicit credentials if provided
+        if credentials_file:
+            credentials = service_account.Credentials.from_service_account_file(credentials_file)
+            client = texttospeech.TextToSpeechClient(credentials=credentials)
+        else:
+            # Use environment variable or application default credentials
+            client = texttospeech.TextToSpeechClient()
+        
+        # Set the text input to be synthesized
+        synthesis_input = texttospeech.SynthesisInput(text=text)
+        
+        # Build the voice request
+        voice = texttospeech.VoiceSelectionParams(
+            language_code=language_code,
+            name=voice_name,
+        )
+        
+        # Select the type of audio file (WAV)
+        audio_config = texttospeech.AudioConfig(
+            audio_encoding=texttospeech.AudioEncoding.LINEAR16,
+            speaking_rate=speaking_rate,
+            pitch=pitch
+        )
+        
+        response = client.synthesize_speech(
+            input=synthesis_input, voice=voice, audio_config=audio_config
+        )
+        return response.audio_content
+    
+    request = {
+        "text": text,
+        "voice_name": voice_name,
+        "language_code": language_code,
+        "speaking_rate": speaking_rate,
+        "pitch": pitch,
+    }
+    return cassette_call("tts.synthesize", request, synthesize, encode=encode_bytes, decode=decode_bytes)
 
 def text_to_speech(text, output_filename="output.wav", voice_name="en-US-Standard-C", 
                   language_code="en-US", speaking_rate=1.0, pitch=0.0, credentials_file=None):
@@ -20,39 +67,13 @@ def text_to_speech(text, output_filename="output.wav", voice_name="en-US-Standar
     Returns:
         str: Path to the output audio file
     """
-    # Initialize the client with explicit credentials if provided
-    if credentials_file:
-        credentials = service_account.Credentials.from_service_account_file(credentials_file)
-        client = texttospeech.TextToSpeechClient(credentials=credentials)
-    else:
-        # Use environment variable or application default credentials
-        client = texttospeech.TextToSpeechClient()
-    
-    # Set the text input to be synthesized
-    synthesis_input = texttospeech.SynthesisInput(text=text)
-    
-    # Build the voice request
-    voice = texttospeech.VoiceSelectionParams(
-        language_code=language_code,
-        name=voice_name,
-    )
-    
-    # Select the type of audio file (WAV)
-    audio_config = texttospeech.AudioConfig(
-        audio_encoding=texttospeech.AudioEncoding.LINEAR16,
-        speaking_rate=speaking_rate,
-        pitch=pitch
-    )
-    
     # Perform the text-to-speech request
     try:
-        response = client.synthesize_speech(
-            input=synthesis_input, voice=voice, audio_config=audio_config
-        )
+        audio_content = _synthesize(text, voice_name, language_code, speaking_rate, pitch, credentials_file)
         
         # Save the audio content to a WAV file
         with open(output_filename, "wb") as out_file:
-            out_file.write(response.audio_content)
+            out_file.write(audio_content)
             print(f"Audio content written to {output_filename}")
             
         return output_filename
@@ -77,36 +98,10 @@ def text_to_speech_bytes(text, voice_name="en-US-Standard-C",
     Returns:
         bytes: The audio content as bytes
     """
-    # Initialize the client with explicit credentials if provided
-    if credentials_file:
-        credentials = service_account.Credentials.from_service_account_file(credentials_file)
-        client = texttospeech.TextToSpeechClient(credentials=credentials)
-    else:
-        # Use environment variable or application default credentials
-        client = texttospeech.TextToSpeechClient()
-    
-    # Set the text input to be synthesized
-    synthesis_input = texttospeech.SynthesisInput(text=text)
-    
-    # Build the voice request
-    voice = texttospeech.VoiceSelectionParams(
-        language_code=language_code,
-        name=voice_name,
-    )
-    
-    # Select the type of audio file (WAV)
-    audio_config = texttospeech.AudioConfig(
-        audio_encoding=texttospeech.AudioEncoding.LINEAR16,
-        speaking_rate=speaking_rate,
-        pitch=pitch
-    )
-    
     # Perform the text-to-speech request
     try:
-        response = client.synthesize_speech(
-            input=synthesis_input, voice=voice, audio_config=audio_config
-        )
-        return response.audio_content
+        audio_content = _synthesize(text, voice_name, language_code, speaking_rate, pitch, credentials_file)
+        return audio_content
     
     except Exception as e:
         print(f"Error generating speech: {e}")
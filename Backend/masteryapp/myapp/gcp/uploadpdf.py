@@ -173,6 +173,14 @@ def upload_process_and_highlight_pdf(file_obj, bucket_name: str, user_id: str, c
         # 2. Process the PDF and create JSON
         results = process_pdf_to_json(bucket_name, user_id, course_id, file_name, credentials_path, existing_subjects=[])
         
+        # Vertex is unavailable (circuit open): report it instead of highlighting nothing
+        if results.get("retry_after") is not None:
+            return {
+                "success": False,
+                "error": results.get("error"),
+                "retry_after": results["retry_after"]
+            }
+        
         # 3. Highlight the PDF - passing individual parameters instead of path
         highlight_results = process_pdf_with_subjects(
             user_id=user_id,
@@ -0,0 +1,32 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models.subject import Subject
+from ...services.mastery import rebuild_mastery
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored mastery aggregates (SnippetMastery, SubjectMastery) from the answer history"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Only rebuild this user (id or username)")
+        parser.add_argument('--course', help="Only rebuild the subjects of this course id")
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(quiz__completed_at__isnull=False).distinct()
+        if options['user']:
+            user_filter = options['user']
+            users = users.filter(pk=user_filter) if user_filter.isdigit() else users.filter(username=user_filter)
+
+        rebuilt = 0
+        for user in users.iterator():
+            subjects = Subject.objects.filter(course__user=user)
+            if options['course']:
+                subjects = subjects.filter(course_id=options['course'])
+            subject_ids = list(subjects.values_list('id', flat=True))
+            with transaction.atomic():
+                rebuild_mastery(user, subject_ids)
+            rebuilt += 1
+            self.stdout.write(f"Rebuilt mastery of {len(subject_ids)} subjects for user {user.username}")
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt mastery for {rebuilt} users"))
@@ -0,0 +1,33 @@
+import math
+
+from django.conf import settings
+
+from .gcp.request_context import request_context
+
+
+class RequestDeadlineMiddleware:
+    """Bind a request id and deadline that every generation call made for the request honours
+
+    Clients may shorten the deadline with an X-Request-Timeout header (seconds); it is kept
+    between settings.REQUEST_TIMEOUT_MIN_SECONDS and settings.REQUEST_DEADLINE_SECONDS.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timeout = getattr(settings, 'REQUEST_DEADLINE_SECONDS', None)
+        requested_timeout = request.headers.get('X-Request-Timeout')
+        if requested_timeout:
+            try:
+                requested_timeout = float(requested_timeout)
+            except ValueError:
+                requested_timeout = None
+            if requested_timeout is not None and math.isfinite(requested_timeout):
+                requested_timeout = max(getattr(settings, 'REQUEST_TIMEOUT_MIN_SECONDS', 0), requested_timeout)
+                timeout = requested_timeout if timeout is None else min(timeout, requested_timeout)
+
+        with request_context(request_id=request.headers.get('X-Request-ID'), timeout=timeout) as context:
+            response = self.get_response(request)
+        response['X-Request-ID'] = context.request_id
+        return response
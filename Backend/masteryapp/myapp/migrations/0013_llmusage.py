@@ -0,0 +1,46 @@
+# Generated by Django 5.1.7 on 2026-10-19 07:57
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0012_quiz_options_per_question_subject_mastery_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='subject',
+            name='mastery',
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='options_per_question',
+            field=models.SmallIntegerField(default=4),
+        ),
+        migrations.CreateModel(
+            name='LLMUsage',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('request_id', models.CharField(max_length=64, null=True)),
+                ('endpoint', models.CharField(max_length=200, null=True)),
+                ('call_site', models.CharField(max_length=100)),
+                ('model', models.CharField(max_length=100)),
+                ('prompt_tokens', models.IntegerField(default=0)),
+                ('output_tokens', models.IntegerField(default=0)),
+                ('latency_ms', models.IntegerField()),
+                ('success', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('course', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='myapp.course')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'created_at'], name='myapp_llmus_user_id_a1be5d_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-19 08:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0013_llmusage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classmaterial',
+            name='rag_file_name',
+            field=models.CharField(blank=True, max_length=500, null=True),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rag_corpus_name',
+            field=models.CharField(blank=True, max_length=500, null=True),
+        ),
+    ]
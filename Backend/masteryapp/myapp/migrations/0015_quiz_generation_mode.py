@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 08:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0014_rag_corpus_names'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quiz',
+            name='generation_mode',
+            field=models.CharField(choices=[('auto', 'Automatic'), ('direct', 'Snippets in the prompt'), ('rag', 'Retrieval from the course corpus')], default='auto', max_length=10),
+        ),
+    ]
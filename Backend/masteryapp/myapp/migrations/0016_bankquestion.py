@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-19 08:10
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0015_quiz_generation_mode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BankQuestion',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('question', models.TextField()),
+                ('choices', models.TextField()),
+                ('single_correct_choice', models.SmallIntegerField()),
+                ('options_per_question', models.SmallIntegerField()),
+                ('times_used', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('snippet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bank_questions', to='myapp.materialsnippet')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['snippet', 'options_per_question'], name='myapp_bankq_snippet_93ba6a_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-19 08:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0016_bankquestion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quiz',
+            name='is_warm',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='warm_mastery',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 08:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0019_question_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='quiz',
+            name='generation_mode',
+            field=models.CharField(choices=[('auto', 'Automatic'), ('direct', 'Snippets in the prompt'), ('rag', 'Retrieval from the course corpus'), ('cloze', 'Local fill-in-the-blank, no model call')], default='auto', max_length=10),
+        ),
+    ]
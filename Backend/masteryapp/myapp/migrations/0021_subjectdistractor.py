@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-19 08:31
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0020_quiz_cloze_mode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubjectDistractor',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('text', models.CharField(max_length=255)),
+                ('source', models.CharField(choices=[('generated', 'Wrong option of a generated question'), ('key_term', 'Key term of a snippet')], max_length=20)),
+                ('times_seen', models.PositiveIntegerField(default=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='distractors', to='myapp.subject')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('subject', 'text'), name='unique_subject_distractor')],
+            },
+        ),
+    ]
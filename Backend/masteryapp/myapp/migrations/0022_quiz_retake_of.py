@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-19 08:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0021_subjectdistractor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quiz',
+            name='retake_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='retakes', to='myapp.quiz'),
+        ),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 5.1.7 on 2026-10-19 09:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def clear_stored_mastery(apps, schema_editor):
+    # The stored values are replaced by running sums; rows are rebuilt from history on first read
+    apps.get_model('myapp', 'SnippetMastery').objects.all().delete()
+    apps.get_model('myapp', 'SubjectMastery').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0024_stored_mastery'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_stored_mastery, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='snippetmastery',
+            name='mastery',
+        ),
+        migrations.RemoveField(
+            model_name='snippetmastery',
+            name='valid_until',
+        ),
+        migrations.AddField(
+            model_name='snippetmastery',
+            name='correct_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='snippetmastery',
+            name='correct_days_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='snippetmastery',
+            name='incorrect_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='snippetmastery',
+            name='incorrect_days_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='snippetmastery',
+            name='evicted_before',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='snippetmastery',
+            name='oldest_answer_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RemoveField(
+            model_name='subjectmastery',
+            name='mastery_total',
+        ),
+        migrations.RemoveField(
+            model_name='subjectmastery',
+            name='snippet_count',
+        ),
+        migrations.RemoveField(
+            model_name='subjectmastery',
+            name='valid_until',
+        ),
+        migrations.AddField(
+            model_name='subjectmastery',
+            name='correct_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='subjectmastery',
+            name='correct_days_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='subjectmastery',
+            name='incorrect_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='subjectmastery',
+            name='incorrect_days_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='subjectmastery',
+            name='evicted_before',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='subjectmastery',
+            name='oldest_answer_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
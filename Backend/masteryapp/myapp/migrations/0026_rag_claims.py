@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-19 08:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0025_mastery_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classmaterial',
+            name='rag_file_claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rag_corpus_claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
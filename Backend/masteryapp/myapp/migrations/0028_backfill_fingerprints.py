@@ -0,0 +1,33 @@
+from django.db import migrations
+
+from myapp.services.fingerprint import _stored_fingerprint
+
+BATCH_SIZE = 1000
+
+
+def backfill_fingerprints(apps, schema_editor):
+    # Questions saved before fingerprints existed; rows whose correct choice is out of range keep none
+    for model_name in ('Question', 'BankQuestion'):
+        model = apps.get_model('myapp', model_name)
+        batch = []
+        for question in model.objects.filter(fingerprint__isnull=True).only(
+            'id', 'question', 'choices', 'single_correct_choice'
+        ).iterator(chunk_size=BATCH_SIZE):
+            question.fingerprint = _stored_fingerprint(question.question, question.choices, question.single_correct_choice)
+            if question.fingerprint:
+                batch.append(question)
+            if len(batch) >= BATCH_SIZE:
+                model.objects.bulk_update(batch, ['fingerprint'])
+                batch = []
+        model.objects.bulk_update(batch, ['fingerprint'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0027_mastery_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_fingerprints, migrations.RunPython.noop),
+    ]
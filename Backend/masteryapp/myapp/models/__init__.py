@@ -5,4 +5,12 @@ from .class_material import ClassMaterial
 from .subject import Subject
 from .material_snippet import MaterialSnippet
 from .question import Question
-from .quiz import Quiz
\ No newline at end of file
+from .quiz import Quiz
+from .llm_usage import LLMUsage
+from .bank_question import BankQuestion
+from .idempotency_key import IdempotencyKey
+from .subject_distractor import SubjectDistractor
+from .snippet_review import SnippetReview
+from .snippet_mastery import SnippetMastery
+from .subject_mastery import SubjectMastery
+from .mastery_version import MasteryVersion
\ No newline at end of file
@@ -0,0 +1,19 @@
+from django.db import models
+from .material_snippet import MaterialSnippet
+import uuid
+
+class BankQuestion(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    snippet = models.ForeignKey(MaterialSnippet, on_delete=models.CASCADE, related_name="bank_questions")
+    question = models.TextField()
+    choices = models.TextField() # Separated by ';;/;;', same as Question.choices
+    single_correct_choice = models.SmallIntegerField()
+    options_per_question = models.SmallIntegerField()
+    times_used = models.PositiveIntegerField(default=0) # Least used questions are served first
+    fingerprint = models.CharField(max_length=128, null=True, blank=True) # Same as Question.fingerprint
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['snippet', 'options_per_question']),
+        ]
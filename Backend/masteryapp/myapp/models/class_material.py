@@ -18,5 +18,7 @@ class ClassMaterial(models.Model):
         null=True
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    rag_file_name = models.CharField(max_length=500, null=True, blank=True) # File holding the snippets in the course corpus
+    rag_file_claimed_at = models.DateTimeField(null=True, blank=True) # Set while a worker uploads the file
     
     
\ No newline at end of file
@@ -13,5 +13,7 @@ class Course(models.Model):
     icon = models.CharField(max_length=300, null=True)
     image_path = models.CharField(max_length=1000, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    rag_corpus_name = models.CharField(max_length=500, null=True, blank=True) # Vertex RAG corpus shared by the course's quizzes
+    rag_corpus_claimed_at = models.DateTimeField(null=True, blank=True) # Set while a worker creates the corpus
     
     
\ No newline at end of file
@@ -0,0 +1,29 @@
+from django.db import models
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+import uuid
+
+class IdempotencyStatus(models.TextChoices):
+    IN_PROGRESS = 'in_progress', 'In progress'
+    COMPLETED = 'completed', 'Completed'
+
+class IdempotencyKey(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    endpoint = models.CharField(max_length=200) # e.g. 'quizzes.create'
+    key = models.CharField(max_length=255) # Idempotency-Key header sent by the client
+    request_hash = models.CharField(max_length=64) # Reusing a key for a different request is rejected
+    status = models.CharField(
+        max_length=20,
+        choices=IdempotencyStatus.choices,
+        default=IdempotencyStatus.IN_PROGRESS,
+    )
+    response_status = models.SmallIntegerField(null=True)
+    response_body = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'endpoint', 'key'], name='unique_idempotency_key'),
+        ]
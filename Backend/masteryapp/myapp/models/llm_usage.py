@@ -0,0 +1,23 @@
+from django.db import models
+from django.contrib.auth.models import User
+from .course import Course
+import uuid
+
+class LLMUsage(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    course = models.ForeignKey(Course, on_delete=models.SET_NULL, null=True)
+    request_id = models.CharField(max_length=64, null=True)
+    endpoint = models.CharField(max_length=200, null=True) # e.g. 'quizzes.create'
+    call_site = models.CharField(max_length=100) # Pipeline task, e.g. 'quiz_generation'
+    model = models.CharField(max_length=100)
+    prompt_tokens = models.IntegerField(default=0)
+    output_tokens = models.IntegerField(default=0)
+    latency_ms = models.IntegerField()
+    success = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+        ]
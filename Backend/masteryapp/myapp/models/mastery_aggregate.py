@@ -0,0 +1,18 @@
+from django.db import models
+from django.contrib.auth.models import User
+import uuid
+
+class MasteryAggregate(models.Model):
+    """Running sums of a user's answers, from which decayed mastery is evaluated (see services/mastery.py)"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    correct_count = models.IntegerField(default=0)
+    correct_days_sum = models.FloatField(default=0) # Sum of the completion times of correct answers, in days since the epoch
+    incorrect_count = models.IntegerField(default=0)
+    incorrect_days_sum = models.FloatField(default=0)
+    evicted_before = models.DateTimeField() # Answers completed at or before this no longer count
+    oldest_answer_at = models.DateTimeField(null=True, blank=True) # Oldest answer still counted, evicted once fully decayed
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
@@ -0,0 +1,7 @@
+from django.db import models
+from django.contrib.auth.models import User
+
+class MasteryVersion(models.Model):
+    """Counter bumped whenever a user's answer history changes, so cached mastery weights know to refresh"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="mastery_version")
+    version = models.PositiveBigIntegerField(default=0)
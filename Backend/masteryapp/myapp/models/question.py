@@ -29,5 +29,6 @@ class Question(models.Model):
     is_correct = models.BooleanField(null=True)
     quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE)
     snippet = models.ForeignKey(MaterialSnippet, on_delete=models.SET_NULL, null=True)
+    fingerprint = models.CharField(max_length=128, null=True, blank=True) # MinHash of question and answer, see services/fingerprint.py
     
     
\ No newline at end of file
@@ -8,6 +8,12 @@ from .material_snippet import MaterialSnippet
 import uuid
 from django.contrib.auth.models import User
 
+class GenerationMode(models.TextChoices):
+    AUTO = 'auto', 'Automatic'
+    DIRECT = 'direct', 'Snippets in the prompt'
+    RAG = 'rag', 'Retrieval from the course corpus'
+    CLOZE = 'cloze', 'Local fill-in-the-blank, no model call'
+
 class Quiz(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -20,4 +26,17 @@ class Quiz(models.Model):
     optimize_learning = models.BooleanField(default=True)
     quiz_length = models.SmallIntegerField(default=20)
     options_per_question = models.SmallIntegerField(default=4)
-    
\ No newline at end of file
+    generation_mode = models.CharField(
+        max_length=10,
+        choices=GenerationMode.choices,
+        default=GenerationMode.AUTO,
+    ) # Stores the resolved mode once the quiz is created.
+    is_warm = models.BooleanField(default=False, db_index=True) # Pre-generated, not handed out yet
+    warm_mastery = models.JSONField(null=True, blank=True) # Subject mastery the warm quiz was weighted with
+    retake_of = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name="retakes") # Attempt whose questions this one reuses
+    
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'course']), # Questions a user has seen in a course
+        ]
@@ -0,0 +1,11 @@
+from django.db import models
+from .mastery_aggregate import MasteryAggregate
+from .material_snippet import MaterialSnippet
+
+class SnippetMastery(MasteryAggregate):
+    snippet = models.ForeignKey(MaterialSnippet, on_delete=models.CASCADE, related_name="masteries")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'snippet'], name='unique_user_snippet_mastery'),
+        ]
@@ -0,0 +1,25 @@
+from django.db import models
+from django.contrib.auth.models import User
+from .course import Course
+from .material_snippet import MaterialSnippet
+import uuid
+
+class SnippetReview(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    snippet = models.ForeignKey(MaterialSnippet, on_delete=models.CASCADE, related_name="reviews")
+    course = models.ForeignKey(Course, on_delete=models.CASCADE) # Copied from the snippet, for the due queue index
+    repetitions = models.PositiveIntegerField(default=0) # Correct reviews in a row
+    lapses = models.PositiveIntegerField(default=0) # Times it was answered wrong
+    ease = models.FloatField(default=2.5) # SM-2 ease factor, at least 1.3
+    interval_days = models.FloatField(default=0)
+    due_at = models.DateTimeField()
+    last_reviewed_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'snippet'], name='unique_user_snippet_review'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'course', 'due_at']), # Due queue of a user in a course
+        ]
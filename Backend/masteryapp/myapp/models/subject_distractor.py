@@ -0,0 +1,23 @@
+from django.db import models
+from .subject import Subject
+import uuid
+
+class DistractorSource(models.TextChoices):
+    GENERATED = 'generated', 'Wrong option of a generated question'
+    KEY_TERM = 'key_term', 'Key term of a snippet'
+
+class SubjectDistractor(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name="distractors")
+    text = models.CharField(max_length=255)
+    source = models.CharField(
+        max_length=20,
+        choices=DistractorSource.choices,
+    )
+    times_seen = models.PositiveIntegerField(default=1) # Harvested this many times; frequent ones are offered first
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['subject', 'text'], name='unique_subject_distractor'),
+        ]
@@ -0,0 +1,11 @@
+from django.db import models
+from .mastery_aggregate import MasteryAggregate
+from .subject import Subject
+
+class SubjectMastery(MasteryAggregate):
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name="masteries")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'subject'], name='unique_user_subject_mastery'),
+        ]
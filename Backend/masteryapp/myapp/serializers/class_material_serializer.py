@@ -4,4 +4,5 @@ from ..models.class_material import ClassMaterial
 class ClassMaterialSerializer(serializers.ModelSerializer):
     class Meta:
         model = ClassMaterial
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+        read_only_fields = ['rag_file_name', 'rag_file_claimed_at']
\ No newline at end of file
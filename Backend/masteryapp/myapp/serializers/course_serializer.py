@@ -4,4 +4,5 @@ from ..models.course import Course
 class CourseSerializer(serializers.ModelSerializer):
     class Meta:
         model = Course
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+        read_only_fields = ['rag_corpus_name', 'rag_corpus_claimed_at']
\ No newline at end of file
@@ -4,4 +4,5 @@ from ..models.quiz import Quiz
 class QuizSerializer(serializers.ModelSerializer):
     class Meta:
         model = Quiz
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+        read_only_fields = ['is_warm', 'warm_mastery', 'retake_of']
\ No newline at end of file
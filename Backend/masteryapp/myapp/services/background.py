@@ -0,0 +1,50 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class Pool:
+    """Thread pool for work that must not hold up (or roll back with) the request that triggered it"""
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Run fn(*args, **kwargs) on the pool, logging failures
+
+        Failures are also set on the returned future for callers that wait on it. Each job closes the database connections of its worker thread when done, since Django
+        opens one connection per thread.
+        """
+        def run():
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                logger.exception(f"Background job {getattr(fn, '__name__', fn)} failed")
+                raise
+            finally:
+                connections.close_all()
+
+        return self._executor.submit(run)
+
+    def owns_current_thread(self) -> bool:
+        """Whether the caller runs on one of this pool's workers (and so must not wait on the pool)"""
+        return threading.current_thread().name.startswith(f"{self.name}_")
+
+
+# Shared pool for indexing, bank filling and other fire-and-forget jobs
+shared = Pool("background", max_workers=4)
+
+
+def submit(fn, *args, **kwargs) -> Future:
+    """Run fn(*args, **kwargs) on the shared background pool (see Pool.submit)"""
+    return shared.submit(fn, *args, **kwargs)
+
+
+def on_shared_pool() -> bool:
+    """Whether the caller is a job of the shared pool"""
+    return shared.owns_current_thread()
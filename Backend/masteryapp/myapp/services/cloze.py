@@ -0,0 +1,236 @@
+import re
+import math
+import random
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from ..models.material_snippet import MaterialSnippet
+from .vector_index import STOP_WORDS
+
+WORD_PATTERN = re.compile(r"[A-Za-z][A-Za-z0-9'\-]*")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+# "X is a ...", "X are ...", "X refers to ...", "X means ..."
+DEFINITION_PATTERN = re.compile(r"^(?P<term>[^,;:]{3,60}?)\s+(?:is|are|refers to|means)\s+(?P<definition>.{15,})$", re.IGNORECASE)
+LEADING_ARTICLE = re.compile(r"^(?:the|a|an)\s+", re.IGNORECASE)
+BLANK = "_____"
+VERB_ENDINGS = ('ing', 'ed', 'ly', 'es')
+
+# Pronouns and determiners: a definition whose term starts with one ("This is important
+# because ...", "Each cell has ...") says nothing about a term
+PRONOUNS_AND_DETERMINERS = frozenset("""
+i you he she it we they me him her us them my your his our their its this that these those
+there here one ones each every either neither any all both some many much few several such
+another other no none nothing something anything everything someone anyone everyone which what
+who whom whose whatever whichever
+""".split())
+# Words too common to be worth asking about, on top of the search stop words
+CLOZE_STOP_WORDS = STOP_WORDS | PRONOUNS_AND_DETERMINERS | frozenset("""
+about after also although among another been before being between both but could did during
+each either even every first had here however into just many may might more most much must
+not now only other others over same should since some such than then there these they those
+through thus under until upon used using very were while whose within without would
+example called known number part type types way ways often usually
+because therefore hence instead rather whether again always never sometimes still already
+important main mainly major certain specific various different several given following
+converts contains consists includes involves allows helps makes gives takes uses becomes
+occurs provides produces requires results leads means refers describes represents shows
+""".split())
+# Sentences asked about, in words
+MIN_SENTENCE_WORDS = 5
+MAX_SENTENCE_WORDS = 60
+# Key terms kept per snippet, as answers and as distractors for the snippet's subject
+TERMS_PER_SNIPPET = 8
+
+
+def _sentences(text: str) -> List[str]:
+    return [
+        sentence.strip() for sentence in SENTENCE_END.split(' '.join(text.split()))
+        if MIN_SENTENCE_WORDS <= len(sentence.split()) <= MAX_SENTENCE_WORDS
+    ]
+
+
+def _is_term_word(token: str) -> bool:
+    lowered = token.lower()
+    if lowered in CLOZE_STOP_WORDS or len(lowered) < 4:
+        return False
+    # Without a tagger, lowercase verb and adverb forms are the likeliest non-terms
+    return token[0].isupper() or not lowered.endswith(VERB_ENDINGS)
+
+
+def _is_definition_term(term: str) -> bool:
+    words = term.lower().split()
+    if not words or len(words) > 4 or words[0] in PRONOUNS_AND_DETERMINERS:
+        return False
+    return not all(word in CLOZE_STOP_WORDS for word in words)
+
+
+def _candidate_terms(text: str, phrases: Optional[Counter] = None) -> Dict[str, str]:
+    """Words and two-word phrases worth asking about, lowercased, with their first spelling in the text
+
+    Two-word phrases are kept when both words are capitalised (names) or when the phrase recurs
+    in phrases (counts over the whole subject), which filters out chance word pairs.
+    """
+    tokens = WORD_PATTERN.findall(text)
+    terms: Dict[str, str] = {}
+    for index, token in enumerate(tokens):
+        if not _is_term_word(token):
+            continue
+        terms.setdefault(token.lower(), token)
+        if index + 1 < len(tokens) and _is_term_word(tokens[index + 1]):
+            following = tokens[index + 1]
+            phrase = f"{token.lower()} {following.lower()}"
+            if (token[0].isupper() and following[0].isupper()) or (phrases is not None and phrases[phrase] > 1):
+                terms.setdefault(phrase, f"{token} {following}")
+    return terms
+
+
+def _term_counts(text: str) -> Counter:
+    tokens = [token.lower() for token in WORD_PATTERN.findall(text)]
+    return Counter(tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])])
+
+
+class SubjectTerms:
+    """Key terms of every snippet of some subjects, scored by TF-IDF within their subject"""
+
+    def __init__(self, snippet_rows: Sequence[Tuple]):
+        """
+        Args:
+            snippet_rows: (snippet id, subject id, snippet text) of every snippet of the subjects
+        """
+        by_subject: Dict[str, List[Tuple[str, str]]] = {}
+        for snippet_id, subject_id, text in snippet_rows:
+            by_subject.setdefault(str(subject_id), []).append((str(snippet_id), text))
+
+        self.snippet_terms: Dict[str, List[str]] = {}
+        self.subject_terms: Dict[str, List[str]] = {}
+        self.snippet_subject: Dict[str, str] = {}
+        for subject_id, snippets in by_subject.items():
+            counts = {snippet_id: _term_counts(text) for snippet_id, text in snippets}
+            phrases = sum(counts.values(), Counter())
+            analysed = [
+                (snippet_id, _candidate_terms(text, phrases), counts[snippet_id]) for snippet_id, text in snippets
+            ]
+            document_frequency = Counter(term for _, candidates, _ in analysed for term in candidates)
+            subject_terms = {}
+            for snippet_id, candidates, counts in analysed:
+                scored = sorted(
+                    candidates,
+                    key=lambda term: -self._score(term, candidates[term], counts, document_frequency, len(snippets)),
+                )[:TERMS_PER_SNIPPET]
+                self.snippet_terms[snippet_id] = [candidates[term] for term in scored]
+                self.snippet_subject[snippet_id] = subject_id
+                for term in scored:
+                    subject_terms.setdefault(term, candidates[term])
+            self.subject_terms[subject_id] = list(subject_terms.values())
+
+    @staticmethod
+    def _score(term: str, spelling: str, counts: Counter, document_frequency: Counter, documents: int) -> float:
+        idf = math.log((1 + documents) / (1 + document_frequency[term])) + 1
+        score = counts[term] * idf
+        if ' ' in term:
+            score *= 1.5 # Phrases make sharper blanks than single words
+        if spelling[0].isupper():
+            score *= 1.2 # Names and proper nouns
+        return score + len(term) / 100
+
+    @classmethod
+    def for_subjects(cls, subject_ids: Iterable) -> "SubjectTerms":
+        """Analyse every snippet of some subjects, in one query"""
+        return cls(MaterialSnippet.objects.filter(
+            subject_id__in=set(subject_ids)
+        ).values_list('id', 'subject_id', 'snippet'))
+
+    @classmethod
+    def for_snippets(cls, snippets: Sequence[MaterialSnippet]) -> "SubjectTerms":
+        """Analyse every snippet of the subjects of the given snippets, in one query"""
+        return cls.for_subjects(snippet.subject_id for snippet in snippets)
+
+
+def _blank_out(sentence: str, term: str) -> Optional[str]:
+    pattern = re.compile(rf"(?<![A-Za-z0-9]){re.escape(term)}(?![A-Za-z0-9])", re.IGNORECASE)
+    if not pattern.search(sentence):
+        return None
+    return pattern.sub(BLANK, sentence)
+
+
+def _questions_for(snippet: MaterialSnippet, terms: SubjectTerms) -> List[Tuple[str, str]]:
+    """(question, answer) pairs for a snippet, best first: definitions, then blanks of its key terms"""
+    sentences = _sentences(snippet.snippet)
+    key_terms = terms.snippet_terms.get(str(snippet.id), [])
+    questions = []
+    for sentence in sentences:
+        match = DEFINITION_PATTERN.match(sentence.rstrip('.'))
+        if match:
+            term = LEADING_ARTICLE.sub('', match.group('term').strip())
+            if _is_definition_term(term):
+                questions.append((f'Which term matches this description: "{match.group("definition").strip()}"?', term))
+    for term in key_terms:
+        for sentence in sentences:
+            blanked = _blank_out(sentence, term)
+            if blanked is not None:
+                questions.append((f'Fill in the blank: "{blanked}"', term))
+                break
+    return questions
+
+
+def _distractors(answer: str, question: str, snippet_id: str, terms: SubjectTerms, count: int, rng) -> List[str]:
+    """Key terms of the subject's other snippets, closest in shape to the answer first
+
+    The snippet's own other key terms are only used when its subject has too few.
+    """
+    answer_lower = answer.lower()
+    question_lower = question.lower()
+    own_terms = set(terms.snippet_terms.get(snippet_id, []))
+    taken = {answer_lower}
+    candidates = []
+    for term in terms.subject_terms.get(terms.snippet_subject.get(snippet_id), []):
+        lowered = term.lower()
+        if lowered in taken or lowered in question_lower or lowered in answer_lower or answer_lower in lowered:
+            continue
+        taken.add(lowered)
+        candidates.append(term)
+    rng.shuffle(candidates)
+    # Same number of words and similar length make the right answer harder to guess by its look
+    candidates.sort(key=lambda term: (
+        term in own_terms,
+        abs(len(term.split()) - len(answer.split())),
+        abs(len(term) - len(answer)) // 4,
+    ))
+    return candidates[:count]
+
+
+def generate_cloze_questions(snippets: Sequence[MaterialSnippet], options_per_question: int,
+                             rng=random) -> List[Dict]:
+    """Build multiple-choice questions from snippet text alone, without a model call
+
+    Each snippet gets a term-definition question when one of its sentences defines a term ("X is
+    ..."), or else a fill-in-the-blank over one of its key terms (TF-IDF within its subject).
+    Distractors are key terms of other snippets of the same subject. A snippet selected several
+    times gets its next question each time; snippets without a usable sentence or enough
+    distractors are skipped.
+
+    Returns:
+        List of questions in the generated format (snippet_id, question, choices, answer_index)
+    """
+    terms = SubjectTerms.for_snippets(snippets)
+    asked: Counter = Counter()
+    questions = []
+    for snippet in snippets:
+        snippet_id = str(snippet.id)
+        candidates = _questions_for(snippet, terms)
+        if not candidates:
+            continue
+        question, answer = candidates[asked[snippet_id] % len(candidates)]
+        asked[snippet_id] += 1
+        distractors = _distractors(answer, question, snippet_id, terms, options_per_question - 1, rng)
+        if len(distractors) < options_per_question - 1:
+            continue
+        answer_index = rng.randrange(options_per_question)
+        choices = distractors[:answer_index] + [answer] + distractors[answer_index:]
+        questions.append({
+            'snippet_id' : snippet_id,
+            'question' : question,
+            'choices' : choices,
+            'answer_index' : answer_index,
+        })
+    return questions
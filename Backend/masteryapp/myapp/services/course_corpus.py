@@ -0,0 +1,159 @@
+import time
+import logging
+import datetime
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from ..models.course import Course
+from ..models.class_material import ClassMaterial
+from ..models.material_snippet import MaterialSnippet
+from ..gcp.rag_question_maker import QuizMakerRAG
+from ..gcp.request_context import DeadlineExceeded, remaining_time
+from . import background
+
+logger = logging.getLogger(__name__)
+
+# A corpus creation or upload claimed longer ago than this is considered dead, in seconds
+CLAIM_SECONDS = 600
+# How often a worker waiting on another one's upload checks for its result, in seconds
+POLL_INTERVAL_SECONDS = 1.0
+
+
+def _create_once(model, pk, result_field: str, claim_field: str, create) -> str:
+    """Return a row's result field, computing it with create(row) exactly once across workers
+
+    The row lock is only held to read the field and claim the work, never across the Vertex
+    call, so quiz creation and other writers are not blocked by it. A worker that finds the work
+    claimed waits for the result; a claim older than CLAIM_SECONDS is considered dead and taken
+    over.
+    """
+    while True:
+        with transaction.atomic():
+            row = model.objects.select_for_update().get(pk=pk)
+            result = getattr(row, result_field)
+            if result:
+                return result
+            claimed_at = getattr(row, claim_field)
+            now = timezone.now()
+            if claimed_at is None or now - claimed_at > datetime.timedelta(seconds=CLAIM_SECONDS):
+                model.objects.filter(pk=pk).update(**{claim_field: now})
+                break
+        remaining = remaining_time()
+        if remaining is not None and remaining <= POLL_INTERVAL_SECONDS:
+            raise DeadlineExceeded(f"Request deadline exceeded waiting for {model.__name__} {pk} to be indexed")
+        time.sleep(POLL_INTERVAL_SECONDS)
+
+    try:
+        result = create(row)
+    except BaseException:
+        model.objects.filter(pk=pk, **{claim_field: now}).update(**{claim_field: None})
+        raise
+    model.objects.filter(pk=pk).update(**{result_field: result, claim_field: None})
+    return result
+
+
+def ensure_course_corpus(course_id) -> str:
+    """Return the course's RAG corpus, creating it on first use
+
+    Concurrent callers share one corpus (see _create_once).
+    """
+    return _create_once(
+        Course, course_id, 'rag_corpus_name', 'rag_corpus_claimed_at',
+        lambda course: QuizMakerRAG().create_course_corpus(display_name=f"course-{course.id}"),
+    )
+
+
+def _upload_material(material: ClassMaterial) -> str:
+    corpus_name = ensure_course_corpus(material.course_id)
+    snippets = MaterialSnippet.objects.filter(class_material=material).select_related('subject')
+    data_list = [{
+        'id' : str(snippet.id),
+        'subject' : snippet.subject.name if snippet.subject else None,
+        'snippet' : snippet.snippet,
+    } for snippet in snippets]
+    return QuizMakerRAG().upload_snippets(corpus_name, data_list, display_name=str(material.id))
+
+
+def index_material(material_id) -> str:
+    """Upload a material's snippets as one file of its course corpus, if not done yet
+
+    Returns:
+        str: The RAG file name of the material
+    """
+    return _create_once(ClassMaterial, material_id, 'rag_file_name', 'rag_file_claimed_at', _upload_material)
+
+
+def index_course_materials(course_id, material_ids: Iterable) -> Tuple[str, Dict[str, str]]:
+    """Make sure the course corpus holds the given materials
+
+    Returns:
+        Tuple of the corpus name and a map of material id to RAG file name
+    """
+    corpus_name = ensure_course_corpus(course_id)
+    rag_file_names = {str(material_id): index_material(material_id) for material_id in material_ids}
+    return corpus_name, rag_file_names
+
+
+def retrieval_scope(course_id, material_ids: Iterable) -> Tuple[Optional[str], Dict[str, str]]:
+    """Corpus of a course and RAG file of each given material, indexing whatever is missing
+
+    Materials are normally indexed right after ingestion, so this is a lookup. Anything still
+    missing (older materials, failed indexing) is indexed on the background pool, which commits
+    independently of the caller's transaction, and waited for until the request deadline. Jobs
+    already running on that pool index inline instead, since waiting on the pool from one of its
+    own workers can deadlock.
+    Call this before the caller writes rows referencing the course, since indexing updates it.
+
+    Returns:
+        Tuple of the corpus name and a map of material id to RAG file name
+    """
+    material_ids = {str(material_id) for material_id in material_ids}
+    course = Course.objects.get(pk=course_id)
+    rag_file_names = {
+        str(material_id): rag_file_name
+        for material_id, rag_file_name in ClassMaterial.objects.filter(
+            pk__in=material_ids, rag_file_name__isnull=False
+        ).values_list('id', 'rag_file_name')
+    }
+    if course.rag_corpus_name and len(rag_file_names) == len(material_ids):
+        return course.rag_corpus_name, rag_file_names
+    if not material_ids:
+        return course.rag_corpus_name, {}
+
+    if background.on_shared_pool():
+        return index_course_materials(course_id, material_ids)
+    future = background.submit(index_course_materials, course_id, material_ids)
+    try:
+        return future.result(timeout=remaining_time())
+    except FutureTimeoutError:
+        raise DeadlineExceeded("Request deadline exceeded while indexing course materials")
+
+
+def schedule_material_indexing(material_id):
+    """Index a freshly ingested material once the transaction that created it commits"""
+    transaction.on_commit(lambda: background.submit(index_material, material_id))
+
+
+def schedule_material_removal(material: ClassMaterial):
+    """Delete a material's file from the course corpus once its deletion commits"""
+    rag_file_name = material.rag_file_name
+    if rag_file_name:
+        transaction.on_commit(lambda: background.submit(_delete_file, rag_file_name))
+
+
+def schedule_corpus_removal(course: Course):
+    """Delete a course's corpus (and every file in it) once the course deletion commits"""
+    corpus_name = course.rag_corpus_name
+    if corpus_name:
+        transaction.on_commit(lambda: background.submit(_delete_corpus, corpus_name))
+
+
+def _delete_file(rag_file_name: str):
+    QuizMakerRAG().delete_file(rag_file_name)
+
+
+def _delete_corpus(corpus_name: str):
+    QuizMakerRAG().delete_corpus(corpus_name)
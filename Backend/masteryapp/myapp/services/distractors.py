@@ -0,0 +1,126 @@
+import random
+import logging
+from typing import Dict, Iterable, List, Sequence
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from ..models.material_snippet import MaterialSnippet
+from ..models.subject_distractor import SubjectDistractor, DistractorSource
+from .cloze import SubjectTerms
+from . import background
+
+logger = logging.getLogger(__name__)
+
+MAX_DISTRACTOR_LENGTH = SubjectDistractor._meta.get_field('text').max_length
+# Options that only make sense next to the other options of their question
+CONTEXTUAL_OPTIONS = frozenset({
+    'all of the above', 'none of the above', 'both of the above', 'neither of the above',
+    'all of these', 'none of these', 'both a and b', 'true', 'false',
+})
+
+
+def _is_reusable(text: str) -> bool:
+    text = text.strip()
+    return 2 <= len(text) <= MAX_DISTRACTOR_LENGTH and text.lower().rstrip('.') not in CONTEXTUAL_OPTIONS
+
+
+def _add_to_pools(texts_by_subject: Dict[str, Iterable[str]], source: str) -> int:
+    """Insert new distractors and count the ones harvested again
+
+    Returns:
+        int: Number of distractors added
+    """
+    added = 0
+    for subject_id, texts in texts_by_subject.items():
+        texts = {text.strip() for text in texts if _is_reusable(text)}
+        if not texts:
+            continue
+        existing = set(SubjectDistractor.objects.filter(subject_id=subject_id, text__in=texts).values_list('text', flat=True))
+        SubjectDistractor.objects.filter(subject_id=subject_id, text__in=existing).update(times_seen=F('times_seen') + 1)
+        SubjectDistractor.objects.bulk_create(
+            [SubjectDistractor(subject_id=subject_id, text=text, source=source) for text in texts - existing],
+            ignore_conflicts=True,
+        )
+        added += len(texts - existing)
+    return added
+
+
+def harvest_generated_distractors(questions_raw: Sequence[Dict]) -> int:
+    """Add the wrong options of generated questions to the pools of their snippets' subjects
+
+    Questions whose options were taken from the pool are skipped.
+    """
+    if not settings.DISTRACTOR_POOL_CANDIDATES:
+        return 0
+    questions_raw = [question_raw for question_raw in questions_raw if not question_raw.get('pooled')]
+    snippet_subjects = dict(MaterialSnippet.objects.filter(
+        pk__in={question_raw['snippet_id'] for question_raw in questions_raw}
+    ).values_list('id', 'subject_id'))
+    snippet_subjects = {str(snippet_id): str(subject_id) for snippet_id, subject_id in snippet_subjects.items()}
+
+    wrong_options: Dict[str, List[str]] = {}
+    for question_raw in questions_raw:
+        subject_id = snippet_subjects.get(str(question_raw['snippet_id']))
+        if subject_id is None:
+            continue
+        answer_index = int(question_raw['answer_index'])
+        correct = str(question_raw['choices'][answer_index]).strip().lower()
+        wrong_options.setdefault(subject_id, []).extend(
+            str(choice) for index, choice in enumerate(question_raw['choices'])
+            if index != answer_index and str(choice).strip().lower() != correct
+        )
+    added = _add_to_pools(wrong_options, DistractorSource.GENERATED)
+    logger.info(f"Harvested {added} new distractors from {len(questions_raw)} generated questions")
+    return added
+
+
+def harvest_key_terms(subject_ids: Iterable) -> int:
+    """Add the key terms of every snippet of some subjects (see cloze.SubjectTerms) to their pools"""
+    if not settings.DISTRACTOR_POOL_CANDIDATES:
+        return 0
+    terms = SubjectTerms.for_subjects(subject_ids)
+    added = _add_to_pools(terms.subject_terms, DistractorSource.KEY_TERM)
+    logger.info(f"Harvested {added} new key term distractors")
+    return added
+
+
+def schedule_distractor_harvest(questions_raw: Sequence[Dict]):
+    """Harvest the wrong options of generated questions once the current transaction commits"""
+    questions_raw = [dict(question_raw) for question_raw in questions_raw if not question_raw.get('pooled')]
+    if questions_raw:
+        transaction.on_commit(lambda: background.submit(harvest_generated_distractors, questions_raw))
+
+
+def schedule_key_term_harvest(subject_ids: Iterable):
+    """Harvest the key terms of some subjects once the current transaction commits"""
+    subject_ids = {str(subject_id) for subject_id in subject_ids}
+    if subject_ids:
+        transaction.on_commit(lambda: background.submit(harvest_key_terms, subject_ids))
+
+
+def distractor_candidates(subject_ids: Iterable, options_per_question: int, rng=random) -> Dict[str, List[str]]:
+    """Candidate wrong options per subject, for generation to pick from, in one query
+
+    Only subjects with at least twice the wrong options a question needs get candidates, so the
+    model can leave out the ones that do not fit its question. Each list is a random sample of
+    DISTRACTOR_POOL_CANDIDATES, drawn from the most often harvested entries.
+
+    Returns:
+        Dict of subject id (as a string) to candidate texts
+    """
+    size = settings.DISTRACTOR_POOL_CANDIDATES
+    if not size:
+        return {}
+    pools: Dict[str, List[str]] = {}
+    for subject_id, text in SubjectDistractor.objects.filter(
+        subject_id__in=set(subject_ids)
+    ).order_by('-times_seen').values_list('subject_id', 'text'):
+        pools.setdefault(str(subject_id), []).append(text)
+
+    candidates = {}
+    for subject_id, texts in pools.items():
+        if len(texts) >= 2 * (options_per_question - 1):
+            candidates[subject_id] = rng.sample(texts[:3 * size], min(size, len(texts)))
+    return candidates
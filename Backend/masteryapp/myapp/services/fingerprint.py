@@ -0,0 +1,115 @@
+import random
+import zlib
+from typing import Dict, Iterable, List, Optional
+
+from ..models.question import Question
+from .vector_index import TOKEN_PATTERN, STOP_WORDS
+
+# MinHash signature size, split into LSH bands: two questions become duplicate candidates when
+# all the values of one band match, which is likely from a Jaccard similarity of ~(1/BANDS)^(1/ROWS)
+NUM_HASHES = 16
+BANDS = 4
+ROWS = NUM_HASHES // BANDS
+# Share of equal signature values from which two questions count as the same question
+NEAR_DUPLICATE_SIMILARITY = 0.7
+# Seen questions listed per snippet in generation prompts, most recent first
+MAX_AVOIDED_PER_SNIPPET = 5
+# Most recent questions of a user in a course checked for repeats; older ones may come back
+MAX_SEEN_QUESTIONS = 1000
+
+_PRIME = (1 << 61) - 1
+_seeds = random.Random(20250323)
+_HASH_PARAMS = [(_seeds.randrange(1, _PRIME), _seeds.randrange(0, _PRIME)) for _ in range(NUM_HASHES)]
+
+
+def _shingles(text: str) -> List[int]:
+    # Same normalisation as the hashing embedder: stop words dropped, plurals folded
+    words = [word[:-1] if len(word) > 3 and word.endswith('s') and not word.endswith('ss') else word
+             for word in TOKEN_PATTERN.findall(text.lower()) if word not in STOP_WORDS]
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    return [zlib.crc32(feature.encode("utf-8")) for feature in features] or [0]
+
+
+def question_fingerprint(question: str, correct_answer: str) -> str:
+    """MinHash signature of a question stem and its correct answer, as a hex string
+
+    Rewordings that keep most words (and the answer) get mostly equal signature values, so
+    similarity() approximates the Jaccard similarity of their word sets.
+    """
+    shingles = _shingles(f"{question} {correct_answer}")
+    return ''.join(
+        f"{min((a * shingle + b) % _PRIME for shingle in shingles) & 0xFFFFFFFF:08x}"
+        for a, b in _HASH_PARAMS
+    )
+
+
+def _stored_fingerprint(question: str, choices: str, correct_choice: Optional[int]) -> Optional[str]:
+    choices = choices.split(';;/;;')
+    if correct_choice is None or not 0 <= correct_choice < len(choices):
+        return None
+    return question_fingerprint(question, choices[correct_choice])
+
+
+def similarity(fingerprint: str, other: str) -> float:
+    """Estimated Jaccard similarity of the questions behind two fingerprints"""
+    equal = sum(fingerprint[i:i + 8] == other[i:i + 8] for i in range(0, NUM_HASHES * 8, 8))
+    return equal / NUM_HASHES
+
+
+def _bands(fingerprint: str) -> List[str]:
+    return [f"{band}:{fingerprint[band * ROWS * 8:(band + 1) * ROWS * 8]}" for band in range(BANDS)]
+
+
+class FingerprintIndex:
+    """LSH index over question fingerprints, for near-duplicate lookups without pairwise comparisons"""
+
+    def __init__(self):
+        self._buckets: Dict[str, List[str]] = {}
+
+    def add(self, fingerprint: str):
+        for band in _bands(fingerprint):
+            self._buckets.setdefault(band, []).append(fingerprint)
+
+    def contains(self, fingerprint: Optional[str]) -> bool:
+        """Whether a near duplicate of the fingerprint was added"""
+        if not fingerprint:
+            return False
+        return any(
+            similarity(fingerprint, candidate) >= NEAR_DUPLICATE_SIMILARITY
+            for band in _bands(fingerprint)
+            for candidate in self._buckets.get(band, ())
+        )
+
+
+class SeenQuestions:
+    """Questions a user was already given in a course: their fingerprints and stems per snippet"""
+
+    def __init__(self, rows: Iterable = ()):
+        self.index = FingerprintIndex()
+        self._stems: Dict[str, List[str]] = {}
+        for snippet_id, question, fingerprint in rows:
+            if fingerprint:
+                self.index.add(fingerprint)
+            if snippet_id is not None:
+                self._stems.setdefault(str(snippet_id), []).append(question)
+
+    @classmethod
+    def for_course(cls, user, course_id) -> "SeenQuestions":
+        """Load the user's MAX_SEEN_QUESTIONS latest questions of a course in one query
+
+        Warm quizzes not handed out are excluded. Fingerprints of questions saved before they
+        existed were backfilled by migration 0028.
+        """
+        rows = (
+            Question.objects.filter(quiz__user=user, quiz__course_id=course_id, quiz__is_warm=False)
+            .order_by('-quiz__created_at')
+            .values_list('snippet_id', 'question', 'fingerprint')[:MAX_SEEN_QUESTIONS]
+        )
+        return cls(rows)
+
+    def contains(self, fingerprint: Optional[str]) -> bool:
+        return self.index.contains(fingerprint)
+
+    def stems(self, snippet_id) -> List[str]:
+        """Most recent distinct question stems asked about a snippet"""
+        return list(dict.fromkeys(self._stems.get(str(snippet_id), ())))[:MAX_AVOIDED_PER_SNIPPET]
@@ -0,0 +1,185 @@
+import json
+import time
+import hashlib
+import datetime
+import functools
+import logging
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from ..models.idempotency_key import IdempotencyKey, IdempotencyStatus
+from ..gcp.request_context import remaining_time
+from . import background
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+# How often a retry checks whether the original request finished, in seconds
+POLL_INTERVAL_SECONDS = 0.5
+# Expired keys are purged at most this often per process, in seconds
+PURGE_INTERVAL_SECONDS = 3600
+
+_last_purge = 0.0
+
+
+def request_fingerprint(request) -> str:
+    """Hash of what a request asks for, uploaded files included by name and size"""
+    data = request.data
+    if hasattr(data, 'getlist'):
+        data = {key: data.getlist(key) for key in data if key not in request.FILES}
+    files = {key: [(file.name, file.size) for file in request.FILES.getlist(key)] for key in request.FILES}
+    payload = json.dumps([request.method, request.path, data, files], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _is_final(response_status: int) -> bool:
+    """Successes and client errors are replayed; server errors, throttling and timeouts are retried"""
+    return response_status < 500 and response_status not in (
+        status.HTTP_408_REQUEST_TIMEOUT, status.HTTP_409_CONFLICT, status.HTTP_429_TOO_MANY_REQUESTS,
+    )
+
+
+def _claim(user, endpoint: str, key: str, request_hash: str) -> Tuple[Optional[IdempotencyKey], Optional[IdempotencyKey]]:
+    """Take a key for this request, or return the record already holding it
+
+    Returns:
+        Tuple of the claimed record (None if the key is taken) and the existing record
+    """
+    now = timezone.now()
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                claimed = IdempotencyKey.objects.create(
+                    user=user,
+                    endpoint=endpoint,
+                    key=key,
+                    request_hash=request_hash,
+                    expires_at=now + datetime.timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS),
+                )
+            return claimed, None
+        except IntegrityError:
+            existing = IdempotencyKey.objects.filter(user=user, endpoint=endpoint, key=key).first()
+            if existing is None:
+                continue # Released in between
+            abandoned = (
+                existing.status == IdempotencyStatus.IN_PROGRESS
+                and now - existing.created_at > datetime.timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS)
+            )
+            if existing.expires_at > now and not abandoned:
+                return None, existing
+            # Expired, or held by a request that died: free it and claim it again
+            IdempotencyKey.objects.filter(pk=existing.pk).delete()
+    return None, IdempotencyKey.objects.filter(user=user, endpoint=endpoint, key=key).first()
+
+
+def _wait_for(record: IdempotencyKey) -> Optional[IdempotencyKey]:
+    """Wait for the request holding a key to finish
+
+    Returns:
+        The record once completed, or still in progress after IDEMPOTENCY_WAIT_SECONDS (or the
+        request deadline); None if it was released because the original request failed
+    """
+    wait = settings.IDEMPOTENCY_WAIT_SECONDS
+    remaining = remaining_time()
+    if remaining is not None:
+        wait = min(wait, remaining)
+    give_up_at = time.monotonic() + wait
+    while record.status == IdempotencyStatus.IN_PROGRESS:
+        if time.monotonic() >= give_up_at:
+            return record
+        time.sleep(POLL_INTERVAL_SECONDS)
+        record = IdempotencyKey.objects.filter(pk=record.pk).first()
+        if record is None:
+            return None
+    return record
+
+
+def _replay(record: IdempotencyKey) -> Response:
+    return Response(record.response_body, status=record.response_status, headers={'Idempotent-Replayed': 'true'})
+
+
+def purge_expired_keys() -> int:
+    """Delete expired idempotency keys
+
+    Returns:
+        int: Number of keys deleted
+    """
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lt=timezone.now()).delete()
+    return deleted
+
+
+def _schedule_purge():
+    global _last_purge
+    if time.monotonic() - _last_purge >= PURGE_INTERVAL_SECONDS:
+        _last_purge = time.monotonic()
+        background.submit(purge_expired_keys)
+
+
+def idempotent(endpoint: str):
+    """Make a viewset action safe to retry with an Idempotency-Key header
+
+    The first request with a key runs the action and stores its response. Retries with the same
+    key (per user and endpoint) get that response back, waiting for it if the first request is
+    still running, so a retried upload or quiz creation does not run the pipeline twice.
+    Responses that are worth retrying (server errors, throttling) release the key instead.
+    Requests without the header are not affected.
+
+    Must wrap the action outside its transaction, so the claimed key is visible to concurrent
+    requests.
+    """
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key or not request.user.is_authenticated:
+                return view_method(self, request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response({
+                    'error' : f'{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters.'
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            _schedule_purge()
+            request_hash = request_fingerprint(request)
+            # Claim the key, or attach to the request holding it; if that request fails and
+            # releases the key while we wait, this one takes over
+            for _ in range(2):
+                claimed, existing = _claim(request.user, endpoint, key, request_hash)
+                if claimed is not None:
+                    break
+                if existing is not None and existing.request_hash != request_hash:
+                    return Response({
+                        'error' : f'{IDEMPOTENCY_HEADER} was already used for a different request.'
+                    }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                record = _wait_for(existing) if existing is not None else None
+                if record is not None and record.status == IdempotencyStatus.COMPLETED:
+                    logger.info(f"Replaying {endpoint} response for idempotency key {key}")
+                    return _replay(record)
+                if record is not None:
+                    break # Still running
+            if claimed is None:
+                return Response({
+                    'error' : 'A request with this idempotency key is still in progress. Please retry later.'
+                }, status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'})
+
+            try:
+                response = view_method(self, request, *args, **kwargs)
+            except BaseException:
+                claimed.delete()
+                raise
+
+            if _is_final(response.status_code) and hasattr(response, 'data'):
+                claimed.status = IdempotencyStatus.COMPLETED
+                claimed.response_status = response.status_code
+                claimed.response_body = response.data
+                claimed.save(update_fields=['status', 'response_status', 'response_body'])
+            else:
+                claimed.delete()
+            return response
+        return wrapper
+    return decorator
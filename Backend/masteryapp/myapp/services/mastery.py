@@ -0,0 +1,359 @@
+import datetime
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from ..models.question import Question
+from ..models.material_snippet import MaterialSnippet
+from ..models.snippet_mastery import SnippetMastery
+from ..models.subject_mastery import SubjectMastery
+from ..models.mastery_version import MasteryVersion
+
+# Snippet mastery shown to users is clamped to [0, MAX_SNIPPET_MASTERY]
+MAX_SNIPPET_MASTERY = 7
+# Every answer counts ±(1 - DECAY_PER_DAY * its age in days), until it has fully decayed
+DECAY_PER_DAY = 0.01
+DECAY_DAYS = 100
+SECONDS_PER_DAY = 86400
+
+# An answer of a submitted quiz: (snippet id, quiz completion time, whether it was correct)
+Answer = Tuple[object, datetime.datetime, bool]
+# How answers are grouped into a kind of aggregate
+_Kind = namedtuple('_Kind', ['model', 'answer_key'])
+SNIPPET = _Kind(SnippetMastery, 'snippet_id')
+SUBJECT = _Kind(SubjectMastery, 'snippet__subject_id')
+AGGREGATE_FIELDS = ['correct_count', 'correct_days_sum', 'incorrect_count', 'incorrect_days_sum']
+
+
+def compute_weight(mastery):
+    # but if mastery is negative, we further add the weight: weight = 1 + abs(mastery).
+    # maybe the weighing is to be reworked.
+    if mastery >= 0:
+        return 1 / (1 + mastery)
+    else:
+        return 1 + abs(mastery)
+
+
+def _days(moment: datetime.datetime) -> float:
+    return moment.timestamp() / SECONDS_PER_DAY
+
+
+def _cutoff(now: datetime.datetime) -> datetime.datetime:
+    return now - datetime.timedelta(days=DECAY_DAYS)
+
+
+def decayed_mastery(aggregate, now: datetime.datetime) -> float:
+    """Sum of ±(1 - 0.01 * age in days) over the answers of an aggregate, in O(1)
+
+    Expanding the sum over correct answers at times t gives C * (1 - 0.01 * now) + 0.01 * sum(t),
+    and likewise for incorrect ones, so counts and time sums are enough. Only valid while no
+    counted answer is older than DECAY_DAYS, which _evict ensures.
+    """
+    now_days = _days(now)
+    return (
+        (aggregate.correct_count - aggregate.incorrect_count) * (1 - DECAY_PER_DAY * now_days)
+        + DECAY_PER_DAY * (aggregate.correct_days_sum - aggregate.incorrect_days_sum)
+    )
+
+
+def _add(aggregate, completed_at: datetime.datetime, correct: bool, count: int):
+    """Add count answers to an aggregate in memory (remove them with a negative count)"""
+    if correct:
+        aggregate.correct_count += count
+        aggregate.correct_days_sum += count * _days(completed_at)
+    else:
+        aggregate.incorrect_count += count
+        aggregate.incorrect_days_sum += count * _days(completed_at)
+
+
+def _answers(user, kind: _Kind, keys, after=None, until=None):
+    """Answered questions of a user under some aggregate keys, completed in (after, until]"""
+    answers = Question.objects.filter(
+        quiz__user=user, quiz__completed_at__isnull=False, is_correct__isnull=False,
+        **{f'{kind.answer_key}__in': keys}
+    )
+    if after is not None:
+        answers = answers.filter(quiz__completed_at__gt=after)
+    if until is not None:
+        answers = answers.filter(quiz__completed_at__lte=until)
+    return answers
+
+
+def _evict(user, kind: _Kind, aggregates: Dict[str, object], now: datetime.datetime, save: bool = False):
+    """Drop fully decayed answers from aggregates whose oldest answer is older than DECAY_DAYS
+
+    Runs only when some answer has expired, and reads only the expired answers. Reads evict in
+    memory only; with save (write path), each row is also updated relative to its stored sums
+    and only if no one evicted it in the meantime, so concurrent submissions are not lost.
+    """
+    cutoff = _cutoff(now)
+    expired = {
+        key: aggregate for key, aggregate in aggregates.items()
+        if aggregate.oldest_answer_at is not None and aggregate.oldest_answer_at <= cutoff
+    }
+    if not expired:
+        return
+
+    before = {key: aggregate.evicted_before for key, aggregate in expired.items()}
+    deltas = {key: kind.model(**dict.fromkeys(AGGREGATE_FIELDS, 0)) for key in expired}
+    expired_answers = (
+        _answers(user, kind, expired.keys(), after=min(before.values()), until=cutoff)
+        .values(kind.answer_key, 'quiz__completed_at', 'is_correct')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    for row in expired_answers:
+        key = str(row[kind.answer_key])
+        if row['quiz__completed_at'] > before[key]:
+            _add(deltas[key], row['quiz__completed_at'], row['is_correct'], row['count'])
+    oldest = {
+        str(row[kind.answer_key]): row['oldest']
+        for row in _answers(user, kind, expired.keys(), after=cutoff)
+        .values(kind.answer_key).annotate(oldest=Min('quiz__completed_at')).order_by()
+    }
+
+    for key, aggregate in expired.items():
+        delta = deltas[key]
+        if save:
+            kind.model.objects.filter(pk=aggregate.pk, evicted_before=aggregate.evicted_before).update(
+                evicted_before=cutoff,
+                oldest_answer_at=oldest.get(key),
+                **{field: F(field) - getattr(delta, field) for field in AGGREGATE_FIELDS}
+            )
+        for field in AGGREGATE_FIELDS:
+            setattr(aggregate, field, getattr(aggregate, field) - getattr(delta, field))
+        aggregate.evicted_before = cutoff
+        aggregate.oldest_answer_at = oldest.get(key)
+
+
+def _build(user, subject_ids, now: datetime.datetime,
+           save: bool = True) -> Tuple[Dict[str, SubjectMastery], Dict[str, SnippetMastery]]:
+    """Compute the aggregates of some subjects and of their snippets from the answer history
+
+    One query over the answers that have not fully decayed. With save, existing snippet rows of
+    these subjects are replaced and the new rows stored; without, nothing is written.
+
+    Returns:
+        Tuple of the subject aggregates by subject id and the snippet aggregates by snippet id
+    """
+    cutoff = _cutoff(now)
+    subjects = {
+        subject_id: SubjectMastery(user=user, subject_id=subject_id, evicted_before=cutoff)
+        for subject_id in subject_ids
+    }
+    snippets: Dict[str, SnippetMastery] = {}
+    answers = (
+        Question.objects.filter(
+            quiz__user=user, quiz__completed_at__gt=cutoff, is_correct__isnull=False,
+            snippet__subject_id__in=subject_ids,
+        )
+        .values('snippet_id', 'snippet__subject_id', 'quiz__completed_at', 'is_correct')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    for row in answers:
+        snippet = snippets.setdefault(
+            str(row['snippet_id']), SnippetMastery(user=user, snippet_id=row['snippet_id'], evicted_before=cutoff)
+        )
+        for aggregate in (snippet, subjects[str(row['snippet__subject_id'])]):
+            _add(aggregate, row['quiz__completed_at'], row['is_correct'], row['count'])
+            if aggregate.oldest_answer_at is None or row['quiz__completed_at'] < aggregate.oldest_answer_at:
+                aggregate.oldest_answer_at = row['quiz__completed_at']
+
+    if save:
+        SnippetMastery.objects.filter(user=user, snippet__subject_id__in=subject_ids).delete()
+        SnippetMastery.objects.bulk_create(snippets.values(), ignore_conflicts=True)
+        SubjectMastery.objects.bulk_create(subjects.values(), ignore_conflicts=True)
+    return subjects, snippets
+
+
+def _subject_ids(subjects: Iterable):
+    return {str(getattr(subject, 'pk', subject)) for subject in subjects}
+
+
+def _subject_aggregates(user, subject_ids, now: datetime.datetime,
+                        save: bool = False) -> Tuple[Dict[str, SubjectMastery], Dict[str, SnippetMastery], set]:
+    """Aggregates of a user in some subjects, built from history where missing and evicted where expired
+
+    With save (write path), the stored rows are locked until the transaction commits, missing
+    aggregates are built and stored and expired answers evicted from the rows. Without (reads),
+    both happen in memory only, so reading mastery never writes.
+
+    Returns:
+        Tuple of the aggregates by subject id, the snippet aggregates of the subjects built by
+        this call (by snippet id) and the ids of those subjects
+    """
+    rows = SubjectMastery.objects.filter(user=user, subject_id__in=subject_ids)
+    if save:
+        rows = rows.select_for_update()
+    aggregates = {str(aggregate.subject_id): aggregate for aggregate in rows}
+    built = set(subject_ids) - aggregates.keys()
+    built_snippets = {}
+    if built:
+        built_subjects, built_snippets = _build(user, built, now, save=save)
+        aggregates.update(built_subjects)
+    _evict(user, SUBJECT, aggregates, now, save=save)
+    return aggregates, built_snippets, built
+
+
+def _snippet_aggregates(user, subject_ids, now: datetime.datetime) -> Dict[str, SnippetMastery]:
+    """Aggregates of the answered snippets of some subjects, whose subject aggregates are stored
+
+    Expired answers are evicted in memory only, like for subjects on reads.
+    """
+    aggregates = {
+        str(aggregate.snippet_id): aggregate
+        for aggregate in SnippetMastery.objects.filter(user=user, snippet__subject_id__in=subject_ids)
+    }
+    _evict(user, SNIPPET, aggregates, now)
+    return aggregates
+
+
+def subject_mastery_map(user, subject_ids: Iterable) -> Dict[str, float]:
+    """Decayed mastery of a user in several subjects, from their stored aggregates
+
+    Every answered question counts +1 if correct and -1 if not, decayed by 1% per day since its
+    quiz was completed, down to 0. Evaluating it reads one row per subject whatever the history,
+    plus any answers that expired since the row was last written (dropped in memory only).
+
+    Args:
+        user: User whose answers are counted
+        subject_ids: Subjects (or their ids) to compute mastery for
+
+    Returns:
+        Dict of subject id (as a string) to mastery; subjects without answers have 0.0
+    """
+    subject_ids = _subject_ids(subject_ids)
+    if not subject_ids:
+        return {}
+    now = timezone.now()
+    aggregates, _, _ = _subject_aggregates(user, subject_ids, now)
+    return {subject_id: decayed_mastery(aggregates[subject_id], now) for subject_id in subject_ids}
+
+
+def subject_masteries(user, subjects: Iterable) -> Dict[str, float]:
+    """Mastery of a user in several subjects as shown in listings
+
+    A subject's mastery is the average of its snippets' mastery (as in subject_mastery_map,
+    clamped to [0, MAX_SNIPPET_MASTERY]); snippets without answers count 0. Subjects without
+    stored aggregates are computed from the history without storing them.
+
+    Returns:
+        Dict of subject id (as a string) to mastery
+    """
+    subject_ids = _subject_ids(subjects)
+    if not subject_ids:
+        return {}
+    now = timezone.now()
+    _, snippet_aggregates, built = _subject_aggregates(user, subject_ids, now)
+    snippet_aggregates.update(_snippet_aggregates(user, subject_ids - built, now))
+    snippet_subjects = dict(
+        MaterialSnippet.objects.filter(subject_id__in=subject_ids).values_list('id', 'subject_id')
+    )
+    totals = dict.fromkeys(subject_ids, 0.0)
+    counts = dict.fromkeys(subject_ids, 0)
+    for subject_id in snippet_subjects.values():
+        counts[str(subject_id)] += 1
+    for snippet_id, aggregate in snippet_aggregates.items():
+        subject_id = str(snippet_subjects.get(aggregate.snippet_id, ''))
+        if subject_id in totals:
+            totals[subject_id] += max(0, min(decayed_mastery(aggregate, now), MAX_SNIPPET_MASTERY))
+    return {
+        subject_id: totals[subject_id] / counts[subject_id] if counts[subject_id] else 0
+        for subject_id in subject_ids
+    }
+
+
+def quiz_answers(questions: Iterable[Question], completed_at: Optional[datetime.datetime]) -> List[Answer]:
+    """Answers a quiz's questions add to mastery"""
+    if completed_at is None:
+        return []
+    return [
+        (question.snippet_id, completed_at, question.is_correct)
+        for question in questions
+        if question.snippet_id is not None and question.is_correct is not None
+    ]
+
+
+def mastery_version(user) -> int:
+    """Version of a user's answer history, bumped by every change applied to the aggregates"""
+    return MasteryVersion.objects.filter(user=user).values_list('version', flat=True).first() or 0
+
+
+def _bump_version(user):
+    if not MasteryVersion.objects.filter(user=user).update(version=F('version') + 1):
+        MasteryVersion.objects.bulk_create([MasteryVersion(user=user)], ignore_conflicts=True)
+        MasteryVersion.objects.filter(user=user).update(version=F('version') + 1)
+
+
+def update_mastery(user, removed: Iterable[Answer] = (), added: Iterable[Answer] = (),
+                   now: Optional[datetime.datetime] = None):
+    """Apply answers added to or removed from the history to the stored aggregates
+
+    Must run after the change is saved, in its transaction: aggregates that do not exist yet are
+    built from the saved history instead, and the rows touched are locked until it commits.
+    Costs a few queries for the quiz's snippets and subjects, whatever the history. The user's
+    mastery version is bumped.
+    """
+    removed, added = list(removed), list(added)
+    snippet_ids = {snippet_id for snippet_id, _, _ in removed + added}
+    if not snippet_ids:
+        return
+    now = now or timezone.now()
+    snippet_subjects = {
+        snippet_id: str(subject_id)
+        for snippet_id, subject_id in MaterialSnippet.objects.filter(id__in=snippet_ids).values_list('id', 'subject_id')
+    }
+    subjects, _, built = _subject_aggregates(user, set(snippet_subjects.values()), now, save=True)
+    snippets = {
+        aggregate.snippet_id: aggregate
+        for aggregate in SnippetMastery.objects.select_for_update().filter(user=user, snippet_id__in=snippet_ids)
+    }
+    _evict(user, SNIPPET, {str(snippet_id): aggregate for snippet_id, aggregate in snippets.items()}, now, save=True)
+    created = []
+
+    for answers, sign in ((removed, -1), (added, 1)):
+        for snippet_id, completed_at, correct in answers:
+            subject_id = snippet_subjects.get(snippet_id)
+            if subject_id is None or subject_id in built:
+                continue # Snippet deleted, or already built from the saved history
+            snippet = snippets.get(snippet_id)
+            if snippet is None:
+                snippet = snippets[snippet_id] = SnippetMastery(user=user, snippet_id=snippet_id, evicted_before=_cutoff(now))
+                created.append(snippet)
+            for aggregate in (snippet, subjects[subject_id]):
+                if completed_at <= aggregate.evicted_before:
+                    continue # Already evicted
+                _add(aggregate, completed_at, correct, sign)
+                if sign > 0 and (aggregate.oldest_answer_at is None or completed_at < aggregate.oldest_answer_at):
+                    aggregate.oldest_answer_at = completed_at
+
+    update_fields = AGGREGATE_FIELDS + ['oldest_answer_at', 'updated_at']
+    SnippetMastery.objects.bulk_create(created)
+    SnippetMastery.objects.bulk_update([aggregate for aggregate in snippets.values() if aggregate not in created], update_fields)
+    SubjectMastery.objects.bulk_update(
+        [aggregate for subject_id, aggregate in subjects.items() if subject_id not in built], update_fields
+    )
+    _bump_version(user)
+
+
+def forget_snippets(snippet_ids: Iterable):
+    """Drop the subject aggregates of snippets about to be deleted, to be rebuilt without their answers
+
+    Their answers stay in the history without a snippet, so they no longer count; their snippet
+    aggregates go with them.
+    """
+    subject_ids = MaterialSnippet.objects.filter(id__in=list(snippet_ids)).values_list('subject_id', flat=True)
+    SubjectMastery.objects.filter(subject_id__in=list(subject_ids)).delete()
+
+
+def rebuild_mastery(user, subjects: Iterable, now: Optional[datetime.datetime] = None):
+    """Recompute the stored aggregates of a user in some subjects from the answer history"""
+    subject_ids = _subject_ids(subjects)
+    if not subject_ids:
+        return
+    SubjectMastery.objects.filter(user=user, subject_id__in=subject_ids).delete()
+    _build(user, subject_ids, now or timezone.now())
+    _bump_version(user)
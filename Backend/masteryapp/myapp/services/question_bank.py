@@ -0,0 +1,177 @@
+import json
+import random
+import logging
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from ..models.quiz import Quiz
+from ..models.bank_question import BankQuestion
+from ..models.material_snippet import MaterialSnippet
+from ..gcp.rag_question_maker import QuizMakerRAG, is_valid_question
+from ..gcp.request_context import request_context, tag_request
+from .fingerprint import FingerprintIndex, SeenQuestions, question_fingerprint
+from .distractors import distractor_candidates, harvest_generated_distractors
+from . import background
+
+logger = logging.getLogger(__name__)
+
+# Bank questions are generated for the default quiz format; other formats are generated live
+DEFAULT_OPTIONS_PER_QUESTION = Quiz._meta.get_field('options_per_question').default
+
+
+def fill_bank(snippet_ids: Iterable, options_per_question: int = DEFAULT_OPTIONS_PER_QUESTION) -> int:
+    """Generate bank questions for snippets that have fewer than QUESTION_BANK_SIZE of them
+
+    Every snippet is listed once per missing question in a direct generation, all in the same
+    shard, so the model writes distinct questions for it. The model is told not to repeat the
+    snippet's bank questions, and near duplicates of them are dropped; wrong options come from
+    the subject's distractor pool when it is large enough, and new ones join it. Bank counts are
+    checked again under the snippet row locks before inserting, so concurrent fills never take a
+    snippet past QUESTION_BANK_SIZE. Usage is charged to the owner of the course.
+
+    Returns:
+        int: Number of questions added to the bank
+    """
+    snippets = list(
+        MaterialSnippet.objects.filter(pk__in=list(snippet_ids))
+        .select_related('class_material__course')
+        .annotate(bank_count=Count(
+            'bank_questions', filter=Q(bank_questions__options_per_question=options_per_question)
+        ))
+    )
+    snippets = [snippet for snippet in snippets if snippet.bank_count < settings.QUESTION_BANK_SIZE]
+    if not snippets:
+        return 0
+
+    banked_stems: Dict[str, List[str]] = {str(snippet.id): [] for snippet in snippets}
+    indexes = {str(snippet.id): FingerprintIndex() for snippet in snippets}
+    indexed_ids = set()
+    for bank_question_id, snippet_id, question, fingerprint in BankQuestion.objects.filter(
+        snippet__in=snippets, options_per_question=options_per_question
+    ).values_list('id', 'snippet_id', 'question', 'fingerprint'):
+        indexed_ids.add(bank_question_id)
+        banked_stems[str(snippet_id)].append(question)
+        if fingerprint:
+            indexes[str(snippet_id)].add(fingerprint)
+
+    distractors = distractor_candidates({snippet.subject_id for snippet in snippets}, options_per_question)
+    data_list = []
+    for snippet in snippets:
+        for _ in range(settings.QUESTION_BANK_SIZE - snippet.bank_count):
+            data_list.append({
+                'id' : str(snippet.id),
+                'snippet' : snippet.snippet,
+                'avoid' : banked_stems[str(snippet.id)],
+                'distractors' : distractors.get(str(snippet.subject_id), []),
+            })
+
+    course = snippets[0].class_material.course
+    with request_context():
+        tag_request(user_id=course.user_id, course_id=course.id, endpoint='question_bank.fill')
+        model_response = QuizMakerRAG().generate_direct(data_list=data_list, options_per_question=options_per_question)
+
+    try:
+        parsed_model_response = json.loads(model_response)
+    except json.JSONDecodeError:
+        logger.error(f"Question bank generation returned invalid JSON for {len(snippets)} snippets")
+        return 0
+
+    valid_questions = [
+        question_raw for question_raw in parsed_model_response if is_valid_question(question_raw, options_per_question)
+    ]
+    with transaction.atomic():
+        # Another fill for the same snippets may have finished while this one was generating:
+        # recount under the snippet row locks and only add what is still missing
+        locked_ids = list(MaterialSnippet.objects.select_for_update().filter(
+            pk__in=[snippet.id for snippet in snippets]
+        ).values_list('pk', flat=True)) # Snippets deleted meanwhile get nothing
+        room = {str(snippet_id): settings.QUESTION_BANK_SIZE for snippet_id in locked_ids}
+        for bank_question_id, snippet_id, fingerprint in BankQuestion.objects.filter(
+            snippet__in=locked_ids, options_per_question=options_per_question
+        ).values_list('id', 'snippet_id', 'fingerprint'):
+            room[str(snippet_id)] -= 1
+            if fingerprint and bank_question_id not in indexed_ids:
+                indexes[str(snippet_id)].add(fingerprint)
+
+        bank_questions = []
+        for question_raw in valid_questions:
+            snippet_id = str(question_raw['snippet_id'])
+            index = indexes.get(snippet_id)
+            fingerprint = question_fingerprint(
+                question_raw['question'], question_raw['choices'][int(question_raw['answer_index'])]
+            )
+            if index is None or room.get(snippet_id, 0) <= 0 or index.contains(fingerprint):
+                continue # Unknown, deleted or full snippet, or a rewording of a question already banked for it
+            index.add(fingerprint)
+            room[snippet_id] -= 1
+            bank_questions.append(BankQuestion(
+                snippet_id=question_raw['snippet_id'],
+                question=question_raw['question'],
+                choices=';;/;;'.join(question_raw['choices']),
+                single_correct_choice=int(question_raw['answer_index']),
+                options_per_question=options_per_question,
+                fingerprint=fingerprint,
+            ))
+        BankQuestion.objects.bulk_create(bank_questions)
+    harvest_generated_distractors(valid_questions)
+    logger.info(f"Added {len(bank_questions)} questions to the bank for {len(snippets)} snippets")
+    return len(bank_questions)
+
+
+def schedule_bank_fill(snippet_ids: Iterable):
+    """Fill the bank for snippets once the transaction that created (or needed) them commits"""
+    snippet_ids = [str(snippet_id) for snippet_id in snippet_ids]
+    if snippet_ids:
+        transaction.on_commit(lambda: background.submit(fill_bank, snippet_ids))
+
+
+def take_from_bank(selected_snippets: Sequence[MaterialSnippet], options_per_question: int,
+                   seen: Optional[SeenQuestions] = None) -> Tuple[List[Dict], List[MaterialSnippet]]:
+    """Answer a snippet selection from the bank, in one query
+
+    A snippet selected several times gets different questions as long as the bank has them.
+    Questions the user has not seen yet (no near duplicate in seen) come first, then the least
+    used ones (ties broken at random), so quizzes rotate through the bank; a seen question is
+    still reused rather than generating what would likely be a duplicate. Use counts are bumped
+    once the quiz commits.
+
+    Returns:
+        Tuple of the bank questions, in the same format as generated ones (snippet_id, question,
+        choices, answer_index), and the selected snippets the bank could not answer
+    """
+    available: Dict[str, List[BankQuestion]] = {}
+    for bank_question in BankQuestion.objects.filter(
+        snippet_id__in={snippet.id for snippet in selected_snippets},
+        options_per_question=options_per_question,
+    ):
+        available.setdefault(str(bank_question.snippet_id), []).append(bank_question)
+    for bank_questions in available.values():
+        random.shuffle(bank_questions)
+        bank_questions.sort(
+            key=lambda bank_question: (seen is not None and seen.contains(bank_question.fingerprint), bank_question.times_used),
+            reverse=True,
+        )
+
+    questions, missing, used_ids = [], [], []
+    for snippet in selected_snippets:
+        bank_questions = available.get(str(snippet.id))
+        if not bank_questions:
+            missing.append(snippet)
+            continue
+        bank_question = bank_questions.pop()
+        used_ids.append(bank_question.id)
+        questions.append({
+            'snippet_id' : str(snippet.id),
+            'question' : bank_question.question,
+            'choices' : bank_question.choices.split(';;/;;'),
+            'answer_index' : bank_question.single_correct_choice,
+        })
+
+    if used_ids:
+        transaction.on_commit(
+            lambda: BankQuestion.objects.filter(pk__in=used_ids).update(times_used=F('times_used') + 1)
+        )
+    return questions, missing
@@ -0,0 +1,223 @@
+import json
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+from ..models.quiz import Quiz, GenerationMode
+from ..models.question import Question, QuestionType
+from ..models.material_snippet import MaterialSnippet
+from ..gcp.document_context import estimate_tokens
+from ..gcp.rag_question_maker import QuizMakerRAG
+from ..gcp.model_router import GenerationError
+from .question_bank import schedule_bank_fill
+from .mastery import compute_weight, subject_mastery_map
+from .fingerprint import SeenQuestions, question_fingerprint
+from .cloze import generate_cloze_questions
+from .distractors import distractor_candidates, schedule_distractor_harvest
+from .sampling import select_course_snippets
+from .spaced_repetition import due_snippets
+from .selection import select_stratified
+
+# Largest a selected snippet can be, in tokens
+MAX_SNIPPET_TOKENS = estimate_tokens('x' * MaterialSnippet._meta.get_field('snippet').max_length)
+
+
+def resolve_generation_mode(requested, quiz_length: int) -> str:
+    """Pick how a quiz is generated
+
+    "auto" resolves to direct generation (snippets in the prompt) whenever the selection is
+    guaranteed to fit in QUIZ_DIRECT_CONTEXT_TOKENS, and to retrieval from the course corpus
+    otherwise. It is resolved before the snippets are picked, so the corpus is only touched
+    when it is actually needed. "cloze" (local questions, no model call) is only used on request.
+    """
+    if requested in (GenerationMode.DIRECT, GenerationMode.RAG, GenerationMode.CLOZE):
+        return requested
+    if quiz_length * MAX_SNIPPET_TOKENS <= settings.QUIZ_DIRECT_CONTEXT_TOKENS:
+        return GenerationMode.DIRECT
+    return GenerationMode.RAG
+
+
+def _due_within_coverage(due: List[MaterialSnippet], subject_ids, quiz_length: int,
+                         min_per_subject: int) -> List[MaterialSnippet]:
+    """Most overdue snippets that still leave room for min_per_subject snippets of every subject"""
+    if len(subject_ids) * min_per_subject > quiz_length:
+        return due # Not every subject can be covered anyway
+    for count in range(len(due), -1, -1):
+        covered = Counter(str(snippet.subject_id) for snippet in due[:count])
+        if count + sum(max(0, min_per_subject - covered[subject_id]) for subject_id in subject_ids) <= quiz_length:
+            return due[:count]
+    return []
+
+
+def select_snippets(quiz: Quiz) -> List[MaterialSnippet]:
+    """Pick the snippets of a saved quiz, weighted towards the subjects its user masters least
+
+    "Optimize learning" quizzes start with the snippets due for review (see spaced_repetition),
+    up to QUIZ_DUE_SHARE of the quiz and as long as every subject can still be covered, and pick
+    the rest by mastery weighting.
+    Snippets are picked without replacement, at least QUIZ_MIN_PER_SUBJECT per subject when the
+    quiz is long enough (due snippets count towards their subject), and only repeat when there
+    are fewer snippets than questions.
+    Whole-course quizzes draw from the user's cached course sampler (Fenwick trees, O(k log n)
+    per quiz); quizzes restricted to subjects or materials weigh their (smaller) candidate set
+    directly, with one mastery query for the mastery of all their subjects.
+    """
+    material_ids = None
+    if quiz.subjects.exists():
+        source_snippets = MaterialSnippet.objects.filter(
+            subject__course=quiz.course,
+            subject__in=quiz.subjects.all()
+        )
+        quiz.optimize_learning = False
+        quiz.save()
+        # If going by subject, there's no point checking the mastery of said subject or doing any comparing.
+    elif quiz.materials.exists():
+        material_ids = list(quiz.materials.values_list('id', flat=True))
+        source_snippets = MaterialSnippet.objects.filter(
+            class_material__in = material_ids
+        )
+    else:
+        source_snippets = None
+
+    due = []
+    if quiz.optimize_learning:
+        due = due_snippets(quiz.user, quiz.course_id, int(quiz.quiz_length * settings.QUIZ_DUE_SHARE), material_ids)
+    if due:
+        subject_ids = {
+            str(subject_id) for subject_id in (source_snippets or MaterialSnippet.objects.filter(subject__course=quiz.course))
+            .values_list('subject_id', flat=True).distinct()
+        }
+        due = _due_within_coverage(due, subject_ids, quiz.quiz_length, settings.QUIZ_MIN_PER_SUBJECT)
+    due_ids = {snippet.id for snippet in due}
+    # Subjects of due snippets are already covered; the rest of the quiz covers the others
+    covered = Counter(str(snippet.subject_id) for snippet in due)
+    remaining = quiz.quiz_length - len(due)
+
+    if source_snippets is None:
+        snippet_ids = select_course_snippets(
+            quiz.user, quiz.course_id, remaining, min_per_subject=settings.QUIZ_MIN_PER_SUBJECT,
+            exclude={str(snippet_id) for snippet_id in due_ids}, covered=covered,
+        )
+        snippets = MaterialSnippet.objects.in_bulk(snippet_ids)
+        picked = [snippets[snippet_id] for snippet_id in map(uuid.UUID, snippet_ids) if snippet_id in snippets]
+    else:
+        snippets = list(source_snippets)
+        # Due snippets are not picked again, unless too few others are left
+        if len(snippets) - len(due_ids) >= remaining:
+            snippets = [snippet for snippet in snippets if snippet.id not in due_ids]
+        subject_mastery = subject_mastery_map(quiz.user, {snippet.subject_id for snippet in snippets})
+        picked = select_stratified(
+            snippets,
+            [compute_weight(subject_mastery[str(snippet.subject_id)]) for snippet in snippets],
+            [str(snippet.subject_id) for snippet in snippets],
+            remaining,
+            min_per_group=settings.QUIZ_MIN_PER_SUBJECT,
+            covered=covered,
+        )
+    return due + picked
+
+
+def snippet_data_list(snippets: List[MaterialSnippet], seen: Optional[SeenQuestions] = None,
+                      distractors: Optional[Dict[str, List[str]]] = None) -> List[Dict]:
+    """Entries sent to the question generator, one per question to write
+
+    With the user's seen questions, each entry lists the questions already asked about its
+    snippet under "avoid", so the model writes a new one. With candidate wrong options per
+    subject (see distractors.distractor_candidates), entries of those subjects list them under
+    "distractors" and the model only writes their stem and answer.
+    """
+    distractors = distractors or {}
+    data_list = []
+    counter = 0
+    for snippet in snippets:
+        counter+=1
+        data_list.append({
+            'id' : str(snippet.id),
+            'snippet' : str(snippet.snippet),
+            'avoid' : seen.stems(snippet.id) if seen is not None else [],
+            'distractors' : distractors.get(str(snippet.subject_id), []),
+            'commented_count_helper': counter,
+        })
+    return data_list
+
+
+def setup_retrieval_tool(quiz_maker_rag: QuizMakerRAG, corpus_name: str, rag_file_names: Dict[str, str],
+                         snippets: List[MaterialSnippet]):
+    # Retrieval is scoped to the files of the materials the snippets to generate come from
+    return quiz_maker_rag.setup_retrieval_tool(
+        corpus_name=corpus_name,
+        rag_file_names=list({rag_file_names[str(snippet.class_material_id)] for snippet in snippets}),
+        similarity_top_k=max(10, len(snippets)),
+    )
+
+
+def generate_questions(quiz: Quiz, snippets: List[MaterialSnippet], corpus_name: Optional[str] = None,
+                       rag_file_names: Optional[Dict[str, str]] = None,
+                       seen: Optional[SeenQuestions] = None) -> List[Dict]:
+    """Generate one question per snippet live, in the quiz's generation mode
+
+    The model is told not to repeat the questions of seen about these snippets, and picks the
+    wrong options from the subject's distractor pool when it has enough of them. The bank of
+    these snippets is stocked afterwards so the next quiz does not wait on them, and the wrong
+    options the model wrote join the pool. Cloze quizzes are built locally (see
+    cloze.generate_cloze_questions) and leave the bank alone.
+
+    Returns:
+        List of generated questions (snippet_id, question, choices, answer_index)
+
+    Raises:
+        CircuitOpenError, DeadlineExceeded: Generation is unavailable or out of time
+        GenerationError: No question could be generated
+    """
+    if not snippets:
+        return []
+    if quiz.generation_mode == GenerationMode.CLOZE:
+        questions = generate_cloze_questions(snippets, quiz.options_per_question)
+        if not questions:
+            raise GenerationError(f"No cloze question could be built from {len(snippets)} snippets")
+        return questions
+    quiz_maker_rag = QuizMakerRAG()
+    distractors = distractor_candidates({snippet.subject_id for snippet in snippets}, quiz.options_per_question)
+    data_list = snippet_data_list(snippets, seen, distractors)
+    if quiz.generation_mode == GenerationMode.RAG:
+        model_response = quiz_maker_rag.generate_response(
+            query="",
+            retrieval_tool=setup_retrieval_tool(quiz_maker_rag, corpus_name, rag_file_names, snippets),
+            quiz_length=len(snippets),
+            options_per_question=quiz.options_per_question,
+            entries=[{key : value for key, value in data.items() if key != 'snippet'} for data in data_list],
+        )
+    else:
+        model_response = quiz_maker_rag.generate_direct(
+            data_list=data_list,
+            options_per_question=quiz.options_per_question,
+        )
+    questions = json.loads(model_response)
+    schedule_bank_fill({snippet.id for snippet in snippets})
+    schedule_distractor_harvest(questions)
+    return questions
+
+
+def save_questions(quiz: Quiz, questions_raw: List[Dict]) -> List[Question]:
+    """Insert the questions of a quiz in one batch, with their fingerprints
+
+    Returns:
+        List[Question]: The saved questions, in the given order
+    """
+    new_questions = [
+        Question(
+            quiz_id=quiz.id,
+            question=question_raw['question'],
+            choices=';;/;;'.join(question_raw['choices']),
+            type=QuestionType.MULTIPLE_CHOICE.value, # Hard-coded for now.
+            single_correct_choice=question_raw['answer_index'],
+            snippet_id=question_raw['snippet_id'],
+            fingerprint=question_fingerprint(
+                question_raw['question'], question_raw['choices'][int(question_raw['answer_index'])]
+            ),
+        )
+        for question_raw in questions_raw
+    ]
+    return Question.objects.bulk_create(new_questions)
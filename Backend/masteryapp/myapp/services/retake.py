@@ -0,0 +1,53 @@
+import random
+from typing import List, Tuple
+
+from ..models.quiz import Quiz
+from ..models.question import Question
+
+
+def shuffled_choices(choices: List[str], correct_choice: int, rng=random) -> Tuple[List[str], int]:
+    """Shuffle the choices of a question
+
+    Returns:
+        Tuple of the shuffled choices and the new index of the correct one
+    """
+    order = list(range(len(choices)))
+    rng.shuffle(order)
+    return [choices[index] for index in order], order.index(correct_choice)
+
+
+def create_retake(quiz: Quiz, rng=random) -> Tuple[Quiz, List[Question]]:
+    """Create a new attempt of a quiz with the same questions, without any generation
+
+    Each question is copied with its choices shuffled and single_correct_choice remapped. The
+    previous attempt keeps its own questions and answers, so its mastery history is untouched.
+
+    Returns:
+        Tuple of the new quiz and its questions
+    """
+    retake = Quiz.objects.create(
+        user=quiz.user,
+        course_id=quiz.course_id,
+        name=quiz.name,
+        optimize_learning=quiz.optimize_learning,
+        quiz_length=quiz.quiz_length,
+        options_per_question=quiz.options_per_question,
+        generation_mode=quiz.generation_mode,
+        retake_of=quiz,
+    )
+    retake.subjects.set(quiz.subjects.all())
+    retake.materials.set(quiz.materials.all())
+
+    questions = []
+    for question in Question.objects.filter(quiz=quiz):
+        choices, correct_choice = shuffled_choices(question.choices.split(';;/;;'), question.single_correct_choice, rng)
+        questions.append(Question(
+            quiz=retake,
+            question=question.question,
+            type=question.type,
+            choices=';;/;;'.join(choices),
+            single_correct_choice=correct_choice,
+            snippet_id=question.snippet_id,
+            fingerprint=question.fingerprint,
+        ))
+    return retake, Question.objects.bulk_create(questions)
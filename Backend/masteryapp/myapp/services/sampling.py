@@ -0,0 +1,291 @@
+import random
+import threading
+from collections import OrderedDict
+from typing import Collection, Dict, Hashable, List, Mapping, Optional, Sequence, Tuple
+
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from ..models.material_snippet import MaterialSnippet
+from .mastery import compute_weight, mastery_version, subject_mastery_map
+
+# Samplers kept in memory, least recently used evicted first
+SAMPLER_CACHE_SIZE = 256
+
+
+class FenwickTree:
+    def __init__(self, values: Sequence[float]):
+        """Binary indexed tree over non-negative values: O(log n) point updates, prefix sums and search"""
+        self.size = len(values)
+        self._tree = [0.0] * (self.size + 1)
+        for index, value in enumerate(values, 1):
+            self._tree[index] += value
+            parent = index + (index & -index)
+            if parent <= self.size:
+                self._tree[parent] += self._tree[index]
+
+    def add(self, index: int, delta: float):
+        index += 1
+        while index <= self.size:
+            self._tree[index] += delta
+            index += index & -index
+
+    def prefix_sum(self, end: int) -> float:
+        """Sum of the values in [0, end)"""
+        total = 0.0
+        while end > 0:
+            total += self._tree[end]
+            end -= end & -end
+        return total
+
+    def find(self, target: float) -> int:
+        """Smallest index whose inclusive prefix sum exceeds target"""
+        position = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            next_position = position + step
+            if next_position <= self.size and self._tree[next_position] <= target:
+                position = next_position
+                target -= self._tree[next_position]
+            step >>= 1
+        return min(position, self.size - 1)
+
+
+class WeightedSampler:
+    def __init__(self, ids: Sequence[Hashable], weights: Sequence[float], groups: Sequence[Hashable]):
+        """Weighted sampling without replacement over grouped ids, with O(log n) weight updates
+
+        Ids are stored group by group, so each group is a range of one Fenwick tree over their
+        weights and a second tree holds the group totals. Drawing zeroes the drawn weight and
+        restores it once the selection is done.
+        """
+        rank = {group: rank for rank, group in enumerate(dict.fromkeys(groups))}
+        order = sorted(range(len(ids)), key=lambda index: rank[groups[index]])
+        self._ids = [ids[index] for index in order]
+        self._weights = [max(0.0, float(weights[index])) for index in order]
+        self._positions = {item_id: position for position, item_id in enumerate(self._ids)}
+        self._group_names: List[Hashable] = []
+        self._ranges: List[Tuple[int, int]] = []
+        self._group_of: List[int] = []
+        for position, index in enumerate(order):
+            if not self._group_names or self._group_names[-1] != groups[index]:
+                self._group_names.append(groups[index])
+                self._ranges.append((position, position))
+            self._ranges[-1] = (self._ranges[-1][0], position + 1)
+            self._group_of.append(len(self._group_names) - 1)
+        self._tree = FenwickTree(self._weights)
+        self._group_tree = FenwickTree([sum(self._weights[start:end]) for start, end in self._ranges])
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, item_id) -> bool:
+        return item_id in self._positions
+
+    def weight(self, item_id) -> float:
+        return self._weights[self._positions[item_id]]
+
+    def set_weight(self, item_id, weight: float):
+        self._set(self._positions[item_id], max(0.0, float(weight)))
+
+    def _set(self, position: int, weight: float):
+        delta = weight - self._weights[position]
+        if delta:
+            self._tree.add(position, delta)
+            self._group_tree.add(self._group_of[position], delta)
+            self._weights[position] = weight
+
+    def _draw(self, start: int, end: int, rng) -> Optional[int]:
+        """Position in [start, end) drawn in proportion to the weights, None if all are zero"""
+        low = self._tree.prefix_sum(start)
+        total = self._tree.prefix_sum(end) - low
+        if total <= 0:
+            return None
+        position = min(max(self._tree.find(low + rng.random() * total), start), end - 1)
+        if self._weights[position] <= 0:
+            # Rounding in the tree sums can land on an empty slot next to the drawn one
+            candidates = [index for index in range(start, end) if self._weights[index] > 0]
+            if not candidates:
+                return None
+            position = min(candidates, key=lambda index: abs(index - position))
+        return position
+
+    def _draw_group(self, needs: List[int], rng) -> Optional[int]:
+        total = self._group_tree.prefix_sum(len(self._ranges))
+        while total > 0:
+            group = self._group_tree.find(rng.random() * total)
+            if needs[group] > 0 and self._weights_in(group) > 0:
+                return group
+            # Group covered or emptied: take it out of the draw (restored with its ids)
+            self._group_tree.add(group, -self._group_tree_value(group))
+            total = self._group_tree.prefix_sum(len(self._ranges))
+        return None
+
+    def _weights_in(self, group: int) -> float:
+        start, end = self._ranges[group]
+        return self._tree.prefix_sum(end) - self._tree.prefix_sum(start)
+
+    def _group_tree_value(self, group: int) -> float:
+        return self._group_tree.prefix_sum(group + 1) - self._group_tree.prefix_sum(group)
+
+    def sample(self, k: int, min_per_group: int = 1, covered: Optional[Mapping[Hashable, int]] = None,
+               exclude: Collection[Hashable] = (), rng=random) -> List:
+        """k ids drawn without replacement, covering every group, in O((k + groups) log n)
+
+        Same selection as selection.select_stratified: each group first gets min_per_group ids
+        (less what covered says it already has), groups drawn in proportion to their total weight
+        when k cannot cover them all, then the remaining slots are drawn from every id. Ids in
+        exclude are left out unless fewer than k others remain. When there are fewer ids than k,
+        further rounds are drawn the same way, so repeats are spread as evenly as possible.
+        """
+        covered = covered or {}
+        excluded = [self._positions[item_id] for item_id in exclude if item_id in self._positions]
+        if len(self._ids) - len(excluded) < k:
+            excluded = []
+        picked: List = []
+        while len(picked) < k and len(self._ids) > len(excluded):
+            saved = {position: self._weights[position] for position in excluded}
+            for position in excluded:
+                self._set(position, 0.0)
+            drawn = self._sample_round(min(k - len(picked), len(self._ids) - len(excluded)),
+                                       min_per_group, covered, saved, rng)
+            picked.extend(drawn)
+            for position, weight in saved.items():
+                self._set(position, weight)
+            # Group entries taken out of the draw are rebuilt from their ids
+            for group in range(len(self._ranges)):
+                self._group_tree.add(group, self._weights_in(group) - self._group_tree_value(group))
+            if not drawn:
+                break # Only zero weights left
+        return picked
+
+    def _sample_round(self, k: int, min_per_group: int, covered, saved: Dict[int, float], rng) -> List:
+        needs = [max(0, min_per_group - covered.get(name, 0)) for name in self._group_names]
+        drawn = []
+        while len(drawn) < k:
+            group = self._draw_group(needs, rng)
+            if group is None:
+                break
+            position = self._draw(*self._ranges[group], rng)
+            if position is None:
+                needs[group] = 0
+                continue
+            needs[group] -= 1
+            saved.setdefault(position, self._weights[position])
+            self._set(position, 0.0)
+            drawn.append(position)
+        while len(drawn) < k:
+            position = self._draw(0, len(self._ids), rng)
+            if position is None:
+                break
+            saved.setdefault(position, self._weights[position])
+            self._set(position, 0.0)
+            drawn.append(position)
+        return [self._ids[position] for position in drawn]
+
+
+class _CourseSampler:
+    """Snippet sampler of one user in one course, with what it was built from"""
+
+    def __init__(self, sampler: WeightedSampler, subject_snippets: Dict[str, List[str]],
+                 subject_weights: Dict[str, float], snippets_version: Tuple, mastery_version, day):
+        self.sampler = sampler
+        self.subject_snippets = subject_snippets
+        self.subject_weights = subject_weights
+        self.snippets_version = snippets_version
+        self.mastery_version = mastery_version
+        self.day = day
+        self.lock = threading.Lock()
+
+
+_samplers: "OrderedDict[Tuple[str, str], _CourseSampler]" = OrderedDict()
+_samplers_lock = threading.Lock()
+
+
+def _snippets_version(course_id) -> Tuple:
+    snippets = MaterialSnippet.objects.filter(subject__course_id=course_id).aggregate(
+        count=Count('id'), latest_material=Max('class_material__created_at'),
+    )
+    return snippets['count'], snippets['latest_material']
+
+
+def _subject_weights(user, subject_ids) -> Dict[str, float]:
+    return {
+        subject_id: compute_weight(mastery)
+        for subject_id, mastery in subject_mastery_map(user, subject_ids).items()
+    }
+
+
+def _build(user, course_id, snippets_version, mastery_version, day) -> _CourseSampler:
+    subject_snippets: Dict[str, List[str]] = {}
+    for snippet_id, subject_id in MaterialSnippet.objects.filter(
+        subject__course_id=course_id
+    ).values_list('id', 'subject_id'):
+        subject_snippets.setdefault(str(subject_id), []).append(str(snippet_id))
+
+    subject_weights = _subject_weights(user, subject_snippets.keys())
+    ids, weights, groups = [], [], []
+    for subject_id, snippet_ids in subject_snippets.items():
+        ids.extend(snippet_ids)
+        weights.extend([subject_weights[subject_id]] * len(snippet_ids))
+        groups.extend([subject_id] * len(snippet_ids))
+    return _CourseSampler(
+        WeightedSampler(ids, weights, groups), subject_snippets, subject_weights, snippets_version, mastery_version, day
+    )
+
+
+def _refresh_mastery(user, cached: _CourseSampler, version: int):
+    """Reweigh only the snippets of subjects whose weight changed, in O(log n) per snippet"""
+    subject_weights = _subject_weights(user, cached.subject_snippets.keys())
+    for subject_id, weight in subject_weights.items():
+        if weight != cached.subject_weights.get(subject_id):
+            for snippet_id in cached.subject_snippets[subject_id]:
+                cached.sampler.set_weight(snippet_id, weight)
+    cached.subject_weights = subject_weights
+    cached.mastery_version = version
+
+
+def course_sampler(user, course_id) -> _CourseSampler:
+    """Return the user's snippet sampler for a course, kept in memory between quizzes
+
+    Two small queries tell whether it is current. New or deleted snippets rebuild it, as does a
+    new day (mastery decays daily). Any change to the user's answers (a submitted, resubmitted or
+    deleted quiz) bumps their mastery version, after which the subject weights are read again
+    from the stored subject masteries (one row per subject) and only the snippets of subjects
+    whose weight changed are reweighed, in O(log n) each.
+    """
+    key = (str(user.id), str(course_id))
+    snippets_version = _snippets_version(course_id)
+    version = mastery_version(user)
+    day = timezone.now().date()
+
+    with _samplers_lock:
+        cached = _samplers.get(key)
+        if cached is not None:
+            _samplers.move_to_end(key)
+
+    if cached is None or cached.snippets_version != snippets_version or cached.day != day:
+        cached = _build(user, course_id, snippets_version, version, day)
+        with _samplers_lock:
+            _samplers[key] = cached
+            _samplers.move_to_end(key)
+            while len(_samplers) > SAMPLER_CACHE_SIZE:
+                _samplers.popitem(last=False)
+    elif cached.mastery_version != version:
+        with cached.lock:
+            if cached.mastery_version != version:
+                _refresh_mastery(user, cached, version)
+    return cached
+
+
+def select_course_snippets(user, course_id, k: int, min_per_subject: int = 1, exclude: Collection[str] = (),
+                           covered: Optional[Mapping[str, int]] = None) -> List[str]:
+    """Pick k distinct snippet ids of a course, weighted towards weakly mastered subjects
+
+    Draws from the cached sampler in O((k + subjects) log n), so every subject is covered when k
+    allows (see WeightedSampler.sample). Snippet ids in exclude are left out unless fewer than k
+    others remain; covered counts snippets each subject already has from elsewhere.
+    """
+    cached = course_sampler(user, course_id)
+    with cached.lock:
+        return cached.sampler.sample(k, min_per_group=min_per_subject, covered=covered, exclude=exclude)
@@ -0,0 +1,57 @@
+import math
+import heapq
+import random
+from typing import Dict, Hashable, List, Mapping, Optional, Sequence
+
+
+def select_stratified(ids: Sequence[Hashable], weights: Sequence[float], groups: Sequence[Hashable], k: int,
+                      min_per_group: int = 1, covered: Optional[Mapping[Hashable, int]] = None, rng=random) -> List:
+    """Weighted sample of k ids without replacement, covering every group
+
+    Efraimidis-Spirakis: each id gets the key log(u) / weight for a uniform u, and the ids with the
+    largest keys form a weighted sample without replacement. Keys are drawn in one pass; then
+    each group keeps its best min_per_group ids (the best keys win when k cannot cover every
+    group) and the remaining slots go to the best keys overall.
+
+    When there are fewer ids than k, every id is used and further rounds are drawn the same way
+    until k ids are picked, so repeats are spread as evenly as possible.
+
+    Args:
+        ids: Candidates
+        weights: Weight of each candidate; zero or negative weights are only used to fill up
+        groups: Group (e.g. subject) of each candidate
+        k: Number of ids to pick
+        min_per_group: Ids guaranteed to each group, as far as k and the group size allow
+        covered: Ids each group already has from elsewhere (e.g. snippets due for review), which
+            count towards its min_per_group
+
+    Returns:
+        Picked ids, best keys first
+    """
+    if not ids or k <= 0:
+        return []
+
+    picked: List = []
+    while len(picked) < k:
+        picked.extend(_select_round(ids, weights, groups, min(k - len(picked), len(ids)), min_per_group, covered or {}, rng))
+    return picked
+
+
+def _select_round(ids, weights, groups, k, min_per_group, covered, rng) -> List:
+    keyed = []
+    by_group: Dict[Hashable, List] = {}
+    for index, (weight, group) in enumerate(zip(weights, groups)):
+        key = math.log(1.0 - rng.random()) / weight if weight > 0 else -math.inf
+        keyed.append((key, index))
+        by_group.setdefault(group, []).append((key, index))
+
+    reserved = []
+    for group, group_keys in by_group.items():
+        reserved.extend(heapq.nlargest(
+            max(0, min_per_group - covered.get(group, 0)), (item for item in group_keys if item[0] > -math.inf)
+        ))
+    reserved = heapq.nlargest(k, reserved)
+
+    chosen = {index for _, index in reserved}
+    rest = heapq.nlargest(k - len(reserved), ((key, index) for key, index in keyed if index not in chosen))
+    return [ids[index] for _, index in sorted(reserved + rest, reverse=True)]
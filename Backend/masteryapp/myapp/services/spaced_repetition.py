@@ -0,0 +1,97 @@
+import datetime
+from typing import Dict, Iterable, List, Optional
+
+from django.utils import timezone
+
+from ..models.question import Question
+from ..models.material_snippet import MaterialSnippet
+from ..models.snippet_review import SnippetReview
+
+# SM-2 grades (0-5) given to an answer: questions are only right or wrong
+CORRECT_GRADE = 4
+INCORRECT_GRADE = 1
+MIN_EASE = 1.3
+# Intervals of the first two correct reviews in a row, in days
+FIRST_INTERVAL_DAYS = 1
+SECOND_INTERVAL_DAYS = 6
+
+
+def schedule_review(review: SnippetReview, correct: bool, now: datetime.datetime):
+    """Apply one SM-2 review to a snippet's state, in place
+
+    A correct answer grows the interval (1 day, 6 days, then times the ease factor); a wrong one
+    restarts it at 1 day. The ease factor moves with the grade and never drops below 1.3.
+    """
+    grade = CORRECT_GRADE if correct else INCORRECT_GRADE
+    if correct:
+        if review.repetitions == 0:
+            review.interval_days = FIRST_INTERVAL_DAYS
+        elif review.repetitions == 1:
+            review.interval_days = SECOND_INTERVAL_DAYS
+        else:
+            review.interval_days = review.interval_days * review.ease
+        review.repetitions += 1
+    else:
+        review.repetitions = 0
+        review.lapses += 1
+        review.interval_days = FIRST_INTERVAL_DAYS
+    review.ease = max(MIN_EASE, review.ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+    review.last_reviewed_at = now
+    review.due_at = now + datetime.timedelta(days=review.interval_days)
+
+
+def record_reviews(user, course_id, questions: Iterable[Question], now: Optional[datetime.datetime] = None) -> int:
+    """Update the review state of the snippets of a submitted quiz's answered questions
+
+    A snippet asked several times in the quiz gets one review, correct only if every answer
+    about it was. Costs one query to load the states and one per write batch, whatever the
+    user's history.
+
+    Returns:
+        int: Number of snippets reviewed
+    """
+    now = now or timezone.now()
+    correct: Dict = {}
+    for question in questions:
+        if question.snippet_id is None or question.is_correct is None:
+            continue
+        correct[question.snippet_id] = correct.get(question.snippet_id, True) and question.is_correct
+    if not correct:
+        return 0
+
+    reviews = {
+        review.snippet_id: review
+        for review in SnippetReview.objects.filter(user=user, snippet_id__in=correct.keys())
+    }
+    created, updated = [], []
+    for snippet_id, is_correct in correct.items():
+        review = reviews.get(snippet_id)
+        if review is None:
+            review = SnippetReview(user=user, snippet_id=snippet_id, course_id=course_id)
+            created.append(review)
+        else:
+            updated.append(review)
+        schedule_review(review, is_correct, now)
+
+    SnippetReview.objects.bulk_create(created)
+    SnippetReview.objects.bulk_update(
+        updated, ['repetitions', 'lapses', 'ease', 'interval_days', 'due_at', 'last_reviewed_at']
+    )
+    return len(correct)
+
+
+def due_snippets(user, course_id, k: int, material_ids: Optional[Iterable] = None,
+                 now: Optional[datetime.datetime] = None) -> List[MaterialSnippet]:
+    """Up to k snippets of a course due for review by a user, most overdue first
+
+    Reads the head of the (user, course, due_at) index, so it does not depend on the size of
+    the user's history.
+    """
+    if k <= 0:
+        return []
+    due = SnippetReview.objects.filter(user=user, course_id=course_id, due_at__lte=now or timezone.now())
+    if material_ids is not None:
+        due = due.filter(snippet__class_material_id__in=material_ids)
+    snippet_ids = list(due.order_by('due_at').values_list('snippet_id', flat=True)[:k])
+    snippets = MaterialSnippet.objects.in_bulk(snippet_ids)
+    return [snippets[snippet_id] for snippet_id in snippet_ids if snippet_id in snippets]
@@ -0,0 +1,30 @@
+import json
+import contextvars
+from typing import Any, Iterable, Iterator
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Format one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+def iterate_in_context(context: contextvars.Context, events: Iterable) -> Iterator:
+    """Iterate events inside a captured context
+
+    Streaming responses are consumed after the view (and the middleware binding the request
+    context) returned; running each step in the view's context keeps its deadline and usage tags.
+    """
+    iterator = iter(events)
+    try:
+        while True:
+            try:
+                yield context.run(next, iterator)
+            except StopIteration:
+                return
+    finally:
+        # Runs the generator's cleanup (e.g. cancelling work) in the same context
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            context.run(close)
@@ -0,0 +1,94 @@
+import datetime
+import logging
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from ..models.llm_usage import LLMUsage
+from . import background
+
+logger = logging.getLogger(__name__)
+
+# Dedicated to usage rows, so they never queue behind generation and indexing jobs on the shared pool
+_usage_pool = background.Pool("usage", max_workers=2)
+
+# Seconds a caller waits for its usage row to be written before logging and moving on
+USAGE_WRITE_TIMEOUT = 5
+
+
+def record_usage(event: Dict[str, Any]):
+    """Usage listener: persist one generation call
+
+    The row is written on the usage pool's own connection, so it commits outside (and survives
+    a rollback of) the request that made the call: a failed quiz creation still spent the tokens.
+    The caller waits for the write, so budget checks right after the call already count it and
+    no row is lost if the process stops.
+    """
+    future = _usage_pool.submit(_save_usage, dict(event))
+    try:
+        future.result(timeout=USAGE_WRITE_TIMEOUT)
+    except FutureTimeoutError:
+        logger.warning(f"Usage row for {event.get('call_site', '')} not written after {USAGE_WRITE_TIMEOUT}s")
+    except Exception:
+        # Already logged by the pool; losing one usage row must not fail the generation call
+        pass
+
+
+def _save_usage(event: Dict[str, Any]):
+    LLMUsage.objects.create(
+        user_id=event.get('user_id'),
+        course_id=event.get('course_id'),
+        request_id=event.get('request_id'),
+        endpoint=event.get('endpoint'),
+        call_site=event.get('call_site', ''),
+        model=event.get('model', ''),
+        prompt_tokens=event.get('prompt_tokens', 0),
+        output_tokens=event.get('output_tokens', 0),
+        latency_ms=event.get('latency_ms', 0),
+        success=event.get('success', True),
+    )
+
+
+def usage_summary(since: datetime.datetime) -> Dict[str, Any]:
+    """Aggregate token usage since a point in time, per endpoint, per course and per call site"""
+    queryset = LLMUsage.objects.filter(created_at__gte=since)
+    aggregates = dict(
+        calls=Count('id'),
+        prompt_tokens=Sum('prompt_tokens'),
+        output_tokens=Sum('output_tokens'),
+        latency_ms=Sum('latency_ms'),
+    )
+
+    def group(*fields):
+        return list(queryset.values(*fields).annotate(**aggregates).order_by('-prompt_tokens'))
+
+    return {
+        'since': since,
+        'totals': queryset.aggregate(**aggregates),
+        'by_endpoint': group('endpoint'),
+        'by_course': group('course_id', 'course__name'),
+        'by_call_site': group('call_site', 'model'),
+    }
+
+
+def tokens_used_today(user) -> int:
+    """Prompt plus output tokens spent by a user since midnight (server time zone)"""
+    start_of_day = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    totals = LLMUsage.objects.filter(user=user, created_at__gte=start_of_day).aggregate(
+        prompt=Sum('prompt_tokens'),
+        output=Sum('output_tokens'),
+    )
+    return (totals['prompt'] or 0) + (totals['output'] or 0)
+
+
+def budget_retry_after(user) -> Optional[int]:
+    """Seconds until the user's daily token budget resets, or None if they are within budget"""
+    budget = getattr(settings, 'LLM_USER_DAILY_TOKEN_BUDGET', None)
+    if not budget or tokens_used_today(user) < budget:
+        return None
+    now = timezone.localtime()
+    tomorrow = (now + datetime.timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return int((tomorrow - now).total_seconds())
@@ -0,0 +1,310 @@
+import io
+import os
+import re
+import zlib
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from ..models.material_snippet import MaterialSnippet
+from ..gcp.cassette import cassette_call
+from . import background
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset("""
+a an and are as at be by can do does for from has have how in is it its of on or that the
+their this to was what when where which who why will with
+""".split())
+
+
+class HashingEmbedder:
+    """Local stand-in for an embedding model: signed feature hashing of words and word bigrams
+
+    Needs no network or model download, so ingestion and search work offline. Vectors are
+    L2-normalised, so dot products are cosine similarities.
+    """
+    name = "hashing"
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def _features(self, text: str) -> List[str]:
+        # Stop words dropped and plurals folded ("trees" -> "tree") so short queries match
+        words = [word[:-1] if len(word) > 3 and word.endswith('s') and not word.endswith('ss') else word
+                 for word in TOKEN_PATTERN.findall(text.lower()) if word not in STOP_WORDS]
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            hashes = np.array([zlib.crc32(feature.encode("utf-8")) for feature in self._features(text)],
+                              dtype=np.uint32)
+            if not len(hashes):
+                continue
+            signs = np.where(hashes & 1, 1.0, -1.0).astype(np.float32)
+            np.add.at(vectors[row], (hashes >> 1) % self.dim, signs)
+        # Sublinear term frequency, then unit length
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
+
+
+class VertexEmbedder:
+    """Vertex AI text embeddings, requested in batches"""
+    name = "vertex"
+
+    def __init__(self, model_name: str = "text-embedding-005", dim: int = 768, batch_size: int = 100):
+        self.model_name = model_name
+        self.dim = dim
+        self.batch_size = batch_size
+        self._model = None
+
+    def _get_model(self):
+        if self._model is None:
+            from vertexai.language_models import TextEmbeddingModel
+            self._model = TextEmbeddingModel.from_pretrained(self.model_name)
+        return self._model
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = list(texts[start:start + self.batch_size])
+            values = cassette_call(
+                "vertex.embed", {"model": self.model_name, "texts": batch},
+                lambda batch=batch: [embedding.values for embedding in self._get_model().get_embeddings(batch)],
+            )
+            vectors.extend(values)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dim)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def get_embedder():
+    """Embedder selected by the VECTOR_INDEX_EMBEDDER setting ("hashing" or "vertex")"""
+    if settings.VECTOR_INDEX_EMBEDDER == VertexEmbedder.name:
+        return VertexEmbedder()
+    return HashingEmbedder()
+
+
+class VectorIndex:
+    def __init__(self, dim: int, embedder_name: str):
+        """In-memory top-k index over unit vectors, stored as a float16 matrix
+
+        Rows live in a preallocated matrix that doubles when full; deleting moves the last row
+        into the freed slot, so add and delete cost O(rows touched) rather than a full copy.
+        Persisting is not incremental: every index_snippets or remove_snippets call rewrites the
+        whole .npz file, O(n) in the size of the course, so callers pass whole batches (one
+        material's snippets) rather than single snippets.
+        """
+        self.dim = dim
+        self.embedder_name = embedder_name
+        self._matrix = np.zeros((0, dim), dtype=np.float16)
+        self._ids: List[str] = []
+        self._positions: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, item_id) -> bool:
+        return str(item_id) in self._positions
+
+    def add(self, ids: Sequence, vectors: np.ndarray):
+        """Insert or replace the vectors of the given ids"""
+        vectors = np.asarray(vectors, dtype=np.float16)
+        new_rows = [i for i, item_id in enumerate(ids) if str(item_id) not in self._positions]
+        needed = len(self._ids) + len(new_rows)
+        if needed > len(self._matrix):
+            grown = np.zeros((max(needed, 2 * len(self._matrix), 64), self.dim), dtype=np.float16)
+            grown[:len(self._ids)] = self._matrix[:len(self._ids)]
+            self._matrix = grown
+
+        for i, item_id in enumerate(ids):
+            item_id = str(item_id)
+            position = self._positions.get(item_id)
+            if position is None:
+                position = len(self._ids)
+                self._ids.append(item_id)
+                self._positions[item_id] = position
+            self._matrix[position] = vectors[i]
+
+    def delete(self, ids: Iterable):
+        for item_id in ids:
+            position = self._positions.pop(str(item_id), None)
+            if position is None:
+                continue
+            last = len(self._ids) - 1
+            if position != last:
+                moved_id = self._ids[last]
+                self._matrix[position] = self._matrix[last]
+                self._ids[position] = moved_id
+                self._positions[moved_id] = position
+            self._ids.pop()
+
+    def search(self, vector: np.ndarray, k: int = 10,
+               allowed_ids: Optional[Iterable] = None) -> List[Tuple[str, float]]:
+        """Top-k ids by cosine similarity, optionally restricted to some ids"""
+        count = len(self._ids)
+        if count == 0 or k <= 0:
+            return []
+        scores = self._matrix[:count].astype(np.float32) @ np.asarray(vector, dtype=np.float32)
+        if allowed_ids is not None:
+            mask = np.full(count, -np.inf, dtype=np.float32)
+            rows = [self._positions[str(item_id)] for item_id in allowed_ids if str(item_id) in self._positions]
+            mask[rows] = 0.0
+            scores = scores + mask
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self._ids[row], float(scores[row])) for row in top if np.isfinite(scores[row])]
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            matrix=self._matrix[:len(self._ids)],
+            ids=np.array(self._ids, dtype=str),
+            embedder=np.array(self.embedder_name),
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "VectorIndex":
+        with np.load(io.BytesIO(data)) as arrays:
+            matrix = arrays["matrix"]
+            index = cls(matrix.shape[1], str(arrays["embedder"]))
+            index.add(list(arrays["ids"]), matrix)
+        return index
+
+
+_indexes: Dict[str, Tuple[VectorIndex, float]] = {}
+_locks: Dict[str, threading.Lock] = {}
+_locks_lock = threading.Lock()
+
+
+def _course_lock(course_id: str) -> threading.Lock:
+    with _locks_lock:
+        return _locks.setdefault(course_id, threading.Lock())
+
+
+def _index_path(course_id: str) -> str:
+    return os.path.join(settings.VECTOR_INDEX_DIR, f"course_{course_id}.npz")
+
+
+def _save(course_id: str, index: VectorIndex):
+    path = _index_path(course_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename so readers in other processes never see a partial file
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(index.to_bytes())
+    os.replace(temp_path, path)
+    _indexes[course_id] = (index, os.path.getmtime(path))
+
+
+def _build(course_id: str, embedder) -> VectorIndex:
+    index = VectorIndex(embedder.dim, embedder.name)
+    snippets = list(MaterialSnippet.objects.filter(class_material__course_id=course_id).values_list('id', 'snippet'))
+    if snippets:
+        index.add([snippet_id for snippet_id, _ in snippets], embedder.embed([text for _, text in snippets]))
+    logger.info(f"Built vector index of course {course_id} with {len(index)} snippets")
+    return index
+
+
+def _load(course_id: str, embedder) -> VectorIndex:
+    """Return the course index, reloading it if another process saved a newer one
+
+    Missing indexes, and indexes built with another embedder, are rebuilt from the database.
+    Call with the course lock held.
+    """
+    path = _index_path(course_id)
+    cached = _indexes.get(course_id)
+    if os.path.isfile(path):
+        mtime = os.path.getmtime(path)
+        if cached is not None and cached[1] == mtime:
+            index = cached[0]
+        else:
+            with open(path, "rb") as f:
+                index = VectorIndex.from_bytes(f.read())
+            _indexes[course_id] = (index, mtime)
+        if index.embedder_name == embedder.name and index.dim == embedder.dim:
+            return index
+
+    index = _build(course_id, embedder)
+    _save(course_id, index)
+    return index
+
+
+def index_snippets(course_id, snippet_ids: Optional[Iterable] = None):
+    """Embed snippets of a course in one batch and add them to its index
+
+    Args:
+        course_id: Course the snippets belong to
+        snippet_ids: Snippets to (re)index, None for every snippet of the course
+    """
+    course_id = str(course_id)
+    embedder = get_embedder()
+    with _course_lock(course_id):
+        if snippet_ids is None:
+            _save(course_id, _build(course_id, embedder))
+            return
+
+        index = _load(course_id, embedder)
+        snippets = MaterialSnippet.objects.filter(class_material__course_id=course_id, pk__in=list(snippet_ids))
+        missing = [(snippet_id, text) for snippet_id, text in snippets.values_list('id', 'snippet')
+                   if snippet_id not in index]
+        if missing:
+            index.add([snippet_id for snippet_id, _ in missing], embedder.embed([text for _, text in missing]))
+            _save(course_id, index)
+
+
+def remove_snippets(course_id, snippet_ids: Iterable):
+    course_id = str(course_id)
+    if not os.path.isfile(_index_path(course_id)):
+        return
+    with _course_lock(course_id):
+        index = _load(course_id, get_embedder())
+        index.delete(snippet_ids)
+        _save(course_id, index)
+
+
+def search_snippets(course_id, query: str, k: int = 10,
+                    allowed_ids: Optional[Iterable] = None) -> List[Tuple[str, float]]:
+    """Top-k snippet ids of a course for a text query, with their cosine similarity"""
+    course_id = str(course_id)
+    embedder = get_embedder()
+    vector = embedder.embed([query])[0]
+    with _course_lock(course_id):
+        index = _load(course_id, embedder)
+        return index.search(vector, k=k, allowed_ids=allowed_ids)
+
+
+def delete_course_index(course_id):
+    course_id = str(course_id)
+    with _course_lock(course_id):
+        _indexes.pop(course_id, None)
+        try:
+            os.remove(_index_path(course_id))
+        except FileNotFoundError:
+            pass
+
+
+def schedule_snippet_indexing(course_id, snippet_ids: Iterable):
+    """Index freshly ingested snippets once the transaction that created them commits"""
+    snippet_ids = list(snippet_ids)
+    transaction.on_commit(lambda: background.submit(index_snippets, course_id, snippet_ids))
+
+
+def schedule_snippet_removal(course_id, snippet_ids: Iterable):
+    """Drop snippets from the index once their deletion commits"""
+    snippet_ids = list(snippet_ids)
+    transaction.on_commit(lambda: background.submit(remove_snippets, course_id, snippet_ids))
+
+
+def schedule_index_removal(course_id):
+    transaction.on_commit(lambda: background.submit(delete_course_index, course_id))
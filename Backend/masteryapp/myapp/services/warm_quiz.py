@@ -0,0 +1,148 @@
+import logging
+import datetime
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from ..models.quiz import Quiz, GenerationMode
+from ..models.course import Course
+from ..models.subject import Subject
+from ..models.class_material import ClassMaterial
+from ..gcp.request_context import request_context, tag_request
+from .usage import budget_retry_after
+from .course_corpus import retrieval_scope
+from .question_bank import take_from_bank
+from .quiz_generation import (
+    resolve_generation_mode, select_snippets, generate_questions, save_questions,
+)
+from .mastery import subject_mastery_map
+from .fingerprint import SeenQuestions
+from . import background
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUIZ_LENGTH = Quiz._meta.get_field('quiz_length').default
+DEFAULT_OPTIONS_PER_QUESTION = Quiz._meta.get_field('options_per_question').default
+
+# Dedicated to warm quizzes: their generation waits on indexing jobs of the shared pool, and
+# running it there could take every worker and leave those jobs queued forever
+_warm_pool = background.Pool("warm-quiz", max_workers=2)
+
+
+def mastery_snapshot(user, course_id) -> Dict[str, float]:
+    """Mastery of every subject of a course for a user, keyed by subject id"""
+    return subject_mastery_map(user, Subject.objects.filter(course_id=course_id).values_list('id', flat=True))
+
+
+def _is_fresh(quiz: Quiz, snapshot: Dict[str, float]) -> bool:
+    """A warm quiz is stale once too old or once the mastery it was weighted with has drifted"""
+    if timezone.now() - quiz.created_at > datetime.timedelta(seconds=settings.WARM_QUIZ_MAX_AGE_SECONDS):
+        return False
+    warm_mastery = quiz.warm_mastery or {}
+    return all(
+        abs(mastery - warm_mastery.get(subject_id, 0.0)) <= settings.WARM_QUIZ_MASTERY_DRIFT
+        for subject_id, mastery in snapshot.items()
+    )
+
+
+def prepare_warm_quiz(user_id, course_id) -> Optional[Quiz]:
+    """Pre-generate the next default quiz of a user for a course, unless a fresh one is waiting
+
+    Stale warm quizzes are discarded first. Nothing is generated for users out of budget. The
+    check and the creation of the (empty) warm quiz happen under a lock on the course row, so
+    concurrent calls for the same user and course generate a single quiz; a warm quiz still
+    being generated counts as waiting.
+    """
+    user = User.objects.get(pk=user_id)
+    with transaction.atomic():
+        if Course.objects.select_for_update().filter(pk=course_id).first() is None:
+            return None
+        snapshot = mastery_snapshot(user, course_id)
+        for quiz in Quiz.objects.filter(user=user, course_id=course_id, is_warm=True):
+            if _is_fresh(quiz, snapshot):
+                return quiz
+            quiz.delete()
+        if budget_retry_after(user) is not None:
+            return None
+
+        generation_mode = resolve_generation_mode(GenerationMode.AUTO, DEFAULT_QUIZ_LENGTH)
+        # Warm quizzes are hidden from listings and mastery until claimed, so the quiz is committed
+        # before generation (outside the lock) and removed if generation fails
+        quiz = Quiz.objects.create(
+            user=user,
+            course_id=course_id,
+            name=f'{timezone.now().strftime("%d %B")} quiz',
+            generation_mode=generation_mode,
+            is_warm=True,
+            warm_mastery=snapshot,
+        )
+
+    with request_context(timeout=settings.REQUEST_DEADLINE_SECONDS):
+        tag_request(user_id=user.id, course_id=course_id, endpoint='quizzes.warm')
+        try:
+            corpus_name, rag_file_names = None, {}
+            if generation_mode == GenerationMode.RAG:
+                corpus_name, rag_file_names = retrieval_scope(
+                    course_id, ClassMaterial.objects.filter(course_id=course_id).values_list('id', flat=True)
+                )
+            selected_snippets = select_snippets(quiz)
+            seen = SeenQuestions.for_course(user, course_id)
+            bank_questions, missing_snippets = take_from_bank(selected_snippets, quiz.options_per_question, seen)
+            generated_questions = generate_questions(quiz, missing_snippets, corpus_name, rag_file_names, seen)
+            save_questions(quiz, bank_questions + generated_questions)
+        except Exception:
+            quiz.delete()
+            raise
+
+    logger.info(f"Prepared warm quiz {quiz.id} for user {user.id} in course {course_id}")
+    return quiz
+
+
+def schedule_warm_quiz(user_id, course_id):
+    """Prepare the user's next quiz once the current transaction commits"""
+    transaction.on_commit(lambda: _warm_pool.submit(prepare_warm_quiz, user_id, course_id))
+
+
+def claim_warm_quiz(user, validated_data) -> Optional[Quiz]:
+    """Hand out the user's warm quiz if it matches the requested parameters and is still fresh
+
+    Only default quizzes are pre-generated: no subject or material filter, default length,
+    options and optimize_learning, and a generation mode of "auto" or the one the warm quiz used.
+    The claimed quiz is published as if it had just been created.
+    """
+    if validated_data.get('subjects') or validated_data.get('materials'):
+        return None
+    if validated_data.get('quiz_length', DEFAULT_QUIZ_LENGTH) != DEFAULT_QUIZ_LENGTH:
+        return None
+    if validated_data.get('options_per_question', DEFAULT_OPTIONS_PER_QUESTION) != DEFAULT_OPTIONS_PER_QUESTION:
+        return None
+
+    course = validated_data['course']
+    quiz = (
+        Quiz.objects.select_for_update(skip_locked=True)
+        .filter(user=user, course=course, is_warm=True)
+        .order_by('-created_at')
+        .first()
+    )
+    if quiz is None:
+        return None
+    if validated_data.get('optimize_learning', True) != quiz.optimize_learning:
+        return None
+    requested_mode = validated_data.get('generation_mode', GenerationMode.AUTO)
+    if requested_mode not in (GenerationMode.AUTO, quiz.generation_mode):
+        return None
+    if not quiz.question_set.exists():
+        return None # Still being generated
+    if not _is_fresh(quiz, mastery_snapshot(user, course.id)):
+        quiz.delete()
+        return None
+
+    quiz.is_warm = False
+    quiz.warm_mastery = None
+    quiz.name = validated_data.get('name', quiz.name)
+    quiz.created_at = timezone.now()
+    quiz.save()
+    return quiz
@@ -1,3 +1,1012 @@
-from django.test import TestCase
+import random
+import os
+import json
+import tempfile
+import datetime
+import threading
+from collections import Counter
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from .models import (
+    BankQuestion, ClassMaterial, Course, IdempotencyKey, LLMUsage, MaterialSnippet, Question, Quiz, SnippetMastery,
+    SnippetReview, Subject, SubjectMastery,
+)
+from .models.quiz import GenerationMode
+
+from .services.selection import select_stratified
+from .services.sampling import FenwickTree, WeightedSampler
+from .services import cloze, idempotency, mastery, question_bank, usage, vector_index
+from .services.vector_index import HashingEmbedder, VectorIndex
+from .services.fingerprint import question_fingerprint
+from .views import quiz_view
+from .services.warm_quiz import claim_warm_quiz
+from .services.retake import create_retake, shuffled_choices
+from .services.spaced_repetition import due_snippets, record_reviews, schedule_review
+from .gcp import request_context as request_context_module
+from .gcp.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, get_breaker
+from .gcp.model_router import GenerationError, ModelRouter
+from .gcp.request_context import DeadlineExceeded, request_context
+from .gcp import rag_question_maker
+from .gcp.rag_question_maker import QuizMakerRAG, expand_pooled_question, is_valid_question
+
+
+class SelectStratifiedTests(SimpleTestCase):
+    def setUp(self):
+        self.rng = random.Random(1)
+
+    def test_picks_k_distinct_ids(self):
+        ids = list(range(20))
+        picked = select_stratified(ids, [1.0] * 20, ['a'] * 20, 8, rng=self.rng)
+        self.assertEqual(len(picked), 8)
+        self.assertEqual(len(set(picked)), 8)
+
+    def test_empty_or_zero_k(self):
+        self.assertEqual(select_stratified([], [], [], 5), [])
+        self.assertEqual(select_stratified([1, 2], [1.0, 1.0], ['a', 'a'], 0), [])
+
+    def test_covers_every_group(self):
+        # One light id per small group next to a heavy group that would otherwise take every slot
+        ids = list(range(13))
+        weights = [100.0] * 10 + [0.01] * 3
+        groups = ['heavy'] * 10 + ['b', 'c', 'd']
+        for _ in range(50):
+            picked = select_stratified(ids, weights, groups, 5, rng=self.rng)
+            self.assertTrue({10, 11, 12} <= set(picked))
+
+    def test_min_per_group(self):
+        ids = list(range(12))
+        weights = [100.0] * 6 + [0.01] * 6
+        groups = ['a'] * 6 + ['b'] * 6
+        for _ in range(50):
+            picked = select_stratified(ids, weights, groups, 6, min_per_group=3, rng=self.rng)
+            self.assertEqual(sum(1 for snippet_id in picked if groups[snippet_id] == 'b'), 3)
+
+    def test_covered_groups_need_no_reserved_pick(self):
+        ids = list(range(12))
+        weights = [100.0] * 10 + [0.01] * 2
+        groups = ['heavy'] * 10 + ['b', 'c']
+        for _ in range(50):
+            picked = select_stratified(ids, weights, groups, 3, covered={'b': 1}, rng=self.rng)
+            self.assertIn(11, picked)
+            self.assertNotIn(10, picked)
+
+    def test_more_groups_than_k_keeps_one_per_group(self):
+        ids = list(range(10))
+        picked = select_stratified(ids, [1.0] * 10, [str(i) for i in ids], 4, rng=self.rng)
+        self.assertEqual(len(set(picked)), 4)
+
+    def test_repeats_spread_evenly_when_k_exceeds_ids(self):
+        counts = Counter(select_stratified([1, 2, 3], [5.0, 1.0, 1.0], ['a', 'b', 'b'], 8, rng=self.rng))
+        self.assertEqual(sum(counts.values()), 8)
+        self.assertLessEqual(max(counts.values()) - min(counts.values()), 1)
+
+    def test_zero_weights_only_fill_up(self):
+        ids = list(range(6))
+        weights = [1.0, 1.0, 1.0, 0.0, 0.0, 0.0]
+        for _ in range(20):
+            self.assertEqual(set(select_stratified(ids, weights, ['a'] * 6, 3, rng=self.rng)), {0, 1, 2})
+        self.assertEqual(len(set(select_stratified(ids, weights, ['a'] * 6, 5, rng=self.rng))), 5)
+
+    def test_heavier_ids_are_picked_more_often(self):
+        ids = list(range(10))
+        weights = [10.0] + [1.0] * 9
+        counts = Counter()
+        for _ in range(2000):
+            counts.update(select_stratified(ids, weights, ['a'] * 10, 1, rng=self.rng))
+        # Drawn with probability 10 / 19 against 1 / 19 for each other id
+        self.assertAlmostEqual(counts[0] / 2000, 10 / 19, delta=0.05)
+
+
+class WeightedSamplerTests(SimpleTestCase):
+    def setUp(self):
+        self.rng = random.Random(3)
+
+    def sampler(self, weights, groups):
+        return WeightedSampler(list(range(len(weights))), weights, groups)
+
+    def test_fenwick_find_and_prefix_sums(self):
+        tree = FenwickTree([1.0, 0.0, 2.0, 3.0])
+        self.assertEqual(tree.prefix_sum(4), 6.0)
+        self.assertEqual([tree.find(target) for target in (0.5, 1.0, 2.9, 3.0, 5.9)], [0, 2, 2, 3, 3])
+        tree.add(1, 4.0)
+        self.assertEqual(tree.prefix_sum(2), 5.0)
+        self.assertEqual(tree.find(1.5), 1)
+
+    def test_picks_k_distinct_ids_and_restores_weights(self):
+        sampler = self.sampler([1.0] * 20, ['a'] * 10 + ['b'] * 10)
+        picked = sampler.sample(8, rng=self.rng)
+        self.assertEqual(len(set(picked)), 8)
+        self.assertEqual([sampler.weight(item_id) for item_id in range(20)], [1.0] * 20)
+        self.assertAlmostEqual(sampler._tree.prefix_sum(20), 20.0)
+
+    def test_covers_every_group(self):
+        sampler = self.sampler([100.0] * 10 + [0.01] * 3, ['heavy'] * 10 + ['b', 'c', 'd'])
+        for _ in range(50):
+            self.assertTrue({10, 11, 12} <= set(sampler.sample(5, rng=self.rng)))
+
+    def test_covered_and_excluded(self):
+        sampler = self.sampler([100.0] * 10 + [0.01] * 2, ['heavy'] * 10 + ['b', 'c'])
+        for _ in range(50):
+            picked = sampler.sample(3, covered={'b': 1}, exclude={0, 1}, rng=self.rng)
+            self.assertIn(11, picked)
+            self.assertNotIn(10, picked)
+            self.assertFalse({0, 1} & set(picked))
+
+    def test_exclude_ignored_when_too_few_others(self):
+        sampler = self.sampler([1.0] * 4, ['a'] * 4)
+        self.assertEqual(set(sampler.sample(4, exclude={0, 1}, rng=self.rng)), {0, 1, 2, 3})
+
+    def test_repeats_spread_evenly_when_k_exceeds_ids(self):
+        counts = Counter(self.sampler([5.0, 1.0, 1.0], ['a', 'b', 'b']).sample(8, rng=self.rng))
+        self.assertEqual(sum(counts.values()), 8)
+        self.assertLessEqual(max(counts.values()) - min(counts.values()), 1)
+
+    def test_weight_updates_change_draws(self):
+        sampler = self.sampler([1.0] * 10, ['a'] * 10)
+        sampler.set_weight(0, 10.0)
+        counts = Counter()
+        for _ in range(2000):
+            counts.update(sampler.sample(1, rng=self.rng))
+        self.assertAlmostEqual(counts[0] / 2000, 10 / 19, delta=0.05)
+        sampler.set_weight(0, 0.0)
+        self.assertNotIn(0, sampler.sample(9, rng=self.rng))
+
+
+class ClozeTermTests(SimpleTestCase):
+    def test_definition_terms_skip_pronouns_and_determiners(self):
+        self.assertFalse(cloze._is_definition_term('This'))
+        self.assertFalse(cloze._is_definition_term('It'))
+        self.assertFalse(cloze._is_definition_term('Each of them'))
+        self.assertTrue(cloze._is_definition_term('Photosynthesis'))
+        self.assertTrue(cloze._is_definition_term('DNA'))
+
+    def test_fillers_are_not_key_terms(self):
+        terms = cloze._candidate_terms('This is important because it converts light into energy')
+        self.assertEqual(set(terms), {'light', 'energy'})
+
+
+class ExpandPooledQuestionTests(SimpleTestCase):
+    candidates = ['Nucleus', 'Ribosome', 'Golgi apparatus', 'Lysosome', 'Mitochondria']
+
+    def expand(self, **fields):
+        question_raw = {'snippet_id': 's1', 'question': 'Which organelle makes ATP?', 'answer': 'Mitochondria',
+                        'distractor_indexes': [0, 1, 3]}
+        question_raw.update(fields)
+        return expand_pooled_question(question_raw, self.candidates, 4, rng=random.Random(0))
+
+    def test_valid_picks(self):
+        question = self.expand()
+        self.assertTrue(is_valid_question(question, 4))
+        self.assertEqual(question['choices'][question['answer_index']], 'Mitochondria')
+        self.assertEqual(set(question['choices']), {'Mitochondria', 'Nucleus', 'Ribosome', 'Lysosome'})
+
+    def test_blank_or_missing_stem(self):
+        self.assertIsNone(self.expand(question=None))
+        self.assertIsNone(self.expand(question='  '))
+
+    def test_invalid_picks_are_rejected(self):
+        self.assertIsNone(self.expand(distractor_indexes=None))
+        self.assertIsNone(self.expand(distractor_indexes=[0, 1]))
+        self.assertIsNone(self.expand(distractor_indexes=[0, 1, 9]))
+        self.assertIsNone(self.expand(distractor_indexes=[0, 0, 1]))
+        self.assertIsNone(self.expand(distractor_indexes=[0, 1, 4])) # The answer itself
+
+
+class StoredMasteryTests(TestCase):
+    def setUp(self):
+        self.rng = random.Random(7)
+        self.start = timezone.now() - datetime.timedelta(days=200)
+        self.user = User.objects.create_user(username='learner')
+        self.course = Course.objects.create(user=self.user, name='Biology', description='')
+        material = ClassMaterial.objects.create(course=self.course, file_name='notes.pdf')
+        self.subjects = [Subject.objects.create(course=self.course, name=f'Subject {i}') for i in range(3)]
+        self.snippets = [
+            MaterialSnippet.objects.create(class_material=material, subject=self.subjects[i % 3], snippet=f'Snippet {i}')
+            for i in range(9)
+        ]
+
+    def at(self, days: float) -> datetime.datetime:
+        return self.start + datetime.timedelta(days=days)
+
+    def take_quiz(self, days: float, length: int = 6) -> Quiz:
+        """Submit a quiz with random answers, as the submit endpoint does"""
+        quiz = Quiz.objects.create(user=self.user, course=self.course, name='Quiz')
+        for snippet in self.rng.choices(self.snippets, k=length):
+            Question.objects.create(quiz=quiz, snippet=snippet, question='?', choices='a;;/;;b', single_correct_choice=0)
+        self.submit(quiz, days)
+        return quiz
+
+    def submit(self, quiz: Quiz, days: float):
+        questions = list(Question.objects.filter(quiz=quiz))
+        previous = mastery.quiz_answers(questions, quiz.completed_at)
+        for question in questions:
+            question.is_correct = self.rng.random() < 0.6
+        with transaction.atomic():
+            Question.objects.bulk_update(questions, ['is_correct'])
+            quiz.completed_at = self.at(days)
+            quiz.save()
+            mastery.update_mastery(
+                self.user, removed=previous, added=mastery.quiz_answers(questions, quiz.completed_at), now=quiz.completed_at
+            )
+
+    def delete(self, quiz: Quiz, days: float):
+        with transaction.atomic():
+            answers = mastery.quiz_answers(Question.objects.filter(quiz=quiz), quiz.completed_at)
+            quiz.delete()
+            mastery.update_mastery(self.user, removed=answers, now=self.at(days))
+
+    def answers(self):
+        return Question.objects.filter(
+            quiz__user=self.user, quiz__completed_at__isnull=False, is_correct__isnull=False
+        ).values_list('snippet__subject_id', 'quiz__completed_at', 'is_correct')
+
+    def expected(self, now: datetime.datetime, floor_days: bool = False):
+        """Mastery per subject summed answer by answer, as before it was stored"""
+        expected = {str(subject.id): 0.0 for subject in self.subjects}
+        for subject_id, completed_at, is_correct in self.answers():
+            days = (now - completed_at).days if floor_days else (now - completed_at).total_seconds() / 86400
+            expected[str(subject_id)] += (1 if is_correct else -1) * max(0, 1 - 0.01 * days)
+        return expected
+
+    def stored(self, now: datetime.datetime):
+        with mock.patch.object(timezone, 'now', return_value=now):
+            return mastery.subject_mastery_map(self.user, self.subjects), mastery.subject_masteries(self.user, self.subjects)
+
+    def assertMasteryEqual(self, first, second, places=6):
+        self.assertEqual(first.keys(), second.keys())
+        for key in first:
+            self.assertAlmostEqual(first[key], second[key], places=places)
+
+    def test_closed_form_matches_answer_by_answer_sum(self):
+        for day in range(0, 90, 7):
+            self.take_quiz(day + self.rng.random())
+        now = self.at(95.5)
+        stored, _ = self.stored(now)
+        self.assertMasteryEqual(stored, self.expected(now))
+        # The old loop decayed by whole days: at most 0.01 apart per answer
+        old = self.expected(now, floor_days=True)
+        counts = Counter(str(subject_id) for subject_id, _, _ in self.answers())
+        for subject_id, value in stored.items():
+            self.assertLessEqual(abs(value - old[subject_id]), 0.01 * counts[subject_id] + 1e-9)
+
+    def test_incremental_updates_equal_rebuild(self):
+        quizzes = [self.take_quiz(day) for day in range(0, 60, 5)]
+        self.submit(quizzes[3], 61) # Resubmission replaces the earlier answers
+        self.delete(quizzes[5], 62)
+        now = self.at(70)
+        incremental = self.stored(now)
+        self.assertMasteryEqual(incremental[0], self.expected(now))
+
+        mastery.rebuild_mastery(self.user, self.subjects, now)
+        rebuilt = self.stored(now)
+        self.assertMasteryEqual(incremental[0], rebuilt[0])
+        self.assertMasteryEqual(incremental[1], rebuilt[1])
+
+    def test_resubmission_counts_the_last_answers_only(self):
+        quiz = self.take_quiz(10)
+        for day in (11, 12, 13):
+            self.submit(quiz, day)
+        now = self.at(20)
+        self.assertMasteryEqual(self.stored(now)[0], self.expected(now))
+        self.assertEqual(
+            sum(row.correct_count + row.incorrect_count for row in SubjectMastery.objects.filter(user=self.user)),
+            Question.objects.filter(quiz=quiz).count(),
+        )
+
+    def counted(self, model=SubjectMastery) -> int:
+        return sum(row.correct_count + row.incorrect_count for row in model.objects.filter(user=self.user))
+
+    def test_answers_are_evicted_after_100_days(self):
+        self.take_quiz(0)
+        self.take_quiz(60)
+        counted = self.counted()
+        now = self.at(130)
+        self.assertMasteryEqual(self.stored(now)[0], self.expected(now))
+        # Reads evict in memory only
+        self.assertEqual(self.counted(), counted)
+
+        now = self.at(200)
+        self.assertMasteryEqual(self.stored(now)[0], dict.fromkeys(self.stored(now)[0], 0.0))
+        self.assertEqual(self.stored(now)[1], dict.fromkeys(self.stored(now)[1], 0))
+        self.assertEqual(self.counted(), counted)
+
+        # The next submission evicts the rows it touches
+        quiz = Quiz.objects.create(user=self.user, course=self.course, name='Quiz')
+        for snippet in self.snippets:
+            Question.objects.create(quiz=quiz, snippet=snippet, question='?', choices='a;;/;;b', single_correct_choice=0)
+        self.submit(quiz, 200)
+        self.assertEqual(self.counted(), len(self.snippets))
+        self.assertEqual(self.counted(SnippetMastery), len(self.snippets))
+        self.assertMasteryEqual(self.stored(self.at(201))[0], self.expected(self.at(201)))
+
+    def test_unanswered_questions_do_not_count(self):
+        # Unlike the per-question loop this replaced, where they counted as wrong answers
+        quiz = Quiz.objects.create(user=self.user, course=self.course, name='Quiz')
+        for _ in range(3):
+            Question.objects.create(quiz=quiz, snippet=self.snippets[0], question='?', choices='a;;/;;b',
+                                    single_correct_choice=0)
+        with transaction.atomic():
+            Question.objects.filter(pk=Question.objects.filter(quiz=quiz).first().pk).update(is_correct=True)
+            quiz.completed_at = self.at(0)
+            quiz.save()
+            mastery.update_mastery(self.user, added=mastery.quiz_answers(Question.objects.filter(quiz=quiz), quiz.completed_at),
+                                   now=quiz.completed_at)
+        subject_mastery, listed_mastery = self.stored(self.at(10))
+        self.assertAlmostEqual(subject_mastery[str(self.subjects[0].id)], 0.9)
+        # Averaged over the subject's three snippets
+        self.assertAlmostEqual(listed_mastery[str(self.subjects[0].id)], 0.3)
+
+    def test_missing_aggregates_are_computed_without_storing_them(self):
+        for day in range(0, 60, 10):
+            self.take_quiz(day)
+        now = self.at(65)
+        stored = self.stored(now)
+        SubjectMastery.objects.filter(user=self.user).delete()
+        SnippetMastery.objects.filter(user=self.user).delete()
+
+        computed = self.stored(now)
+        self.assertMasteryEqual(computed[0], stored[0])
+        self.assertMasteryEqual(computed[1], stored[1])
+        self.assertFalse(SubjectMastery.objects.filter(user=self.user).exists())
+        self.assertFalse(SnippetMastery.objects.filter(user=self.user).exists())
+
+    def test_changes_after_eviction(self):
+        first = self.take_quiz(0)
+        self.take_quiz(150) # Evicts the first quiz from the rows it touches
+        # Its answers were already dropped from the sums and must not be removed twice
+        self.delete(first, 151)
+        now = self.at(160)
+        self.assertMasteryEqual(self.stored(now)[0], self.expected(now))
+
+
+class ClaimWarmQuizTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='learner')
+        self.course = Course.objects.create(user=self.user, name='Biology', description='')
+        self.warm_quiz = Quiz.objects.create(user=self.user, course=self.course, name='Warm', is_warm=True, warm_mastery={})
+        Question.objects.create(quiz=self.warm_quiz, question='What do mitochondria make?', type='SHORT_ANSWER',
+                                choices='', correct_short_answer='ATP')
+
+    def test_default_request_claims_the_warm_quiz(self):
+        quiz = claim_warm_quiz(self.user, {'course': self.course})
+        self.assertEqual(quiz, self.warm_quiz)
+        self.assertFalse(quiz.is_warm)
+
+    def test_optimize_learning_must_match(self):
+        self.assertIsNone(claim_warm_quiz(self.user, {'course': self.course, 'optimize_learning': False}))
+        self.assertTrue(Quiz.objects.get(pk=self.warm_quiz.pk).is_warm)
+
+
+class UsageRecordingTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='spender')
+
+    def event(self, tokens: int) -> dict:
+        return dict(user_id=self.user.id, call_site='quiz_generation', model='flash',
+                    prompt_tokens=tokens, output_tokens=0, latency_ms=10)
+
+    def test_row_is_counted_as_soon_as_the_call_returns(self):
+        usage.record_usage(self.event(300))
+        self.assertEqual(usage.tokens_used_today(self.user), 300)
+
+    def test_row_survives_a_rolled_back_request(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                usage.record_usage(self.event(120))
+                raise RuntimeError("quiz creation failed")
+        self.assertEqual(LLMUsage.objects.filter(user=self.user).count(), 1)
+
+
+class ModelRouterTests(SimpleTestCase):
+    def setUp(self):
+        # Usage rows need the database; these tests only look at the router's own metrics
+        patcher = mock.patch.object(request_context_module, '_usage_listeners', [])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.release = threading.Event()
+
+    def router(self, model: str, max_workers: int = 4, **route) -> ModelRouter:
+        """Router hedging every call after 50ms, whose requests answer after the given delays"""
+        route = {'model': model, 'fallbacks': [], 'timeout': 5,
+                 'hedge': dict(delay=0.05, max_rate=1.0, min_samples=1000), **route}
+        router = ModelRouter(routes={'task': route}, max_workers=max_workers)
+        # Let the slow requests finish, and their usage be emitted, before the listeners come back
+        self.addCleanup(router._executor.shutdown)
+        self.addCleanup(self.release.set)
+        return router
+
+    def answer(self, router: ModelRouter, *legs):
+        """Make the nth request sent answer legs[n] ("slow" ones only once the test ends)"""
+        calls = iter(legs)
+        lock = threading.Lock()
+
+        def generate_content(model_name, contents, config, tools=None, document=None):
+            with lock:
+                leg = next(calls)
+            if leg == 'slow':
+                self.release.wait(5)
+            return leg
+        router._generate_content = generate_content
+
+    def test_slow_call_is_hedged_and_the_hedge_wins(self):
+        router = self.router('hedge-wins')
+        self.answer(router, 'slow', 'fast')
+        self.assertEqual(router.generate('task', 'prompt'), 'fast')
+        metrics = router.metrics()['task']
+        self.assertEqual((metrics['hedges'], metrics['hedge_wins']), (1, 1))
+
+    def test_primary_answering_first_wins(self):
+        router = self.router('primary-wins')
+        hedge_sent = threading.Event()
+        calls = []
+
+        def generate_content(model_name, contents, config, tools=None, document=None):
+            calls.append(model_name)
+            if len(calls) == 1:
+                hedge_sent.wait(5)
+                return 'primary'
+            hedge_sent.set()
+            self.release.wait(5)
+            return 'hedge'
+        router._generate_content = generate_content
+
+        self.assertEqual(router.generate('task', 'prompt'), 'primary')
+        metrics = router.metrics()['task']
+        self.assertEqual((metrics['hedges'], metrics['hedge_wins']), (1, 0))
+
+    def test_fast_call_is_not_hedged(self):
+        router = self.router('not-hedged')
+        self.answer(router, 'fast')
+        self.assertEqual(router.generate('task', 'prompt'), 'fast')
+        self.assertEqual(router.metrics()['task']['hedges'], 0)
+
+    def test_no_hedge_while_every_worker_is_busy(self):
+        router = self.router('busy', max_workers=1, timeout=0.2)
+        self.answer(router, 'slow', 'fast')
+        with self.assertRaises(GenerationError):
+            router.generate('task', 'prompt')
+        self.assertEqual(router.metrics()['task']['hedges'], 0)
+
+    def test_deadline_expiry_does_not_count_against_the_model(self):
+        router = self.router('deadline', hedge=None)
+        self.answer(router, 'slow')
+        with request_context(timeout=0.1):
+            with self.assertRaises(DeadlineExceeded):
+                router.generate('task', 'prompt')
+        self.assertEqual(router.metrics()['task']['timeouts'], 1)
+        self.assertEqual(get_breaker('vertex:deadline').snapshot()['calls'], 0)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = CircuitBreaker('test', window=10, min_calls=4, failure_rate=0.5,
+                                      slow_call_seconds=10, slow_call_rate=0.5, open_seconds=30,
+                                      clock=lambda: self.now)
+
+    def calls(self, *outcomes, latency: float = 1.0):
+        for success in outcomes:
+            self.breaker.allow()
+            self.breaker.record(success, latency)
+
+    def test_failures_open_then_a_probe_closes(self):
+        self.calls(True, False, True)
+        self.assertEqual(self.breaker.state, CLOSED) # Fewer than min_calls
+        self.calls(False)
+        self.assertEqual(self.breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.allow()
+
+        self.now = 29
+        self.assertEqual(self.breaker.retry_after(), 1)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.allow()
+
+        self.now = 30
+        self.breaker.allow()
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.allow() # A single probe at a time
+        self.breaker.record(True, 1.0)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.breaker.snapshot()['calls'], 0)
+
+    def test_failed_probe_reopens(self):
+        self.calls(False, False, False, False)
+        self.now = 30
+        self.calls(False)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.now = 59
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.allow()
+
+    def test_slow_calls_open(self):
+        self.calls(True, True, True, latency=10)
+        self.calls(True, latency=1)
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_slow_probe_reopens(self):
+        self.calls(True, True, True, True, latency=20)
+        self.now = 30
+        self.calls(True, latency=20)
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_released_calls_are_not_counted(self):
+        for _ in range(10):
+            self.breaker.allow()
+            self.breaker.release()
+        self.assertEqual(self.breaker.snapshot()['calls'], 0)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_released_probe_lets_the_next_call_probe(self):
+        self.calls(False, False, False, False)
+        self.now = 30
+        self.breaker.allow()
+        self.breaker.release()
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.calls(True)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+
+class IdempotencyTests(TestCase):
+    class Action:
+        """Stand-in viewset action answering with the next queued status"""
+
+        def __init__(self, *statuses):
+            self.statuses = list(statuses)
+            self.calls = 0
+
+        @idempotency.idempotent('tests.create')
+        def create(self, request):
+            self.calls += 1
+            return Response({'call': self.calls}, status=self.statuses.pop(0))
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='retrier')
+        patcher = mock.patch.object(idempotency, '_schedule_purge')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request(self, key: str = 'key-1', data=None) -> Request:
+        request = Request(
+            RequestFactory().post('/quizzes/', json.dumps(data or {'name': 'Quiz'}), content_type='application/json',
+                                  HTTP_IDEMPOTENCY_KEY=key),
+            parsers=[JSONParser()],
+        )
+        request.user = self.user
+        return request
+
+    def test_same_key_replays_the_response(self):
+        action = self.Action(201, 201)
+        first = action.create(self.request())
+        replayed = action.create(self.request())
+        self.assertEqual(action.calls, 1)
+        self.assertEqual((replayed.status_code, replayed.data), (201, first.data))
+        self.assertEqual(replayed['Idempotent-Replayed'], 'true')
+
+    def test_client_errors_are_replayed_too(self):
+        action = self.Action(400, 201)
+        action.create(self.request())
+        self.assertEqual(action.create(self.request()).status_code, 400)
+        self.assertEqual(action.calls, 1)
+
+    def test_same_key_for_a_different_request_is_rejected(self):
+        action = self.Action(201, 201)
+        action.create(self.request())
+        response = action.create(self.request(data={'name': 'Other quiz'}))
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(action.calls, 1)
+
+    def test_key_is_released_after_retryable_responses(self):
+        for retryable in (500, 409, 429):
+            action = self.Action(retryable, 201)
+            self.assertEqual(action.create(self.request(key=f'key-{retryable}')).status_code, retryable)
+            self.assertFalse(IdempotencyKey.objects.filter(key=f'key-{retryable}').exists())
+            self.assertEqual(action.create(self.request(key=f'key-{retryable}')).status_code, 201)
+            self.assertEqual(action.calls, 2)
+
+    def test_key_is_released_when_the_action_raises(self):
+        action = self.Action()
+        with self.assertRaises(IndexError):
+            action.create(self.request())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    @override_settings(IDEMPOTENCY_WAIT_SECONDS=0)
+    def test_key_held_by_a_running_request_conflicts(self):
+        self.hold('key-1', seconds_ago=60)
+        action = self.Action(201)
+        self.assertEqual(action.create(self.request()).status_code, 409)
+        self.assertEqual(action.calls, 0)
+
+    @override_settings(IDEMPOTENCY_WAIT_SECONDS=0, IDEMPOTENCY_LOCK_SECONDS=600)
+    def test_dead_request_key_is_taken_over(self):
+        self.hold('key-1', seconds_ago=601)
+        action = self.Action(201)
+        self.assertEqual(action.create(self.request()).status_code, 201)
+        self.assertEqual(action.calls, 1)
+        self.assertEqual(IdempotencyKey.objects.get(key='key-1').status, 'completed')
+
+    def hold(self, key: str, seconds_ago: float):
+        """Key claimed by a request for the same payload that has not finished yet"""
+        record = IdempotencyKey.objects.create(
+            user=self.user, endpoint='tests.create', key=key,
+            request_hash=idempotency.request_fingerprint(self.request(key=key)),
+            expires_at=timezone.now() + datetime.timedelta(days=1),
+        )
+        IdempotencyKey.objects.filter(pk=record.pk).update(
+            created_at=timezone.now() - datetime.timedelta(seconds=seconds_ago))
+
+
+class VectorIndexTests(SimpleTestCase):
+    texts = {
+        'mitochondria': 'Mitochondria produce ATP through cellular respiration',
+        'photosynthesis': 'Chloroplasts turn light into chemical energy by photosynthesis',
+        'osmosis': 'Osmosis moves water across a semipermeable membrane',
+        'mitosis': 'Mitosis splits a cell nucleus into two identical nuclei',
+    }
+
+    def setUp(self):
+        self.embedder = HashingEmbedder()
+        self.index = VectorIndex(self.embedder.dim, self.embedder.name)
+        self.index.add(list(self.texts), self.embedder.embed(list(self.texts.values())))
+
+    def search(self, query: str, index: VectorIndex = None, **kwargs):
+        return [item_id for item_id, _ in (index or self.index).search(self.embedder.embed([query])[0], **kwargs)]
+
+    def test_add_and_search(self):
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(self.search('how do cells make ATP', k=1), ['mitochondria'])
+        self.assertEqual(len(self.search('cells', k=10)), 4)
+
+    def test_add_replaces_existing_ids(self):
+        self.index.add(['osmosis'], self.embedder.embed(['Ribosomes translate messenger RNA into protein']))
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(self.search('ribosomes translate RNA', k=1), ['osmosis'])
+
+    def test_delete_moves_the_last_row_into_the_gap(self):
+        self.index.delete(['photosynthesis', 'unknown'])
+        self.assertEqual(len(self.index), 3)
+        self.assertNotIn('photosynthesis', self.index)
+        # Mitosis was the last row and now sits where photosynthesis was
+        self.assertEqual(self.index._positions['mitosis'], 1)
+        self.assertEqual(self.search('nucleus splits into identical nuclei', k=1), ['mitosis'])
+        self.assertNotIn('photosynthesis', self.search('light energy', k=10))
+
+    def test_search_only_returns_allowed_ids(self):
+        results = self.search('how do cells make ATP', k=3, allowed_ids=['osmosis', 'mitosis', 'unknown'])
+        self.assertEqual(sorted(results), ['mitosis', 'osmosis'])
+
+    def test_saved_index_reloads(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(VECTOR_INDEX_DIR=directory):
+            vector_index._save('course', self.index)
+            self.assertTrue(os.path.isfile(os.path.join(directory, 'course_course.npz')))
+            vector_index._indexes.pop('course')
+            reloaded = vector_index._load('course', self.embedder)
+        self.assertIsNot(reloaded, self.index)
+        self.assertEqual(sorted(reloaded._ids), sorted(self.texts))
+        for query in self.texts.values():
+            self.assertEqual(self.search(query, reloaded, k=1), self.search(query, k=1))
+
+
+@override_settings(QUESTION_BANK_SIZE=3)
+class FillBankTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='owner')
+        course = Course.objects.create(user=user, name='Biology', description='')
+        material = ClassMaterial.objects.create(course=course, file_name='notes.pdf')
+        subject = Subject.objects.create(course=course, name='Cells')
+        self.snippet = MaterialSnippet.objects.create(class_material=material, subject=subject, snippet='Cells divide')
+        self.requests = []
+        self.during_generation = lambda: None
+
+        test = self
+
+        class QuizMaker:
+            def generate_direct(self, data_list, options_per_question):
+                test.requests.append(data_list)
+                test.during_generation()
+                return json.dumps([test.question(len(test.requests), i, item['id']) for i, item in enumerate(data_list)])
+        patcher = mock.patch.object(question_bank, 'QuizMakerRAG', QuizMaker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def question(fill: int, number: int, snippet_id: str) -> dict:
+        words = ' '.join(f'{word}{fill}x{number}' for word in ('alpha', 'beta', 'gamma', 'delta'))
+        return {'snippet_id': snippet_id, 'question': f'Which term matches {words}?',
+                'choices': [f'{choice}{fill}x{number}' for choice in 'abcd'], 'answer_index': 0}
+
+    def bank(self, count: int, fill: int):
+        for number in range(count):
+            question = self.question(fill, number, self.snippet.id)
+            BankQuestion.objects.create(snippet=self.snippet, question=question['question'],
+                                        choices=';;/;;'.join(question['choices']), single_correct_choice=0,
+                                        options_per_question=4,
+                                        fingerprint=question_fingerprint(question['question'], question['choices'][0]))
+
+    def test_fills_up_to_the_bank_size_once(self):
+        self.assertEqual(question_bank.fill_bank([self.snippet.id]), 3)
+        self.assertEqual(len(self.requests[0]), 3)
+        self.assertEqual(question_bank.fill_bank([self.snippet.id]), 0)
+        self.assertEqual(len(self.requests), 1) # Full snippets are not sent to the model
+        self.assertEqual(BankQuestion.objects.filter(snippet=self.snippet).count(), 3)
+
+    def test_only_asks_for_the_missing_questions(self):
+        self.bank(2, fill=0)
+        self.assertEqual(question_bank.fill_bank([self.snippet.id]), 1)
+        self.assertEqual(len(self.requests[0]), 1)
+        self.assertEqual(len(self.requests[0][0]['avoid']), 2)
+
+    def test_recounts_under_lock_after_a_concurrent_fill(self):
+        # Another fill banks two questions while this one is waiting for the model
+        self.during_generation = lambda: self.bank(2, fill=0)
+        self.assertEqual(question_bank.fill_bank([self.snippet.id]), 1)
+        self.assertEqual(BankQuestion.objects.filter(snippet=self.snippet).count(), 3)
+
+    def test_drops_questions_already_banked_by_a_concurrent_fill(self):
+        # The concurrent fill banked the very questions this one generates
+        self.during_generation = lambda: self.bank(1, fill=1)
+        self.assertEqual(question_bank.fill_bank([self.snippet.id]), 2)
+        stems = list(BankQuestion.objects.filter(snippet=self.snippet).values_list('question', flat=True))
+        self.assertEqual(len(stems), len(set(stems)))
+
+
+class ShardedGenerationTests(SimpleTestCase):
+    def setUp(self):
+        for name, value in (('DIRECT_BATCH_QUESTIONS', 5), ('DIRECT_BATCH_TOKENS', 30000), ('SHARD_RETRIES', 2)):
+            patcher = mock.patch.object(rag_question_maker, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Sharding needs no Vertex AI client
+        self.maker = QuizMakerRAG.__new__(QuizMakerRAG)
+        self.maker.debug = False
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def question(snippet_id: str, **fields) -> dict:
+        question = {'snippet_id': snippet_id, 'question': f'What does {snippet_id} say?',
+                    'choices': ['A', 'B', 'C', 'D'], 'answer_index': 0}
+        question.update(fields)
+        return question
+
+    def generate(self, answer):
+        """Shard generator recording every request and answering answer(shard, attempt)"""
+        def generate_shard(shard):
+            ids = [data['id'] for data in shard]
+            with self.lock:
+                attempt = sum(1 for request in self.requests if set(request) & set(ids))
+                self.requests.append(ids)
+            result = answer(shard, attempt)
+            if isinstance(result, Exception):
+                raise result
+            return result if isinstance(result, str) else json.dumps(result)
+        return generate_shard
+
+    def entries(self, count: int):
+        return [{'id': f's{i}', 'snippet': f'Snippet {i}'} for i in range(count)]
+
+    def test_entries_are_sharded_and_merged_in_order(self):
+        generate_shard = self.generate(lambda shard, attempt: [self.question(data['id']) for data in shard])
+        questions = self.maker._generate_sharded(self.entries(12), 4, generate_shard)
+        self.assertEqual([question['snippet_id'] for question in questions], [f's{i}' for i in range(12)])
+        self.assertEqual(sorted(len(request) for request in self.requests), [2, 5, 5])
+
+    def test_entries_of_a_snippet_stay_in_one_shard(self):
+        entries = self.entries(4) + [{'id': 's0', 'snippet': 'Snippet 0'}] * 2
+        generate_shard = self.generate(lambda shard, attempt: [self.question(data['id']) for data in shard])
+        self.maker._generate_sharded(entries, 4, generate_shard)
+        self.assertIn(['s0', 's0', 's0'], [request[:3] for request in self.requests])
+
+    def test_only_missing_or_malformed_questions_are_asked_again(self):
+        def answer(shard, attempt):
+            if attempt == 0:
+                return [self.question('s0'), self.question('s1', choices=['A', 'B']), self.question('unknown')]
+            return [self.question(data['id']) for data in shard]
+        questions = self.maker._generate_sharded(self.entries(3), 4, self.generate(answer))
+        self.assertEqual(self.requests, [['s0', 's1', 's2'], ['s1', 's2']])
+        self.assertEqual(sorted(question['snippet_id'] for question in questions), ['s0', 's1', 's2'])
+
+    def test_failed_attempts_are_retried(self):
+        def answer(shard, attempt):
+            if attempt == 0:
+                return rag_question_maker.GenerationError('model unavailable')
+            if attempt == 1:
+                return 'not json'
+            return [self.question(data['id']) for data in shard]
+        questions = self.maker._generate_sharded(self.entries(2), 4, self.generate(answer))
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual(len(questions), 2)
+
+    def test_shard_giving_up_only_shortens_the_quiz(self):
+        def answer(shard, attempt):
+            if shard[0]['id'] == 's5':
+                return rag_question_maker.GenerationError('model unavailable')
+            return [self.question(data['id']) for data in shard]
+        questions = self.maker._generate_sharded(self.entries(7), 4, self.generate(answer))
+        self.assertEqual([question['snippet_id'] for question in questions], [f's{i}' for i in range(5)])
+        self.assertEqual(sum(1 for request in self.requests if request[0] == 's5'), 3) # 1 + SHARD_RETRIES
+
+    def test_no_question_at_all_fails(self):
+        generate_shard = self.generate(lambda shard, attempt: rag_question_maker.GenerationError('model unavailable'))
+        with self.assertRaises(rag_question_maker.GenerationError):
+            self.maker._generate_sharded(self.entries(3), 4, generate_shard)
+
+
+class QuizStreamTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='streamer')
+        course = Course.objects.create(user=self.user, name='Biology', description='')
+        material = ClassMaterial.objects.create(course=course, file_name='notes.pdf')
+        subject = Subject.objects.create(course=course, name='Cells')
+        self.snippets = [
+            MaterialSnippet.objects.create(class_material=material, subject=subject, snippet=f'Snippet {i}')
+            for i in range(4)
+        ]
+        self.quiz = Quiz.objects.create(user=self.user, course=course, name='Quiz', quiz_length=4,
+                                        generation_mode=GenerationMode.DIRECT)
+        self.shards = []
+
+        test = self
+
+        class QuizMaker:
+            def iter_questions(self, data_list, options_per_question, retrieval_tool=None):
+                for shard in test.shards:
+                    if isinstance(shard, Exception):
+                        raise shard
+                    yield [test.question(data_list[i]['id'], i) for i in shard]
+        patcher = mock.patch.object(quiz_view, 'QuizMakerRAG', QuizMaker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def question(snippet_id: str, number: int) -> dict:
+        return {'snippet_id': snippet_id, 'question': f'Question {number}?', 'choices': ['A', 'B', 'C', 'D'],
+                'answer_index': 0}
+
+    def stream(self, bank_questions=()):
+        """Events of the quiz stream, as (event, data) pairs"""
+        ready_questions = quiz_view.save_questions(self.quiz, list(bank_questions))
+        plan = {'quiz': self.quiz, 'warm': False, 'bank_questions': list(bank_questions),
+                'missing_snippets': self.snippets[len(bank_questions):], 'corpus_name': None,
+                'rag_file_names': {}, 'seen': None}
+        events = []
+        for chunk in quiz_view.QuizViewSet().quiz_events(plan, ready_questions):
+            event, data = chunk.strip().split('\n')
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+        return events
+
+    def test_questions_stream_as_shards_complete(self):
+        self.shards = [[0, 1], [2]]
+        events = self.stream(bank_questions=[self.question(self.snippets[0].id, 9)])
+        self.assertEqual([event for event, _ in events], ['quiz', 'question', 'question', 'question', 'question', 'done'])
+        self.assertEqual(events[1][1]['question'], 'Question 9?') # Bank questions first
+        done = events[-1][1]
+        self.assertEqual((done['quiz_id'], done['question_count'], done['bank_count'], done['generated_count']),
+                         (str(self.quiz.id), 4, 1, 3))
+        self.assertEqual(Question.objects.filter(quiz=self.quiz).count(), 4)
+
+    def test_failure_part_way_keeps_the_questions_streamed(self):
+        self.shards = [[0, 1], rag_question_maker.GenerationError('model unavailable')]
+        events = self.stream()
+        self.assertEqual([event for event, _ in events], ['quiz', 'question', 'question', 'error', 'done'])
+        self.assertEqual(events[-1][1]['question_count'], 2)
+        self.assertTrue(Quiz.objects.filter(pk=self.quiz.pk).exists())
+
+    def test_quiz_without_questions_is_deleted(self):
+        self.shards = [rag_question_maker.GenerationError('model unavailable')]
+        events = self.stream()
+        self.assertEqual([event for event, _ in events], ['quiz', 'error', 'done'])
+        self.assertEqual((events[-1][1]['quiz_id'], events[-1][1]['question_count']), (None, 0))
+        self.assertFalse(Quiz.objects.filter(pk=self.quiz.pk).exists())
+
+
+class RetakeTests(TestCase):
+    choices = ['Nucleus', 'Ribosome', 'Mitochondria', 'Lysosome']
+
+    def test_shuffle_remaps_the_correct_choice(self):
+        for seed in range(20):
+            shuffled, correct_choice = shuffled_choices(self.choices, 2, random.Random(seed))
+            self.assertEqual(sorted(shuffled), sorted(self.choices))
+            self.assertEqual(shuffled[correct_choice], 'Mitochondria')
+
+    def test_shuffle_does_not_change_the_original(self):
+        choices = list(self.choices)
+        shuffled_choices(choices, 0, random.Random(1))
+        self.assertEqual(choices, self.choices)
+
+    def test_retake_copies_questions_without_answers(self):
+        user = User.objects.create_user(username='retaker')
+        course = Course.objects.create(user=user, name='Biology', description='')
+        quiz = Quiz.objects.create(user=user, course=course, name='Quiz', completed_at=timezone.now())
+        for correct_choice in range(4):
+            Question.objects.create(quiz=quiz, question=f'Question {correct_choice}?', type='MULTIPLE_CHOICE',
+                                    choices=';;/;;'.join(self.choices), single_correct_choice=correct_choice,
+                                    attempted_single_choice=0, is_correct=correct_choice == 0)
+
+        retake, questions = create_retake(quiz, random.Random(3))
+        self.assertEqual((retake.retake_of, retake.completed_at), (quiz, None))
+        self.assertEqual(len(questions), 4)
+        originals = {question.question: question for question in Question.objects.filter(quiz=quiz)}
+        for question in Question.objects.filter(quiz=retake):
+            original = originals[question.question]
+            self.assertEqual(question.choices.split(';;/;;')[question.single_correct_choice],
+                             self.choices[original.single_correct_choice])
+            self.assertEqual((question.attempted_single_choice, question.is_correct), (None, None))
+        # The first attempt keeps its answers
+        self.assertEqual(Question.objects.filter(quiz=quiz, is_correct=True).count(), 1)
+
+
+class SpacedRepetitionTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.user = User.objects.create_user(username='reviewer')
+        self.course = Course.objects.create(user=self.user, name='Biology', description='')
+        self.materials = [ClassMaterial.objects.create(course=self.course, file_name=f'notes{i}.pdf') for i in range(2)]
+        subject = Subject.objects.create(course=self.course, name='Cells')
+        self.snippets = [
+            MaterialSnippet.objects.create(class_material=self.materials[i % 2], subject=subject, snippet=f'Snippet {i}')
+            for i in range(4)
+        ]
+
+    def review(self, *answers) -> SnippetReview:
+        review = SnippetReview(ease=2.5)
+        for day, correct in enumerate(answers):
+            schedule_review(review, correct, self.now + datetime.timedelta(days=day))
+        return review
+
+    def test_correct_answers_grow_the_interval(self):
+        self.assertEqual([self.review(*[True] * n).interval_days for n in (1, 2, 3, 4)], [1, 6, 15, 37.5])
+        review = self.review(True, True)
+        self.assertEqual((review.repetitions, review.ease), (2, 2.5))
+        self.assertEqual(review.due_at, self.now + datetime.timedelta(days=1 + 6))
+
+    def test_wrong_answer_restarts_the_interval(self):
+        review = self.review(True, True, True, False)
+        self.assertEqual((review.repetitions, review.lapses, review.interval_days), (0, 1, 1))
+        self.assertAlmostEqual(review.ease, 2.5 - 0.54)
+        self.assertEqual(self.review(*[False] * 5).ease, 1.3)
+
+    def question(self, snippet, is_correct) -> Question:
+        return Question(question='?', type='MULTIPLE_CHOICE', choices='', snippet=snippet, is_correct=is_correct)
+
+    def test_one_review_per_snippet_of_a_quiz(self):
+        reviewed = record_reviews(self.user, self.course.id, [
+            self.question(self.snippets[0], True),
+            self.question(self.snippets[0], False), # Correct only if every answer about it was
+            self.question(self.snippets[1], True),
+            self.question(self.snippets[2], None), # Unanswered
+        ], now=self.now)
+        self.assertEqual(reviewed, 2)
+        reviews = {review.snippet_id: review for review in SnippetReview.objects.filter(user=self.user)}
+        self.assertEqual(set(reviews), {self.snippets[0].id, self.snippets[1].id})
+        self.assertEqual(reviews[self.snippets[0].id].lapses, 1)
+        self.assertEqual(reviews[self.snippets[1].id].repetitions, 1)
+
+        record_reviews(self.user, self.course.id, [self.question(self.snippets[1], True)],
+                       now=self.now + datetime.timedelta(days=1))
+        self.assertEqual(SnippetReview.objects.get(user=self.user, snippet=self.snippets[1]).interval_days, 6)
+
+    def test_due_snippets_most_overdue_first(self):
+        for snippet, days_overdue in zip(self.snippets, (1, 5, 3, -2)):
+            SnippetReview.objects.create(user=self.user, snippet=snippet, course=self.course,
+                                         due_at=self.now - datetime.timedelta(days=days_overdue),
+                                         last_reviewed_at=self.now - datetime.timedelta(days=10))
+        other = User.objects.create_user(username='other')
+        SnippetReview.objects.create(user=other, snippet=self.snippets[3], course=self.course,
+                                     due_at=self.now - datetime.timedelta(days=9), last_reviewed_at=self.now)
+
+        self.assertEqual(due_snippets(self.user, self.course.id, 10, now=self.now),
+                         [self.snippets[1], self.snippets[2], self.snippets[0]])
+        self.assertEqual(due_snippets(self.user, self.course.id, 2, now=self.now), [self.snippets[1], self.snippets[2]])
+        self.assertEqual(due_snippets(self.user, self.course.id, 10, material_ids=[self.materials[0].id], now=self.now),
+                         [self.snippets[2], self.snippets[0]])
+        self.assertEqual(due_snippets(self.user, self.course.id, 0, now=self.now), [])
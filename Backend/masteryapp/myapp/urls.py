@@ -8,6 +8,7 @@ from .views.material_snippet_view import MaterialSnippetViewset
 from .views.question_view import QuestionViewset
 from .views.quiz_view import QuizViewSet
 from .views.subject_view import SubjectViewset
+from .views.llm_usage_view import LLMUsageViewSet
 router = DefaultRouter()
 
 router.register(r'materials', ClassMaterialViewSet, basename='class_material')
@@ -16,6 +17,7 @@ router.register(r'snippets', MaterialSnippetViewset, basename='snippet')
 router.register(r'questions', QuestionViewset, basename='question')
 router.register(r'quizzes', QuizViewSet, basename='quiz')
 router.register(r'subjects', SubjectViewset, basename='subject')
+router.register(r'llm_usage', LLMUsageViewSet, basename='llm_usage')
 
 
 urlpatterns = [
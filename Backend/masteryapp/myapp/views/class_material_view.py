@@ -1,4 +1,5 @@
 import json
+import math
 from rest_framework import viewsets
 
 from ..serializers.material_snippet_serializer import MaterialSnippetSerializer
@@ -24,6 +25,14 @@ from ..serializers.material_snippet_serializer import MaterialSnippetSerializer
 from ..auth_backends import CsrfExemptSessionAuthentication
 from rest_framework.authentication import BasicAuthentication
 from ..gcp.gc_utils import get_pdf_bytes_from_gcs
+from ..gcp.request_context import tag_request
+from ..services.usage import budget_retry_after
+from ..services.course_corpus import schedule_material_indexing, schedule_material_removal
+from ..services.vector_index import schedule_snippet_indexing, schedule_snippet_removal
+from ..services.question_bank import schedule_bank_fill
+from ..services.distractors import schedule_key_term_harvest
+from ..services.idempotency import idempotent
+from ..services.mastery import forget_snippets
 import base64
 
 
@@ -70,6 +79,15 @@ class ClassMaterialViewSet(viewsets.ModelViewSet):
                  
         
     
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        schedule_material_removal(instance)
+        snippet_ids = list(MaterialSnippet.objects.filter(class_material=instance).values_list('id', flat=True))
+        forget_snippets(snippet_ids)
+        instance.delete()
+        schedule_snippet_removal(instance.course_id, snippet_ids)
+    
+    @idempotent('materials.create')
     @transaction.atomic
     def create(self, request, *args, **kwargs):
         print('request.data: ', request.data)
@@ -81,6 +99,13 @@ class ClassMaterialViewSet(viewsets.ModelViewSet):
         print('material_raw: ', material_raw)
         course_id = data['course_id']
         
+        retry_after = budget_retry_after(request.user)
+        if retry_after is not None:
+            return Response({
+                'error' : 'Daily generation budget exhausted.'
+            }, status=status.HTTP_429_TOO_MANY_REQUESTS, headers={'Retry-After': str(retry_after)})
+        tag_request(user_id=request.user.id, course_id=course_id, endpoint='materials.create')
+        
         pdf_file = request.FILES.get('file')
         
         existing_subjects_qs = Subject.objects.filter(course__id=course_id)
@@ -98,6 +123,12 @@ class ClassMaterialViewSet(viewsets.ModelViewSet):
         success = parse_result.get('success', False)
         
         if not success:
+            if parse_result.get('retry_after') is not None:
+                # Vertex circuit is open: the upload can be retried once it recovers
+                return Response({
+                    'error' : 'Material processing is temporarily unavailable. Please retry later.'
+                }, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                headers={'Retry-After': str(math.ceil(parse_result['retry_after']))})
             return Response({
                 'error' : 'Parse method failed'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -138,6 +169,14 @@ class ClassMaterialViewSet(viewsets.ModelViewSet):
                 snippet=snippet
             )
             
+        # Add the snippets to the course corpus used for quizzes, to the local search index and
+        # to the question bank, off the request path
+        new_snippet_ids = list(MaterialSnippet.objects.filter(class_material=new_material).values_list('id', flat=True))
+        schedule_material_indexing(new_material.id)
+        schedule_snippet_indexing(course_id, new_snippet_ids)
+        schedule_bank_fill(new_snippet_ids)
+        schedule_key_term_harvest({existing_subjects[item['subject'].lower()].id for item in all_partitions})
+            
         final_snippets = MaterialSnippet.objects.filter(class_material=new_material)
         final_subjects = Subject.objects.filter(course_id=course_id)
             
@@ -8,6 +8,9 @@ from ..models.course import Course
 from ..serializers.course_serializer import CourseSerializer
 from ..auth_backends import CsrfExemptSessionAuthentication
 from rest_framework.authentication import BasicAuthentication
+from ..services.course_corpus import schedule_corpus_removal
+from ..services.vector_index import schedule_index_removal
+from ..services.warm_quiz import schedule_warm_quiz
 
 
 
@@ -28,6 +31,9 @@ class CourseViewSet(viewsets.ModelViewSet):
         try:
             course = Course.objects.get(pk=id_param)
             serializer = self.get_serializer(course)
+            if course.user_id == request.user.id:
+                # Opening a course usually leads to a quiz: have one ready
+                schedule_warm_quiz(request.user.id, course.id)
             return Response({'course': serializer.data}, status=status.HTTP_200_OK)
         except Course.DoesNotExist:
             return Response({"error": "Course not found"}, status=status.HTTP_404_NOT_FOUND)
@@ -91,6 +97,8 @@ class CourseViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Course not found'}, status=status.HTTP_404_NOT_FOUND)
 
         course.delete()
+        schedule_corpus_removal(course)
+        schedule_index_removal(course.id)
 
         return Response({'message': 'Course deleted successfully'}, status=status.HTTP_200_OK)
     
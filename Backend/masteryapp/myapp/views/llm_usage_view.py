@@ -0,0 +1,34 @@
+import datetime
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.viewsets import ViewSet
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.permissions import IsAdminUser
+from rest_framework.authentication import BasicAuthentication
+
+from ..auth_backends import CsrfExemptSessionAuthentication
+from ..services.usage import usage_summary
+from ..gcp.model_router import get_router
+from ..gcp.circuit_breaker import breakers_snapshot
+
+
+class LLMUsageViewSet(ViewSet):
+    authentication_classes = [CsrfExemptSessionAuthentication, BasicAuthentication]
+    permission_classes = [IsAdminUser]
+
+    @action(detail=False, methods=['get'], url_path='summary')
+    def summary(self, request):
+        try:
+            days = int(request.query_params.get('days', 1))
+        except ValueError:
+            return Response({
+                'error' : 'days must be an integer'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        since = timezone.now() - datetime.timedelta(days=days)
+        return Response({
+            'usage' : usage_summary(since),
+            'router' : get_router().metrics(),
+            'circuits' : breakers_snapshot(),
+        }, status=status.HTTP_200_OK)
@@ -1,3 +1,4 @@
+import uuid
 from rest_framework import generics, status, viewsets
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
@@ -10,6 +11,7 @@ from ..serializers.course_serializer import CourseSerializer
 from ..auth_backends import CsrfExemptSessionAuthentication
 from rest_framework.authentication import BasicAuthentication
 from ..serializers.material_snippet_serializer import MaterialSnippetSerializer
+from ..services.vector_index import search_snippets
 
 
 class MaterialSnippetViewset(viewsets.ModelViewSet):
@@ -37,6 +39,36 @@ class MaterialSnippetViewset(viewsets.ModelViewSet):
         serializer = self.get_serializer(queryset, many=True)
         return Response({'material_snippets': serializer.data}, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=['get'], url_path='search')
+    def search(self, request):
+        course_id = request.query_params.get('course_id')
+        query = request.query_params.get('q', '').strip()
+        if not course_id or not query:
+            return Response({'error': 'Missing required query parameters: course_id, q'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            k = min(int(request.query_params.get('k', 10)), 100)
+        except ValueError:
+            return Response({'error': 'k must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        course = get_object_or_404(Course, pk=course_id, user=request.user)
+
+        allowed_ids = None
+        subject_id = request.query_params.get('subject_id')
+        if subject_id:
+            allowed_ids = MaterialSnippet.objects.filter(
+                class_material__course=course, subject_id=subject_id
+            ).values_list('id', flat=True)
+
+        results = search_snippets(course.id, query, k=k, allowed_ids=allowed_ids)
+        snippets = MaterialSnippet.objects.in_bulk([snippet_id for snippet_id, _ in results])
+        data = []
+        for snippet_id, score in results:
+            snippet = snippets.get(uuid.UUID(snippet_id))
+            if snippet is None:
+                continue # Deleted since it was indexed
+            data.append({**self.get_serializer(snippet).data, 'score': score})
+        return Response({'material_snippets': data}, status=status.HTTP_200_OK)
+
             
     
     
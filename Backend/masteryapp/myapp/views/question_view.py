@@ -47,9 +47,9 @@ class QuestionViewset(viewsets.ModelViewSet):
     def list(self, request, *args, **kwargs):
         quiz_id = request.query_params.get('quiz_id')
         if quiz_id:
-            queryset = Question.objects.filter(quiz_id=quiz_id)
+            queryset = Question.objects.filter(quiz_id=quiz_id, quiz__is_warm=False)
         else:
-            queryset = Question.objects.filter(quiz__user=request.user)
+            queryset = Question.objects.filter(quiz__user=request.user, quiz__is_warm=False)
         serializer = self.get_serializer(queryset, many=True)
         return Response({'questions': serializer.data}, status=status.HTTP_200_OK)
 
@@ -1,5 +1,8 @@
 import json
+import math
+import time
 import random
+import contextvars
 from rest_framework import viewsets
 
 from myapp.auth_backends import CsrfExemptSessionAuthentication
@@ -12,10 +15,10 @@ from rest_framework import generics, status, viewsets
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.decorators import action
-from vertexai.preview.generative_models import GenerativeModel
 from django.db import transaction
         
 from django.utils import timezone
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 
 from ..models.course import Course
@@ -25,13 +28,32 @@ from ..models.material_snippet import MaterialSnippet
 from ..serializers.course_serializer import CourseSerializer
 from ..serializers.question_serializer import QuestionSerializer
 from ..serializers.quiz_serializer import QuizSerializer
-from ..models.quiz import Quiz
+from ..models.quiz import Quiz, GenerationMode
 from rest_framework.authentication import BasicAuthentication
 from ..models.material_snippet import MaterialSnippet
 
 from io import BytesIO
 from pdfminer.high_level import extract_text
 from ..gcp.rag_question_maker import QuizMakerRAG
+from ..gcp.request_context import DeadlineExceeded
+from ..gcp.circuit_breaker import CircuitOpenError
+from ..gcp.model_router import GenerationError
+from ..gcp.request_context import tag_request
+from ..services.usage import budget_retry_after
+from ..services.course_corpus import retrieval_scope
+from ..services.quiz_generation import (
+    resolve_generation_mode, select_snippets, snippet_data_list, setup_retrieval_tool, generate_questions,
+    save_questions,
+)
+from ..services.question_bank import take_from_bank, schedule_bank_fill
+from ..services.warm_quiz import claim_warm_quiz, schedule_warm_quiz
+from ..services.streaming import sse_event, iterate_in_context
+from ..services.fingerprint import SeenQuestions
+from ..services.distractors import distractor_candidates, schedule_distractor_harvest
+from ..services.idempotency import idempotent
+from ..services.retake import create_retake
+from ..services.spaced_repetition import record_reviews
+from ..services.mastery import quiz_answers, update_mastery
 
 MAX_SNIPPET_MASTERY = 7
 
@@ -51,102 +73,47 @@ class QuizViewSet(viewsets.ModelViewSet):
     def list(self, request, *args, **kwargs):
         course_id = request.query_params.get('course_id')
         if course_id:
-            queryset = Quiz.objects.filter(course_id=course_id)
+            queryset = Quiz.objects.filter(course_id=course_id, is_warm=False)
         else:
-            queryset = Quiz.objects.filter(user=request.user)
+            queryset = Quiz.objects.filter(user=request.user, is_warm=False)
         serializer = self.get_serializer(queryset, many=True)
         return Response({'quizzes': serializer.data}, status=status.HTTP_200_OK)
 
     
+    @idempotent('quizzes.create')
     @transaction.atomic
     def create(self, request, *args, **kwargs):
-        data = request.data.copy()
-        data['user'] = request.user.id
-        now = timezone.now()
-        human_date = now.strftime("%d %B")
-        data['name'] = data.get('name', f'{human_date} quiz')
-        serializer = QuizSerializer(data=data)
-        if not serializer.is_valid():
-            return Response({
-                'error' : serializer.errors
-            }, status=status.HTTP_400_BAD_REQUEST)
-            
-        new_quiz: Quiz = serializer.save()
-        
-        if new_quiz.subjects.exists():
-            source_snippets = MaterialSnippet.objects.filter(
-                subject__course=new_quiz.course,
-                subject__in=new_quiz.subjects.all()
-            )
-            new_quiz.optimize_learning = False
-            new_quiz.save()
-            # If going by subject, there's no point checking the mastery of said subject or doing any comparing.
-        elif new_quiz.materials.exists():
-            source_snippets = MaterialSnippet.objects.filter(
-                class_material__in = new_quiz.materials.all()
-            )
-        else:
-            source_snippets = MaterialSnippet.objects.filter(
-                subject__course=new_quiz.course
-            )
-        
-        # By now we have the source snippets.
-        
-        weighted_snippets = []
-        for snippet in source_snippets:
-            subject = snippet.subject
-            mastery = self.compute_mastery_score(subject, request.user)
-            weight = self.compute_weight(mastery)
-            weighted_snippets.append((snippet, weight))
-
-        selected_snippets = random.choices(
-            population=[snip for snip, wt in weighted_snippets],
-            weights=[wt for snip, wt in weighted_snippets],
-            k=new_quiz.quiz_length
-        )
+        plan, error_response = self.plan_quiz(request, endpoint='quizzes.create')
+        if error_response is not None:
+            return error_response
+        new_quiz: Quiz = plan['quiz']
         
-        data_list = []
-        counter = 0
-        for snippet in selected_snippets:
-            counter+=1
-            data_list.append({
-                'id' : str(snippet.id),
-                'snippet' : str(snippet.snippet),
-                'commented_count_helper': counter,
-            })
-        
-        quiz_maker_rag = QuizMakerRAG()
-        corpus_name = quiz_maker_rag.setup_corpus(
-            bucket_name="educatorgenai",
-            data_list=data_list
-        )
-        model: GenerativeModel = quiz_maker_rag.setup_model(corpus_name=corpus_name)
-        model_response = quiz_maker_rag.generate_response(
-            query="",
-            model=model,
-            quiz_length=len(selected_snippets),
-            options_per_question=new_quiz.options_per_question,
-        )
         try:
-            parsed_model_response = json.loads(model_response)
-        except Exception as e:
+            generated_questions = generate_questions(
+                new_quiz, plan['missing_snippets'], plan['corpus_name'], plan['rag_file_names'], plan['seen']
+            )
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            transaction.set_rollback(True)
+            return self.generation_unavailable_response(e)
+        except GenerationError as e:
+            transaction.set_rollback(True)
+            print(f'Error generating quiz questions: {e}')
+            return Response({
+                'error' : 'Quiz generation failed. Please retry.'
+            }, status=status.HTTP_502_BAD_GATEWAY)
+        except ValueError as e:
+            transaction.set_rollback(True)
             return Response(
                 {
                     'error' : f'Parse error of generative models response: {e}'
                 },
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
-        for question_raw in parsed_model_response:
-            new_question = Question.objects.create(
-                quiz_id=new_quiz.id,
-                question=question_raw['question'],
-                choices=';;/;;'.join(question_raw['choices']),
-                type=QuestionType.MULTIPLE_CHOICE.value, # Hard-coded for now.
-                single_correct_choice=question_raw['answer_index'],
-                snippet_id=question_raw['snippet_id'],
-            )
-            
-        final_questions = Question.objects.filter(quiz=new_quiz)
+        
+        if plan['warm']:
+            final_questions = list(Question.objects.filter(quiz=new_quiz))
+        else:
+            final_questions = save_questions(new_quiz, plan['bank_questions'] + generated_questions)
         
         return Response({
             'quiz' : QuizSerializer(new_quiz).data,
@@ -154,6 +121,177 @@ class QuizViewSet(viewsets.ModelViewSet):
         },
                         status=status.HTTP_201_CREATED)
         
+    @action(detail=False, methods=['post'], url_path='stream')
+    def stream(self, request):
+        """Create a quiz and stream it as server-sent events
+        
+        Same input as create. Emits a "quiz" event once the quiz row is committed, a "question"
+        event per question as soon as it is saved (warm or bank questions first, then each
+        generated shard), an "error" event if generation fails part way, and a final "done" summary.
+        """
+        with transaction.atomic():
+            plan, error_response = self.plan_quiz(request, endpoint='quizzes.stream')
+            if error_response is not None:
+                return error_response
+            if plan['warm']:
+                ready_questions = list(Question.objects.filter(quiz=plan['quiz']))
+            else:
+                ready_questions = save_questions(plan['quiz'], plan['bank_questions'])
+        
+        response = StreamingHttpResponse(
+            iterate_in_context(contextvars.copy_context(), self.quiz_events(plan, ready_questions)),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no' # Let proxies pass events through as they come
+        return response
+    
+    def quiz_events(self, plan, ready_questions):
+        new_quiz: Quiz = plan['quiz']
+        start = time.monotonic()
+        yield sse_event('quiz', QuizSerializer(new_quiz).data)
+        for question in ready_questions:
+            yield sse_event('question', QuestionSerializer(question).data)
+        
+        generated_count = 0
+        if plan['missing_snippets'] and new_quiz.generation_mode == GenerationMode.CLOZE:
+            # Built locally in a few milliseconds: no shards to stream
+            try:
+                questions = generate_questions(new_quiz, plan['missing_snippets'])
+            except GenerationError as e:
+                print(f'Error generating quiz questions: {e}')
+                questions = []
+                yield sse_event('error', {
+                    'error' : 'No question could be built from these materials.'
+                })
+            for question in save_questions(new_quiz, questions):
+                generated_count += 1
+                yield sse_event('question', QuestionSerializer(question).data)
+        elif plan['missing_snippets']:
+            quiz_maker_rag = QuizMakerRAG()
+            try:
+                retrieval_tool = None
+                if new_quiz.generation_mode == GenerationMode.RAG:
+                    retrieval_tool = setup_retrieval_tool(
+                        quiz_maker_rag, plan['corpus_name'], plan['rag_file_names'], plan['missing_snippets']
+                    )
+                distractors = distractor_candidates(
+                    {snippet.subject_id for snippet in plan['missing_snippets']}, new_quiz.options_per_question
+                )
+                for shard_questions in quiz_maker_rag.iter_questions(
+                    snippet_data_list(plan['missing_snippets'], plan['seen'], distractors),
+                    new_quiz.options_per_question, retrieval_tool=retrieval_tool,
+                ):
+                    schedule_distractor_harvest(shard_questions)
+                    for question in save_questions(new_quiz, shard_questions):
+                        generated_count += 1
+                        yield sse_event('question', QuestionSerializer(question).data)
+            except (CircuitOpenError, DeadlineExceeded) as e:
+                unavailable = self.generation_unavailable_response(e)
+                yield sse_event('error', dict(unavailable.data, retry_after=unavailable.get('Retry-After')))
+            except Exception as e:
+                print(f'Error generating quiz questions: {e}')
+                yield sse_event('error', {
+                    'error' : 'Quiz generation failed. Please retry.'
+                })
+            schedule_bank_fill({snippet.id for snippet in plan['missing_snippets']})
+        
+        question_count = len(ready_questions) + generated_count
+        if question_count == 0:
+            new_quiz.delete()
+        yield sse_event('done', {
+            'quiz_id' : str(new_quiz.id) if question_count else None,
+            'question_count' : question_count,
+            'requested_count' : new_quiz.quiz_length,
+            'warm' : plan['warm'],
+            'bank_count' : len(plan['bank_questions']),
+            'generated_count' : generated_count,
+            'elapsed_ms' : int((time.monotonic() - start) * 1000),
+        })
+    
+    def plan_quiz(self, request, endpoint):
+        """Validate a quiz request and save the quiz, or claim the user's matching warm quiz
+        
+        Returns:
+            Tuple of the plan (quiz, whether it was warm, bank questions, snippets left to generate,
+            retrieval scope, questions the user has seen) and an error response, exactly one being None
+        """
+        # Cloze quizzes make no model call, so they stay available once the budget is spent
+        retry_after = budget_retry_after(request.user)
+        if retry_after is not None and request.data.get('generation_mode') != GenerationMode.CLOZE:
+            return None, Response({
+                'error' : 'Daily generation budget exhausted.'
+            }, status=status.HTTP_429_TOO_MANY_REQUESTS, headers={'Retry-After': str(retry_after)})
+        
+        data = request.data.copy()
+        data['user'] = request.user.id
+        tag_request(user_id=request.user.id, endpoint=endpoint)
+        now = timezone.now()
+        human_date = now.strftime("%d %B")
+        data['name'] = data.get('name', f'{human_date} quiz')
+        serializer = QuizSerializer(data=data)
+        if not serializer.is_valid():
+            return None, Response({
+                'error' : serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+        # Usage is only attributed to a course once it is known to exist
+        tag_request(course_id=serializer.validated_data['course'].id)
+        
+        warm_quiz = claim_warm_quiz(request.user, serializer.validated_data)
+        if warm_quiz is not None:
+            return {
+                'quiz' : warm_quiz,
+                'warm' : True,
+                'bank_questions' : [],
+                'missing_snippets' : [],
+                'corpus_name' : None,
+                'rag_file_names' : {},
+                'seen' : None,
+            }, None
+        
+        generation_mode = resolve_generation_mode(
+            serializer.validated_data.get('generation_mode'),
+            serializer.validated_data.get('quiz_length', Quiz._meta.get_field('quiz_length').default),
+        )
+        corpus_name, rag_file_names = None, {}
+        if generation_mode == GenerationMode.RAG:
+            # The course corpus is long-lived; this only indexes materials that are not in it yet.
+            # Done before saving the quiz, as indexing updates the course row the quiz references.
+            course = serializer.validated_data['course']
+            try:
+                corpus_name, rag_file_names = retrieval_scope(
+                    course.id, ClassMaterial.objects.filter(course=course).values_list('id', flat=True)
+                )
+            except (CircuitOpenError, DeadlineExceeded) as e:
+                return None, self.generation_unavailable_response(e)
+            except Exception as e:
+                print(f'Error indexing course materials: {e}')
+                return None, Response({
+                    'error' : 'Could not set up the retrieval corpus for this course.'
+                }, status=status.HTTP_502_BAD_GATEWAY)
+            
+        new_quiz: Quiz = serializer.save(generation_mode=generation_mode)
+        selected_snippets = select_snippets(new_quiz)
+        
+        # Questions come from the pre-generated bank, unseen ones first; only snippets it cannot
+        # answer are generated live, told which questions the user already had about them
+        seen = None
+        if generation_mode == GenerationMode.CLOZE:
+            bank_questions, missing_snippets = [], selected_snippets
+        else:
+            seen = SeenQuestions.for_course(request.user, new_quiz.course_id)
+            bank_questions, missing_snippets = take_from_bank(selected_snippets, new_quiz.options_per_question, seen)
+        
+        return {
+            'quiz' : new_quiz,
+            'warm' : False,
+            'bank_questions' : bank_questions,
+            'missing_snippets' : missing_snippets,
+            'corpus_name' : corpus_name,
+            'rag_file_names' : rag_file_names,
+            'seen' : seen,
+        }, None
+        
         
     @transaction.atomic
     @action(detail=True, methods=['patch'], url_path='submit')
@@ -163,7 +301,9 @@ class QuizViewSet(viewsets.ModelViewSet):
                 'error' : 'Tried to submit a quiz without providing quiz ID'
             }, status=status.HTTP_400_BAD_REQUEST)  # status.DUMBASS
         
-        target_quiz: Quiz = get_object_or_404(Quiz, pk=pk)
+        # Only the owner's answers count towards their reviews and mastery. Locked so concurrent
+        # submissions of the same quiz apply one after the other
+        target_quiz: Quiz = get_object_or_404(Quiz.objects.select_for_update(), pk=pk, user=request.user, is_warm=False)
         
         data = self.request.data.copy()
         
@@ -174,8 +314,11 @@ class QuizViewSet(viewsets.ModelViewSet):
                 'error' : 'Cannot submit quiz without providing related question.s final form.'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        quiz_questions = Question.objects.filter(quiz=target_quiz).all()
+        quiz_questions = list(Question.objects.filter(quiz=target_quiz))
         quiz_questions_dict = {str(question.id): question for question in quiz_questions}
+        # Answers of an earlier submission are replaced
+        previous_answers = quiz_answers(quiz_questions, target_quiz.completed_at)
+        first_submission = target_quiz.completed_at is None
         
         if len(submitted_questions) != len(quiz_questions):
             return Response({
@@ -192,45 +335,66 @@ class QuizViewSet(viewsets.ModelViewSet):
             question: Question = quiz_questions_dict[submit_question['id']]
             question.attempted_single_choice = attempted_answer
             question.is_correct = int(attempted_answer) == question.single_correct_choice
-            question.save()
         
+        # One UPDATE for all the answers, writing only the graded fields
+        Question.objects.bulk_update(quiz_questions, ['attempted_single_choice', 'is_correct'])
         target_quiz.completed_at = timezone.now()
-        target_quiz.save()
-        
-        final_questions = Question.objects.filter(quiz=target_quiz)
+        target_quiz.save(update_fields=['completed_at'])
+        if first_submission:
+            # A resubmission corrects answers, it is not another review of the snippets
+            record_reviews(request.user, target_quiz.course_id, quiz_questions, target_quiz.completed_at)
+        update_mastery(
+            request.user, removed=previous_answers, added=quiz_answers(quiz_questions, target_quiz.completed_at),
+            now=target_quiz.completed_at,
+        )
+        # The user most likely starts another quiz next: prepare it with the updated mastery
+        schedule_warm_quiz(request.user.id, target_quiz.course_id)
         
         return Response({
             'quiz' : QuizSerializer(target_quiz).data,
-            'questions' : QuestionSerializer(final_questions, many=True).data
+            'questions' : QuestionSerializer(quiz_questions, many=True).data
         }, status=status.HTTP_200_OK)
             
         
         
-    def compute_mastery_score(self, subject, user):
-        # Retrieve questions for this user and subject.
-        questions = Question.objects.filter(quiz__user=user, snippet__subject=subject)
-        mastery = 0.0
-        now = timezone.now()
-        
-        for question in questions:
-            if question.is_correct is None:
-                continue # Unanswered question
-            # If question is answered, it's quiz has a completed_at date.
-            days_since = (now - question.quiz.completed_at).days
-            degradation = max(0, 1 - (0.01 * days_since))
-            if question.is_correct:
-                mastery += degradation
-            else:
-                mastery -= degradation
-        return mastery
-    
-    def compute_weight(self, mastery):
-        # but if mastery is negative, we further add the weight: weight = 1 + abs(mastery).
-        # maybe the weighing is to be reworked.
-        if mastery >= 0:
-            return 1 / (1 + mastery)
-        else:
-            return 1 + abs(mastery)
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        answers = quiz_answers(Question.objects.filter(quiz=instance), instance.completed_at)
+        instance.delete()
+        # Its answers no longer count towards the stored mastery
+        update_mastery(instance.user, removed=answers)
 
+    @idempotent('quizzes.retake')
+    @transaction.atomic
+    @action(detail=True, methods=['post'], url_path='retake')
+    def retake(self, request, pk=None):
+        """Start a new attempt of a completed quiz with the same questions, choices reshuffled
 
-            
+        No generation is involved. The completed attempt keeps its answers, so mastery counts
+        both attempts.
+        """
+        target_quiz: Quiz = get_object_or_404(Quiz, pk=pk, user=request.user, is_warm=False)
+        if target_quiz.completed_at is None:
+            return Response({
+                'error' : 'Only a completed quiz can be retaken.'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        tag_request(user_id=request.user.id, course_id=target_quiz.course_id, endpoint='quizzes.retake')
+        quiz, questions = create_retake(target_quiz)
+
+        return Response({
+            'quiz' : QuizSerializer(quiz).data,
+            'questions' : QuestionSerializer(questions, many=True).data
+        }, status=status.HTTP_201_CREATED)
+
+
+    def generation_unavailable_response(self, error):
+        if isinstance(error, CircuitOpenError):
+            # Vertex is failing or too slow: fail fast and tell the client when to come back
+            return Response({
+                'error' : 'Quiz generation is temporarily unavailable. Please retry later.'
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={'Retry-After': str(math.ceil(error.retry_after))})
+        return Response({
+            'error' : 'Quiz generation did not finish before the request deadline.'
+        }, status=status.HTTP_504_GATEWAY_TIMEOUT)
@@ -19,6 +19,7 @@ from ..models.material_snippet import MaterialSnippet
 from ..serializers.course_serializer import CourseSerializer
 from ..gcp.stt_generator import get_command_from_bytes
 from ..gcp.tts_generator import text_to_speech_bytes
+from ..gcp.request_context import tag_request
 from io import BytesIO
 from pdfminer.high_level import extract_text
 
@@ -27,6 +28,7 @@ class SpeechView(ViewSet):
     @action(detail=False, methods=['post'], url_path='send_instruction')
     def send_instruction(self, request):
         audio_bytes = request.FILES.get('audio')
+        tag_request(user_id=request.user.id, endpoint='speech.send_instruction')
         all_courses = Course.objects.filter(user=request.user).all()
         all_material = ClassMaterial.objects.filter(course__user = request.user).all()
         all_courses_dict = {course.name: course for course in all_courses}